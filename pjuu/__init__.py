@@ -20,6 +20,9 @@ import sentry_sdk
 from sentry_sdk.integrations.flask import FlaskIntegration
 
 from pjuu.configurator import load as load_config
+from pjuu.lib import keys as k
+from pjuu.lib.cache import DocumentCache
+from pjuu.lib.scripts import Scripts
 from pjuu.lib.sessions import RedisSessionInterface
 from pjuu.lib.storage import Storage
 
@@ -40,6 +43,15 @@ mongo = PyMongo()
 # redis_sessions is only used by Flask for sessions
 redis = Redis()
 redis_sessions = Redis()
+# Lua scripts which run inside the _MAIN_ redis
+scripts = Scripts()
+# Read-through cache of post documents
+post_cache = DocumentCache('posts', k.POST_CACHE, k.POST_CACHE_STATS,
+                           'POST_CACHE', counted=True)
+# The parts of a user shown next to their posts
+author_cache = DocumentCache('users', k.AUTHOR_CACHE, k.AUTHOR_CACHE_STATS,
+                             'AUTHOR_CACHE',
+                             ('username', 'avatar', 'donated', 'active'))
 
 # Storage subsystem
 storage = Storage()
@@ -101,6 +113,13 @@ def create_app(config_dict=None):
     # This is the _MAIN_ redis client. ONLY STORE DATA HERE
     redis.init_app(app)
 
+    # Load our Lua scripts in to Redis
+    scripts.init_app(app, redis)
+
+    # Post cache, uses MongoDB and the _MAIN_ redis
+    post_cache.init_app(app, mongo, redis)
+    author_cache.init_app(app, mongo, redis)
+
     # Create Flask-Mail
     mail.init_app(app)
 
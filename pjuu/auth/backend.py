@@ -16,10 +16,12 @@ from pymongo.errors import DuplicateKeyError
 from werkzeug.security import (generate_password_hash as generate_password,
                                check_password_hash as check_password)
 # Pjuu imports
-from pjuu import mongo as m, redis as r, storage
-from pjuu.auth.utils import get_user
+from pjuu import author_cache, mongo as m, redis as r, storage
+from pjuu.auth.utils import forget_user, get_user, update_user
 from pjuu.lib import keys as k, timestamp, get_uuid
-from pjuu.posts.backend import delete_post
+from pjuu.lib.counters import delete_counters
+from pjuu.lib.leaderboard import add_user, remove_user
+from pjuu.posts.backend import delete_post, touch_feed
 
 
 # Username & E-mail checker re patterns
@@ -120,6 +122,8 @@ def create_account(username, email, password):
             # Insert the new user in to Mongo. If this fails a None will be
             # returned
             result = m.db.users.insert(user)
+            if result:
+                add_user(uid)
             return uid if result else None
     except DuplicateKeyError:  # pragma: no cover
         # Oh no something went wrong. Pass over it. A None will be returned.
@@ -212,7 +216,9 @@ def signin(user_id):
     """
     session['user_id'] = user_id
     # update last login
-    m.db.users.update({'_id': user_id}, {'$set': {'last_login': timestamp()}})
+    update_user(user_id, {'$set': {'last_login': timestamp()}})
+    # Bring the users feed back if they have been away
+    touch_feed(user_id)
 
 
 def signout():
@@ -226,10 +232,12 @@ def activate(user_id, action=True):
     """Activates a user account and removes 'ttl' key from Mongo
 
     """
-    return m.db.users.update(
-        {'_id': user_id},
+    result = update_user(
+        user_id,
         {'$set': {'active': action}, '$unset': {'ttl': None}}
     ).get('updatedExisting')
+    author_cache.invalidate(user_id)
+    return result
 
 
 def ban(user_id, action=True):
@@ -237,10 +245,25 @@ def ban(user_id, action=True):
 
     By passing False as action this will unban the user
     """
-    return m.db.users.update(
-        {'_id': user_id},
+    result = update_user(
+        user_id,
         {'$set': {'banned': action}}
     ).get('updatedExisting')
+    author_cache.invalidate(user_id)
+    return result
+
+
+def donated(user_id, action=True):
+    """Mark a user as having donated, they get a badge next to their name.
+
+    By passing False as action this will remove the badge
+    """
+    result = update_user(
+        user_id,
+        {'$set': {'donated': action}}
+    ).get('updatedExisting')
+    author_cache.invalidate(user_id)
+    return result
 
 
 def bite(user_id, action=True):
@@ -248,8 +271,8 @@ def bite(user_id, action=True):
 
     By passing False as action this will unbite the user
     """
-    return m.db.users.update(
-        {'_id': user_id},
+    return update_user(
+        user_id,
         {'$set': {'op': action}}
     ).get('updatedExisting')
 
@@ -260,8 +283,8 @@ def mute(user_id, action=True):
 
     By passing False as action this will un-mute the user
     """
-    return m.db.users.update(
-        {'_id': user_id},
+    return update_user(
+        user_id,
         {'$set': {'muted': action}}
     ).get('updatedExisting')
 
@@ -279,8 +302,7 @@ def change_password(user_id, password):
                                  method='pbkdf2:sha256:2000',
                                  salt_length=20)
 
-    return m.db.users.update({'_id': user_id},
-                             {'$set': {'password': password}})
+    return update_user(user_id, {'$set': {'password': password}})
 
 
 def change_email(user_id, new_email):
@@ -290,8 +312,7 @@ def change_email(user_id, new_email):
     This function is unsafe and provides NO sanity checking.
 
     """
-    return m.db.users.update({'_id': user_id},
-                             {'$set': {'email': new_email.lower()}})
+    return update_user(user_id, {'$set': {'email': new_email.lower()}})
 
 
 def delete_account(user_id):
@@ -311,6 +332,10 @@ def delete_account(user_id):
 
     # Delete the user from MongoDB
     m.db.users.remove({'_id': user_id})
+    forget_user(user_id)
+    author_cache.invalidate(user_id)
+    remove_user(user_id)
+    delete_counters('users', user_id)
 
     # If the user has an avatar remove it
     if user.get('avatar'):
@@ -344,18 +369,23 @@ def delete_account(user_id):
     followee_cursor = r.zrange(k.USER_FOLLOWING.format(user_id), 0, -1)
 
     for followee_id in followee_cursor:
-        # Clear the followers list of people uid is following
+        # Clear the followers and approved lists of people uid is following.
+        # Only followers can be approved.
         r.zrem(k.USER_FOLLOWERS.format(followee_id), user_id)
-    # Delete the following list
+        r.zrem(k.USER_APPROVED.format(followee_id), user_id)
+    # Delete the following and approved lists
     r.delete(k.USER_FOLLOWING.format(user_id))
+    r.delete(k.USER_APPROVED.format(user_id))
 
     # Delete the users feed, this may have been added too during this process.
     # Probably not but let's be on the safe side
     r.delete(k.USER_FEED.format(user_id))
+    r.zrem(k.USERS_LAST_SEEN, user_id)
 
     # Delete the users alert list
     # DO NOT DELETE ANY ALERTS AS THESE ARE GENERIC
     r.delete(k.USER_ALERTS.format(user_id))
+    r.delete(k.USER_ALERTS_UNREAD.format(user_id))
 
     # All done. This code may need making SAFER in case there are issues
     # elsewhere in the code base.
@@ -10,7 +10,7 @@
 from flask import url_for
 import pymongo
 
-from pjuu import mongo as m
+from pjuu import author_cache, mongo as m
 
 
 def get_stats():
@@ -44,6 +44,8 @@ def get_stats():
         )
         newest_users.append(link)
 
+    cache_stats = author_cache.get_stats()
+
     return [
         ('Total users', total_users),
         ('Total active users', total_active),
@@ -51,4 +53,9 @@ def get_stats():
         ('Total muted users', total_muted),
         ('Total OP users', total_op),
         ('Newest users', newest_users),
+        ('Author cache hits (process/Redis)', '{0}/{1}'.format(
+            cache_stats.get('local_hits'), cache_stats.get('redis_hits'))),
+        ('Author cache misses', cache_stats.get('misses')),
+        ('Author cache hit rate',
+         '{0:.1%}'.format(cache_stats.get('hit_rate')))
     ]
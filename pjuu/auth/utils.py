@@ -8,8 +8,198 @@ circular imports.
 
 """
 
+# Stdlib imports
+import json
+# 3rd party imports
+from flask import current_app as app, g, has_app_context
+# Pjuu imports
+from pjuu import author_cache, mongo as m, redis as r
+from pjuu.lib import keys as k
+from pjuu.lib.counters import apply_counters
 
-from pjuu import mongo as m
+
+# Fields of the signed in user which are not needed on every request. Views
+# which need them (e.g. `about` on the settings page) have to load them.
+SESSION_USER_EXCLUDE = ('password', 'about', 'ttl')
+
+
+class IdentityMap(object):
+    """Holds every user document loaded during a request so each user is only
+    fetched from MongoDB once.
+
+    Users which are expected to be needed can be queued with `prefetch`,
+    they are all loaded with a single `$in` query the next time a user is
+    not in the map.
+
+    `queries` counts the trips made to MongoDB and `saved` the trips the map
+    made unnecessary.
+
+    """
+
+    def __init__(self):
+        self.users = {}
+        # `(field, value)` of a unique field to the `_id` of the user
+        self.uids = {}
+        self.pending = set()
+        self.queries = 0
+        self.saved = 0
+
+    def add(self, user_id, user):
+        self.users[user_id] = user
+        if user is not None:
+            self.uids[('username', user.get('username'))] = user_id
+            self.uids[('email', user.get('email'))] = user_id
+
+    def prefetch(self, user_ids):
+        """Queue `user_ids` to be loaded with the next lookup."""
+        self.pending.update(user_id for user_id in user_ids
+                            if user_id not in self.users)
+
+    def get(self, user_id):
+        """Returns the user with `user_id` or None."""
+        if user_id in self.users:
+            self.saved += 1
+            return self.users[user_id]
+
+        user_ids = self.pending | {user_id}
+        self.pending = set()
+
+        self.queries += 1
+        users = dict((user.get('_id'), user) for user in
+                     m.db.users.find({'_id': {'$in': list(user_ids)}}))
+
+        for _id in user_ids:
+            self.add(_id, users.get(_id))
+
+        return self.users[user_id]
+
+    def find(self, field, value):
+        """Returns the user where the unique `field` is `value` or None."""
+        key = (field, value)
+        if key in self.uids:
+            self.saved += 1
+            user_id = self.uids[key]
+            return self.users.get(user_id) if user_id is not None else None
+
+        self.queries += 1
+        user = m.db.users.find_one({field: value})
+
+        if user is not None:
+            self.add(user.get('_id'), user)
+        else:
+            self.uids[key] = None
+
+        return user
+
+    def forget(self, user_id):
+        """Drop `user_id` from the map. Call after the user has changed."""
+        user = self.users.pop(user_id, None)
+        if user is not None:
+            self.uids.pop(('username', user.get('username')), None)
+            self.uids.pop(('email', user.get('email')), None)
+
+        # Lookups for users which did not exist may now find this user
+        self.uids = dict((key, value) for key, value in self.uids.items()
+                         if value is not None)
+
+
+def get_identity_map():
+    """Returns the identity map for the current request or None if we are not
+    inside of one.
+
+    """
+    if not has_app_context():
+        return None
+    return g.get('identity_map')
+
+
+def prefetch_users(user_ids):
+    """Let the identity map know `user_ids` are about to be needed so they can
+    all be loaded with one query.
+
+    """
+    identity_map = get_identity_map()
+    if identity_map is not None:
+        identity_map.prefetch(user_ids)
+
+
+def forget_user(user_id):
+    """Drop a changed user from the identity map and bump their version so
+    the cached copy of the signed in user is not used again. Call this after
+    every write to a user document.
+
+    """
+    identity_map = get_identity_map()
+    if identity_map is not None:
+        identity_map.forget(user_id)
+
+    r.incr(k.USER_VERSION.format(user_id))
+
+
+def get_session_user(user_id):
+    """Get the signed in user for the current request.
+
+    The user is loaded without `SESSION_USER_EXCLUDE` and kept in Redis for
+    ``SESSION_USER_TTL`` seconds along with the users version at the time.
+    The copy is only used while the version has not changed, `forget_user`
+    changes it on every write so a ban takes effect on the next request.
+    Counter changes not yet written to MongoDB are added as in `get_user`.
+
+    :param user_id: The user_id of the signed in user
+    :type user_id: str
+    :returns: The user as a dict
+    :rtype: dict or None
+
+    """
+    ttl = app.config.get('SESSION_USER_TTL', 30)
+    cache_key = k.USER_SESSION.format(user_id)
+
+    # The version has to be read before MongoDB so a change made while the
+    # user is loaded leaves the copy out of date.
+    pipe = r.pipeline(transaction=False)
+    pipe.get(k.USER_VERSION.format(user_id))
+    pipe.get(cache_key)
+    version, cached = pipe.execute()
+    version = int(version or 0)
+
+    user = None
+    if ttl and cached is not None:
+        cached = json.loads(cached)
+        if cached.get('version') == version:
+            user = cached.get('user')
+
+    if user is None:
+        user = m.db.users.find_one({'_id': user_id}, dict(
+            (field, False) for field in SESSION_USER_EXCLUDE))
+
+        if ttl and user is not None:
+            r.setex(cache_key, ttl, json.dumps({'version': version,
+                                                'user': user}))
+
+    # The copy is of MongoDB, add the counter changes still waiting
+    return apply_counters('users', [user])[0]
+
+
+def update_user(user_id, update):
+    """Apply the MongoDB `update` to the user with `user_id` and drop them from
+    the identity map.
+
+    :returns: The result of the update
+
+    """
+    result = m.db.users.update({'_id': user_id}, update)
+    forget_user(user_id)
+    return result
+
+
+def find_user(field, value):
+    """Returns a copy of the user with the unique `field` set to `value`."""
+    identity_map = get_identity_map()
+    if identity_map is None:
+        return m.db.users.find_one({field: value})
+
+    user = identity_map.find(field, value)
+    return dict(user) if user is not None else None
 
 
 def get_uid_username(username, non_active=False):
@@ -23,17 +213,9 @@ def get_uid_username(username, non_active=False):
     :rtype: str or None
 
     """
-    # Will return the user object with on the _id (user_id) field
-    query_dict = {
-        'username': username.lower()
-    }
-
-    if not non_active:
-        query_dict['active'] = True
-
-    user = m.db.users.find_one(query_dict, {})
+    user = find_user('username', username.lower())
 
-    if user is not None:
+    if user is not None and (non_active or user.get('active')):
         return user.get('_id')
 
     return None
@@ -50,18 +232,10 @@ def get_uid_email(email, non_active=False):
     :rtype: str or None
 
     """
-    query_dict = {
-        'email': email.lower()
-    }
+    user = find_user('email', email.lower())
 
-    if not non_active:
-        query_dict['active'] = True
-
-    # Look up the email inside mongo
-    uid = m.db.users.find_one(query_dict, {})
-
-    if uid is not None:
-        return uid.get('_id')
+    if user is not None and (non_active or user.get('active')):
+        return user.get('_id')
 
     return None
 
@@ -85,7 +259,8 @@ def get_uid(lookup_value, non_active=False):
 
 
 def get_user(user_id):
-    """Get user with `user_id` as `dict`.
+    """Get user with `user_id` as `dict`. Counter changes not yet written to
+    MongoDB are added.
 
     :param user_id: The user_id to get
     :type user_id: str
@@ -93,4 +268,61 @@ def get_user(user_id):
     :rtype: dict or None
 
     """
-    return m.db.users.find_one({'_id': user_id})
+    identity_map = get_identity_map()
+    if identity_map is None:
+        user = m.db.users.find_one({'_id': user_id})
+    else:
+        user = identity_map.get(user_id)
+        user = dict(user) if user is not None else None
+
+    return apply_counters('users', [user])[0]
+
+
+def get_users(user_ids):
+    """Get the users with `user_ids` with a single query.
+
+    :param user_ids: The user_ids to get
+    :type user_ids: list
+    :returns: The users as dicts in the order of `user_ids`. Users which do
+              not exist are left out.
+    :rtype: list
+
+    """
+    identity_map = get_identity_map()
+    if identity_map is None:
+        users = dict((user.get('_id'), user) for user in
+                     m.db.users.find({'_id': {'$in': list(set(user_ids))}}))
+    else:
+        identity_map.prefetch(user_ids)
+        users = dict((user_id, identity_map.get(user_id))
+                     for user_id in set(user_ids))
+
+    return [dict(users[user_id]) for user_id in user_ids
+            if users.get(user_id) is not None]
+
+
+def hydrate_authors(posts):
+    """Add the `user_avatar` and `user_donated` of each posts author to the
+    post. The authors come from the author card cache, at most one trip to
+    Redis and one query to MongoDB. Counter changes not yet written to
+    MongoDB are added in the same way as `get_post`.
+
+    :param posts: The posts (or replies) to add the authors to
+    :type posts: list
+    :returns: The posts in the same order. Posts who's author no longer
+              exists are left out.
+    :rtype: list
+
+    """
+    users = author_cache.get_many(
+        list(set(post.get('user_id') for post in posts)))
+
+    hydrated = []
+    for post in posts:
+        user = users.get(post.get('user_id'))
+        if user is not None:
+            post['user_avatar'] = user.get('avatar')
+            post['user_donated'] = user.get('donated', False)
+            hydrated.append(post)
+
+    return apply_counters('posts', hydrated)
@@ -23,7 +23,7 @@ from pjuu.auth.backend import (
     change_email as be_change_email, delete_account as be_delete_account,
     dump_account as be_dump_account
 )
-from pjuu.auth.utils import get_uid, get_user
+from pjuu.auth.utils import IdentityMap, get_session_user, get_uid, get_user
 from pjuu.auth.decorators import anonymous_required, login_required
 from pjuu.auth.forms import (
     ForgotForm, SignInForm, ResetForm, SignUpForm, ChangeEmailForm,
@@ -34,6 +34,22 @@ from pjuu.auth.forms import (
 auth_bp = Blueprint('auth', __name__)
 
 
+@auth_bp.before_app_request
+def _open_identity_map():
+    """Every request gets its own identity map so a user document is only
+    loaded once per request. See `pjuu.auth.utils.IdentityMap`.
+
+    .. note: This has to be the first thing to run on a request.
+    """
+    g.identity_map = IdentityMap()
+
+
+@auth_bp.teardown_app_request
+def _close_identity_map(exception=None):
+    """Nothing in the identity map can outlive the request."""
+    g.pop('identity_map', None)
+
+
 @auth_bp.before_app_request
 def _load_user():
     """Get the currently logged in user as a `dict` and store on the
@@ -42,8 +58,8 @@ def _load_user():
     """
     user = None
     if 'user_id' in session:
-        # Fetch the user object from MongoDB
-        user = get_user(session.get('user_id'))
+        # Fetch the user object from the cache or MongoDB
+        user = get_session_user(session.get('user_id'))
         # Remove the uid from the session if the user is not logged in
         if not user:
             session.pop('user_id', None)
@@ -77,6 +93,19 @@ def inject_token_header(response):
     return response
 
 
+@auth_bp.after_app_request
+def inject_identity_map_header(response):
+    """In debug mode show how many trips to MongoDB for users the identity
+    map made and how many it saved as the header X-Pjuu-User-Queries.
+
+    """
+    identity_map = g.get('identity_map')
+    if app.debug and identity_map is not None:
+        response.headers['X-Pjuu-User-Queries'] = '{0} made, {1} saved'.format(
+            identity_map.queries, identity_map.saved)
+    return response
+
+
 @auth_bp.app_context_processor
 def inject_user():
     """Injects `current_user` into the Jinja environment
@@ -9,6 +9,27 @@ For an example of how alerts are used look in users.backend and
 posts.backend. Posts especially as this extends the alert object for its
 own purposes.
 
+Alerts are stored as Redis hashes. Each alert type is registered with a short
+code using `register_alert` and lists the attributes it stores in `fields`,
+the hash holds the format version, the type code and these fields. Renaming
+or moving an alert class does not affect stored alerts, changing its code or
+fields does.
+
+Alerts also store the data they need to be displayed, such as usernames, in
+`captured` when it is known as they are created. These are optional so
+alerts stored without them are still read, they are looked up instead.
+
+Links are built from the stored fields with `alert_link`, which only calls
+`url_for` once per kind of link in a request.
+
+Alerts with an `aggregate_key` are merged. For ``ALERT_AGGREGATE_WINDOW``
+seconds after one is created any alert with the same key updates it rather
+than creating another, "Alice and 12 others commented on...". Users already
+alerted have it moved to the top of their alerts.
+
+Alerts stored by older versions as jsonpickle blobs can still be read, run
+``scripts/migrate_alerts.py`` to convert them.
+
 :license: AGPL v3, see LICENSE for more details
 :copyright: 2014-2023 Joe Doherty
 
@@ -16,26 +37,152 @@ own purposes.
 
 # Stdlib imports
 from collections.abc import Iterable
+from urllib.parse import quote
 # 3rd party imports
+from flask import current_app as app, g, url_for
 import jsonpickle
 from werkzeug.utils import cached_property
 # Pjuu imports
-from pjuu import redis as r
-from pjuu.auth.utils import get_user as be_get_user
+from pjuu import celery, redis as r, scripts
+from pjuu.auth.utils import get_user as be_get_user, get_users
 from pjuu.lib import keys as k, timestamp, get_uuid
 
 
+# Bump this when the layout of the stored hash changes
+ALERT_FORMAT_VERSION = 1
+
+# Type code to alert class
+ALERT_TYPES = {}
+
+
+def register_alert(code):
+    """Class decorator which registers an alert class under the type `code`.
+    Codes are stored with every alert so must never be reused.
+
+    """
+    def decorator(cls):
+        if code in ALERT_TYPES:
+            raise ValueError('alert type {} is already registered'.format(
+                code))
+        cls.type_code = code
+        ALERT_TYPES[code] = cls
+        return cls
+    return decorator
+
+
+def encode_alert(alert):
+    """Returns `alert` as a `dict` to be stored as a Redis hash."""
+    if ALERT_TYPES.get(getattr(alert, 'type_code', None)) is not type(alert):
+        raise ValueError('{} is not a registered alert type'.format(
+            type(alert).__name__))
+
+    data = {
+        '_v': ALERT_FORMAT_VERSION,
+        '_t': alert.type_code,
+        'alert_id': alert.alert_id,
+        'timestamp': repr(alert.timestamp),
+        'user_id': alert.user_id,
+    }
+    for field in alert.fields:
+        data[field] = getattr(alert, field)
+    # Only store what was captured, this must not cause any look ups
+    for field in alert.captured:
+        data[field] = alert.__dict__.get(field)
+    # Redis can not store None, missing values are read back as None. Alerts
+    # about users who have gone are removed by `verify` when they are read.
+    return dict((field, value) for field, value in data.items()
+                if value is not None)
+
+
+def decode_alert(data):
+    """Returns the alert stored in the hash `data` or None if it can not be
+    decoded.
+
+    """
+    try:
+        if int(data.get('_v', 0)) != ALERT_FORMAT_VERSION:
+            return None
+
+        cls = ALERT_TYPES.get(data.get('_t'))
+        if cls is None:
+            return None
+
+        # The alert already exists, do not run __init__
+        alert = cls.__new__(cls)
+        alert.alert_id = data['alert_id']
+        alert.timestamp = float(data['timestamp'])
+        alert.user_id = data.get('user_id')
+        for field in cls.fields:
+            setattr(alert, field, data.get(field))
+        for field in cls.captured:
+            if field in data:
+                setattr(alert, field, data[field])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+    return alert
+
+
+def alert_link(endpoint, **values):
+    """Returns the URL of `endpoint` with `values`, like `url_for`.
+
+    The URL is made from a pattern built with `url_for` the first time
+    `endpoint` is linked to in the request, so showing a page of alerts does
+    not build the same route for every alert.
+
+    """
+    patterns = g.setdefault('alert_links', {})
+    names = tuple(sorted(values))
+
+    pattern = patterns.get((endpoint, names))
+    if pattern is None:
+        markers = dict((name, 'alertlink{}x'.format(i))
+                       for i, name in enumerate(names))
+        pattern = url_for(endpoint, **markers).replace('{', '{{') \
+            .replace('}', '}}')
+        for name, marker in markers.items():
+            pattern = pattern.replace(marker, '{' + name + '}')
+        patterns[(endpoint, names)] = pattern
+
+    return pattern.format(**dict((name, quote(str(value), safe=''))
+                                 for name, value in values.items()))
+
+
+def decode_legacy_alert(pickled_alert):
+    """Returns an alert stored as a jsonpickle blob or None."""
+    try:
+        alert = jsonpickle.decode(pickled_alert)
+    except (TypeError, ValueError):
+        return None
+
+    return alert if isinstance(alert, BaseAlert) else None
+
+
+@register_alert('base')
 class BaseAlert(object):
     """Base form for all alerts within Pjuu.
 
-    Note: This should not be used directly but subclassed.
+    Note: This should not be used directly but subclassed. Subclasses need
+    registering with `register_alert` and any attributes they add listing in
+    `fields`. Fields are stored as strings.
 
     """
 
-    def __init__(self, user_id):
+    # Attributes stored along with `alert_id`, `timestamp` and `user_id`
+    fields = ()
+    # Display data stored if it was given when the alert was created
+    captured = ('username', 'actors')
+    # How many users caused the alert, only merged alerts have more than one
+    actors = 1
+    # When the user being shown the alert first caused it, see `prepare_many`
+    acted = None
+
+    def __init__(self, user_id, username=None):
         self.alert_id = get_uuid()
         self.timestamp = timestamp()
         self.user_id = user_id
+        if username is not None:
+            self.username = username
 
     @cached_property
     def user(self):
@@ -46,6 +193,33 @@ class BaseAlert(object):
         """
         return be_get_user(self.user_id)
 
+    @cached_property
+    def username(self):
+        """The username of the user who caused the alert. This is captured
+        when the alert is created, it is only looked up for alerts stored
+        without it.
+
+        """
+        return (self.user or {}).get('username')
+
+    def profile_url(self):
+        """The link to the profile of the user who caused the alert."""
+        return alert_link('users.profile', username=self.username)
+
+    def others(self):
+        """How many users other than `user_id` caused the alert."""
+        try:
+            return max(int(self.actors) - 1, 0)
+        except (TypeError, ValueError):
+            return 0
+
+    def aggregate_key(self):
+        """Overwrite to return the Redis key alerts are merged on. Alerts
+        with the same key are merged in to one, None is never merged.
+
+        """
+        return None
+
     def verify(self):
         """Check the alert is valid. You may need to overwrite this if you add
         anything to base alerts. See posts.backends.PostingAlert for more
@@ -55,6 +229,72 @@ class BaseAlert(object):
         # Simple implementation, check the user exists
         return self.user is not None
 
+    @classmethod
+    def verify_many(cls, alerts):
+        """Check many alerts of this type at once, this is what
+        `AlertManager.get_many` uses. Returns the alerts which are valid.
+
+        If you overwrite `verify` overwrite this too, it should make the same
+        checks with a fixed number of queries however many alerts there are.
+
+        """
+        users = dict((user.get('_id'), user) for user in
+                     get_users([alert.user_id for alert in alerts]))
+
+        valid = []
+        for alert in alerts:
+            user = users.get(alert.user_id)
+            if user is not None:
+                # Fill the cached `user` so it is not looked up again
+                alert.user = user
+                valid.append(alert)
+
+        return valid
+
+    @classmethod
+    def prepare_many(cls, alerts, for_uid):
+        """Look up anything `prettify` needs to show `alerts` to the user
+        with `for_uid` in one go. `AlertManager.get_many` calls this once per
+        type of alert so displaying a page of alerts does not need a look up
+        per alert.
+
+        Merged alerts show the most recent user, if that is `for_uid` they are
+        changed to show the user before them. `for_uid` is never counted in
+        the others, `acted` is set to when they were first an actor or None.
+
+        """
+        alerts = [alert for alert in alerts if alert.others()]
+        if not alerts:
+            return
+
+        pipe = r.pipeline(transaction=False)
+        for alert in alerts:
+            pipe.zscore(k.ALERT_ACTORS.format(alert.alert_id), for_uid)
+            pipe.zrevrange(k.ALERT_ACTORS.format(alert.alert_id), 0, 1)
+        results = pipe.execute()
+
+        shown = []
+        for alert, acted, user_ids in zip(alerts, results[::2],
+                                          results[1::2]):
+            alert.acted = acted
+            if acted is not None:
+                alert.actors = max(int(alert.actors) - 1, 0)
+            if alert.user_id == for_uid:
+                user_ids = [user_id for user_id in user_ids
+                            if user_id != for_uid]
+                if user_ids:
+                    shown.append((alert, user_ids[0]))
+
+        users = dict((user.get('_id'), user) for user in get_users(
+            [user_id for _, user_id in shown]))
+
+        for alert, user_id in shown:
+            user = users.get(user_id)
+            if user is not None:
+                alert.user_id = user.get('_id')
+                alert.user = user
+                alert.username = user.get('username')
+
     def prettify(self, for_uid=None):
         """Overwrite to show how the alert will be presented to the user.
 
@@ -63,8 +303,8 @@ class BaseAlert(object):
             return "This is an alert about how cool Joe is :P"
 
         Feel free to use all functions you need to help make this happen.
-        You may have to import some from Jinja2 and use url_for to get what we
-        are looking for.
+        Build links with `profile_url` or `alert_link` from the stored fields
+        rather than calling url_for for every alert.
 
         """
         raise NotImplementedError
@@ -76,32 +316,101 @@ class AlertManager(object):
     """
 
     def get(self, aid):
-        """Attempts to load an Alert from Redis and unpickle it.
+        """Attempts to load an Alert from Redis and decode it.
 
         """
-        # Try the unpickling process
-        try:
-            pickled_alert = r.get(k.ALERT.format(aid))
-            alert = jsonpickle.decode(pickled_alert)
-        except (TypeError, ValueError):
-            # We failed to get an alert for whateva reason
-            return None
+        alerts = self.get_many([aid])
+        return alerts[0] if alerts else None
 
-        # Ensure we got an alert and that it verifies.
-        if alert.verify():
-            # Return the alert object
-            return alert
-        else:
+    def get_many(self, aids, user_id=None):
+        """Load many alerts at once.
+
+        The alerts are read with a single pipeline and verified with
+        `BaseAlert.verify_many` once per type of alert. Alerts which do not
+        verify are deleted and, if `user_id` is given, every alert which could
+        not be loaded is removed from that users alerts and their unread
+        count.
+
+        If `user_id` is given the alerts are also prepared to be shown to that
+        user with `BaseAlert.prepare_many`.
+
+        :returns: The alerts which are valid in the order of `aids`
+        :rtype: list
+
+        """
+        if not aids:
+            return []
+
+        pipe = r.pipeline(transaction=False)
+        for aid in aids:
+            pipe.hgetall(k.ALERT.format(aid))
+        results = pipe.execute(raise_on_error=False)
+
+        decoded = []
+        legacy = []
+        for aid, data in zip(aids, results):
+            if isinstance(data, dict):
+                decoded.append(decode_alert(data))
+            else:
+                # The wrong type, the alert has not been migrated yet
+                legacy.append(aid)
+
+        if legacy:
+            decoded.extend(decode_legacy_alert(pickled_alert) for pickled_alert
+                           in r.mget([k.ALERT.format(aid) for aid in legacy]))
+
+        # Group the alerts by type so each type can verify them in one go
+        by_type = {}
+        for alert in decoded:
+            if alert is not None:
+                by_type.setdefault(type(alert), []).append(alert)
+
+        alerts = {}
+        for alert_type, typed_alerts in by_type.items():
+            typed_alerts = alert_type.verify_many(typed_alerts)
+            if user_id is not None and typed_alerts:
+                alert_type.prepare_many(typed_alerts, user_id)
+
+            for alert in typed_alerts:
+                alerts[alert.alert_id] = alert
+
+        stale = [aid for aid in aids if aid not in alerts]
+        if stale:
+            unread = 0
+            if user_id is not None:
+                # Alerts newer than the users last check are in their unread
+                # count and have to be taken off it
+                user = be_get_user(user_id) or {}
+                last_checked = user.get('alerts_last_checked', -1)
+
+                pipe = r.pipeline(transaction=False)
+                for aid in stale:
+                    pipe.zscore(k.USER_ALERTS.format(user_id), aid)
+                unread = sum(1 for score in pipe.execute()
+                             if score is not None and score > last_checked)
+
+            pipe = r.pipeline(transaction=False)
             # If the alert did not verify delete it
             # This will stop this always being called
-            r.delete(k.ALERT.format(aid))
-            return None
+            pipe.delete(*[k.ALERT.format(aid) for aid in stale])
+            pipe.delete(*[k.ALERT_ACTORS.format(aid) for aid in stale])
+            if user_id is not None:
+                pipe.zrem(k.USER_ALERTS.format(user_id), *stale)
+            if unread:
+                scripts.unread_decr(
+                    keys=[k.USER_ALERTS_UNREAD.format(user_id)],
+                    args=[unread], client=pipe)
+            pipe.execute()
+
+        return [alerts[aid] for aid in aids if aid in alerts]
 
     def alert(self, alert, user_ids):
         """Will attempt to alert the user with uid to the alert being managed.
 
-        This will call the alerts before_alert() method, which allows you to
-        change the alert per user. It's not needed though.
+        Users are only alerted once and never about something they did
+        themselves. Alerts are delivered in pipelines of
+        ``ALERT_BATCH_SIZE`` users, audiences larger than ``ALERT_TASK_SIZE``
+        are left to a Celery task so the request does not wait for them.
 
         """
         # Check that the manager actually has an alert
@@ -113,12 +422,79 @@ class AlertManager(object):
         if not isinstance(user_ids, Iterable) or isinstance(user_ids, str):
             raise TypeError('user_ids must be iterable')
 
-        # Create the alert object
-        r.set(k.ALERT.format(alert.alert_id), jsonpickle.encode(alert))
-        # Set the 4WK timeout on it
-        r.expire(k.ALERT.format(alert.alert_id), k.EXPIRE_4WKS)
+        # Don't alert users more than once or about their own actions
+        user_ids = [user_id for user_id in dict.fromkeys(user_ids)
+                    if user_id != alert.user_id]
+
+        alert_id = alert.alert_id
+        aggregate_key = alert.aggregate_key()
+        window = app.config.get('ALERT_AGGREGATE_WINDOW', 3600)
+
+        # Alerts without a user have no actor to merge
+        if aggregate_key is not None and window > 0 and \
+                alert.user_id is not None:
+            aggregate_id = r.get(aggregate_key)
+            if aggregate_id is not None and merge_alert(aggregate_id, alert):
+                alert_id = aggregate_id
+            else:
+                # Start a new alert for others to be merged in to
+                r.set(aggregate_key, alert_id, ex=window)
+
+        if alert_id == alert.alert_id:
+            # Create the alert object
+            pipe = r.pipeline(transaction=False)
+            pipe.hset(k.ALERT.format(alert_id), mapping=encode_alert(alert))
+            # Set the 4WK timeout on it
+            pipe.expire(k.ALERT.format(alert_id), k.EXPIRE_4WKS)
+            if aggregate_key is not None and alert.user_id is not None:
+                pipe.zadd(k.ALERT_ACTORS.format(alert_id),
+                          {alert.user_id: alert.timestamp})
+                pipe.expire(k.ALERT_ACTORS.format(alert_id), k.EXPIRE_4WKS)
+            pipe.execute()
+
+        if len(user_ids) > app.config.get('ALERT_TASK_SIZE', 1000):
+            deliver_alert.delay(alert_id, alert.timestamp, user_ids)
+        else:
+            deliver_alert(alert_id, alert.timestamp, user_ids)
+
+
+def merge_alert(alert_id, alert):
+    """Merge `alert` in to the stored alert with `alert_id`. It keeps its id
+    but takes on the user, time and display data of `alert`.
+
+    :returns: False if there is no alert with `alert_id` to merge in to
+    :rtype: bool
+
+    """
+    # Capture the display data, the old users data is replaced
+    for field in alert.captured:
+        getattr(alert, field)
+
+    data = encode_alert(alert)
+    del data['alert_id']
+
+    args = [alert.user_id, repr(alert.timestamp), k.EXPIRE_4WKS]
+    for field, value in data.items():
+        args.extend((field, value))
+
+    return bool(scripts.alert_merge(
+        keys=[k.ALERT.format(alert_id), k.ALERT_ACTORS.format(alert_id)],
+        args=args))
+
+
+@celery.task()
+def deliver_alert(alert_id, alert_timestamp, user_ids):
+    """Add the stored alert `alert_id` to the alerts of `user_ids` and count
+    it as unread. One pipeline is sent per ``ALERT_BATCH_SIZE`` users.
+
+    """
+    batch_size = app.config.get('ALERT_BATCH_SIZE', 500)
 
-        for user_id in user_ids:
-            r.zadd(k.USER_ALERTS.format(user_id), {
-                str(alert.alert_id): alert.timestamp
+    for i in range(0, len(user_ids), batch_size):
+        pipe = r.pipeline(transaction=False)
+        for user_id in user_ids[i:i + batch_size]:
+            pipe.zadd(k.USER_ALERTS.format(user_id), {
+                str(alert_id): alert_timestamp
             })
+            pipe.incr(k.USER_ALERTS_UNREAD.format(user_id))
+        pipe.execute()
@@ -0,0 +1,309 @@
+# -*- coding: utf8 -*-
+
+"""Caches which sit in front of MongoDB.
+
+There are two tiers. A small least recently used cache inside each process
+and a Redis tier which is shared by every process. Entries in the process
+tier live for a few seconds only, a process can not see another process
+invalidating an entry so this bounds how stale a read can be.
+
+Each document has a generation in Redis which every invalidate changes. A
+document read from MongoDB is only written back to Redis if its generation is
+the same as before the read, so an invalidate which happens during the read
+is never undone by the old document.
+
+:license: AGPL v3, see LICENSE for more details
+:copyright: 2014-2023 Joe Doherty
+
+"""
+
+# Stdlib imports
+from collections import OrderedDict
+import json
+from time import time
+# Pjuu imports
+from pjuu.lib.scripts import CACHE_SET
+
+
+class LRUCache(object):
+    """A per-process least recently used cache where entries expire after
+    `ttl` seconds.
+
+    """
+
+    def __init__(self, maxsize=1024, ttl=5):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+
+    def get(self, key, default=None):
+        entry = self.entries.get(key)
+        if entry is None:
+            return default
+
+        expires, value = entry
+        if expires < time():
+            del self.entries[key]
+            return default
+
+        self.entries.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self.entries[key] = (time() + self.ttl, value)
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def delete(self, key):
+        self.entries.pop(key, None)
+
+    def clear(self):
+        self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class DocumentCache(object):
+    """Read-through cache of MongoDB documents keyed by `_id`.
+
+    Documents are stored as JSON. Both tiers hold the serialized document and
+    every read decodes a fresh copy, callers are free to change what they are
+    given.
+
+    If `fields` is given only those fields are cached and the Redis tier
+    stores each document as a hash of JSON values, one field per value. A
+    document which does not have a field has it set to `None`.
+
+    Hits and misses are counted in the Redis hash `stats_key`. Counts are
+    kept in the process and sent along with the next trip to Redis, a read
+    served from the process tier does not touch Redis at all.
+
+    Settings are read from the app config using `config_prefix`:
+
+    - ``<prefix>_ENABLED``: Turn the cache on or off
+    - ``<prefix>_SIZE``: Number of documents in the process tier
+    - ``<prefix>_LOCAL_TTL``: Seconds a document lives in the process tier
+    - ``<prefix>_TTL``: Seconds a document lives in the Redis tier
+
+    :param collection: Name of the MongoDB collection
+    :param key: Redis key pattern, formatted with the document `_id`
+    :param stats_key: Redis key of the hit and miss counters
+    :param config_prefix: Prefix of the settings for this cache
+    :param fields: Only cache these fields, as Redis hashes
+    :param counted: The documents have write-behind counters (see
+                    `pjuu.lib.counters`). A flush only invalidates the process
+                    tier of the process which ran it, so other processes keep
+                    documents no longer than ``COUNTERS_FLUSH_INTERVAL``.
+    """
+
+    def __init__(self, collection, key, stats_key, config_prefix,
+                 fields=None, counted=False, app=None):
+        self.collection = collection
+        self.key = key
+        self.stats_key = stats_key
+        self.config_prefix = config_prefix
+        self.fields = tuple(fields) if fields is not None else None
+        self.counted = counted
+        self.app = app
+
+        self.enabled = True
+        self.ttl = 600
+        self.local = LRUCache()
+        self.pending = {}
+
+    def init_app(self, app, mongo, redis):
+        self.app = app
+        self.mongo = mongo
+        self.redis = redis
+
+        def config(name, default):
+            return app.config.get('{0}_{1}'.format(self.config_prefix, name),
+                                  default)
+
+        self.enabled = config('ENABLED', True)
+        self.ttl = config('TTL', 600)
+        local_ttl = config('LOCAL_TTL', 5)
+        if self.counted:
+            local_ttl = min(local_ttl,
+                            app.config.get('COUNTERS_FLUSH_INTERVAL', 10))
+        self.local = LRUCache(config('SIZE', 1024), local_ttl)
+        self.pending = {}
+
+        # Same as `pjuu.lib.scripts.Scripts`, there is no application context
+        connection = app.extensions['redis'][redis.config_prefix]
+        self.cache_set = connection.register_script(CACHE_SET)
+
+    def count(self, name, amount):
+        if amount:
+            self.pending[name] = self.pending.get(name, 0) + amount
+
+    def flush_stats(self, pipe):
+        """Add the counts kept in this process to the pipeline `pipe`."""
+        for name, amount in self.pending.items():
+            pipe.hincrby(self.stats_key, name, amount)
+        self.pending = {}
+
+    def get_stats(self):
+        """Returns the hit and miss counts of every process as a dict."""
+        pipe = self.redis.pipeline(transaction=False)
+        self.flush_stats(pipe)
+        pipe.hgetall(self.stats_key)
+        stats = pipe.execute()[-1]
+
+        stats = dict((name, int(stats.get(name, 0)))
+                     for name in ('local_hits', 'redis_hits', 'misses'))
+        lookups = sum(stats.values())
+        stats['hit_rate'] = \
+            (lookups - stats['misses']) / lookups if lookups else 0
+
+        return stats
+
+    def find(self, ids):
+        """Returns a MongoDB cursor of the documents with `ids`."""
+        projection = None
+        if self.fields is not None:
+            projection = dict((field, True) for field in self.fields)
+
+        return self.mongo.db[self.collection].find({'_id': {'$in': ids}},
+                                                   projection)
+
+    def generation_key(self, _id):
+        return self.key.format(_id) + ':generation'
+
+    def read(self, pipe, _id):
+        """Queue the read of `_id` and its generation from the Redis tier on
+        `pipe`.
+
+        """
+        if self.fields is None:
+            pipe.get(self.key.format(_id))
+        else:
+            pipe.hmget(self.key.format(_id), self.fields)
+        pipe.get(self.generation_key(_id))
+
+    def decode(self, value):
+        """Returns the JSON of a value read from the Redis tier or None if
+        the document was not there.
+
+        """
+        if self.fields is None or value is None:
+            return value
+
+        if all(field is None for field in value):
+            return None
+
+        return json.dumps(dict(
+            (name, json.loads(field) if field is not None else None)
+            for name, field in zip(self.fields, value)))
+
+    def write(self, pipe, doc, generation):
+        """Queue the write of `doc` to the Redis tier on `pipe`. It is only
+        written if the documents generation is still `generation`.
+
+        :returns: The JSON of the document
+        :rtype: str
+
+        """
+        keys = [self.key.format(doc.get('_id')),
+                self.generation_key(doc.get('_id'))]
+        args = [generation or '', self.ttl]
+
+        if self.fields is None:
+            value = json.dumps(doc)
+            self.cache_set(keys=keys, args=args + [value], client=pipe)
+            return value
+
+        doc = dict((field, doc.get(field)) for field in self.fields)
+        for field, value in doc.items():
+            args.extend([field, json.dumps(value)])
+        self.cache_set(keys=keys, args=args, client=pipe)
+        return json.dumps(doc)
+
+    def get(self, _id):
+        """Get a single document, `None` if it does not exist."""
+        return self.get_many([_id]).get(_id)
+
+    def get_many(self, ids):
+        """Get many documents at once.
+
+        :returns: `{_id: document}` for every document that exists
+        :rtype: dict
+
+        """
+        if not self.enabled:
+            return dict((doc.get('_id'), doc) for doc in self.find(ids))
+
+        documents = {}
+
+        # Process tier
+        missing = []
+        for _id in ids:
+            value = self.local.get(_id)
+            if value is not None:
+                documents[_id] = json.loads(value)
+            else:
+                missing.append(_id)
+        self.count('local_hits', len(ids) - len(missing))
+
+        if not missing:
+            return documents
+
+        # Redis tier
+        pipe = self.redis.pipeline(transaction=False)
+        for _id in missing:
+            self.read(pipe, _id)
+        self.flush_stats(pipe)
+        values = pipe.execute()
+        ids = missing
+        missing = []
+        generations = {}
+        for i, _id in enumerate(ids):
+            value = self.decode(values[i * 2])
+            if value is not None:
+                self.local.set(_id, value)
+                documents[_id] = json.loads(value)
+            else:
+                missing.append(_id)
+                generations[_id] = values[i * 2 + 1]
+        self.count('redis_hits', len(ids) - len(missing))
+
+        if not missing:
+            return documents
+
+        # MongoDB
+        self.count('misses', len(missing))
+        pipe = self.redis.pipeline(transaction=False)
+        self.flush_stats(pipe)
+        values = {}
+        for doc in self.find(missing):
+            values[doc.get('_id')] = self.write(
+                pipe, doc, generations.get(doc.get('_id')))
+        written = pipe.execute()[-len(values):] if values else []
+
+        for (_id, value), stored in zip(values.items(), written):
+            # Only keep what made it in to Redis, if the document was
+            # invalidated while it was read it is already out of date
+            if stored:
+                self.local.set(_id, value)
+            documents[_id] = json.loads(value)
+
+        return documents
+
+    def invalidate(self, *ids):
+        """Remove documents from the cache. Call this every time a document
+        changes in MongoDB.
+
+        """
+        if not ids:
+            return
+
+        pipe = self.redis.pipeline(transaction=False)
+        for _id in ids:
+            self.local.delete(_id)
+            pipe.delete(self.key.format(_id))
+            pipe.incr(self.generation_key(_id))
+            pipe.expire(self.generation_key(_id), self.ttl)
+        pipe.execute()
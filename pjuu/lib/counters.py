@@ -0,0 +1,279 @@
+# -*- coding: utf8 -*-
+
+"""Write-behind counters.
+
+Counters on documents which change all the time, a posts `score` and
+`comment_count` and a users `score`, are not written to MongoDB as they
+change. Changes are added up in a Redis hash per document and the
+document is marked as dirty. `flush_counters` writes them to MongoDB with
+bulk updates every ``COUNTERS_FLUSH_INTERVAL`` seconds, it is run by Celery
+beat.
+
+What is in MongoDB is behind by the changes which are still waiting, reads
+need to add them with `apply_counters`.
+
+``scripts/reconcile_scores.py`` rebuilds the post and user scores from the
+votes stored in Redis.
+
+:license: AGPL v3, see LICENSE for more details
+:copyright: 2014-2023 Joe Doherty
+
+"""
+
+# 3rd party imports
+from flask import current_app as app
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+# Pjuu imports
+from pjuu import celery, mongo as m, post_cache, redis as r
+from pjuu.lib import keys as k
+
+
+# Collection name to the key its counters are stored under
+COUNTER_KEYS = {
+    'posts': k.POST_COUNTERS,
+    'users': k.USER_COUNTERS,
+}
+
+
+def incr_counter(collection, _id, field, amount=1):
+    """Add `amount` (which may be negative) to the counter `field` of the
+    document with `_id`.
+
+    """
+    incr_counters([(collection, _id, field, amount)])
+
+
+def incr_counters(changes):
+    """Make many `incr_counter` changes with one pipeline.
+
+    :param changes: `(collection, _id, field, amount)` tuples
+    :type changes: list
+
+    """
+    pipe = r.pipeline(transaction=False)
+    for collection, _id, field, amount in changes:
+        pipe.hincrby(COUNTER_KEYS[collection].format(_id), field, amount)
+        pipe.sadd(k.DIRTY_COUNTERS.format(collection), _id)
+    pipe.execute()
+
+
+def clear_counter(collection, _id, field):
+    """Drop the waiting changes to `field`. Call this when the field is set
+    in MongoDB directly.
+
+    """
+    r.hdel(COUNTER_KEYS[collection].format(_id), field)
+
+
+def delete_counters(collection, _id):
+    """Drop all waiting changes, call this when the document is deleted."""
+    r.delete(COUNTER_KEYS[collection].format(_id))
+
+
+def get_counters(collection, ids):
+    """Returns the waiting changes for each of `ids` as ``{_id: {field:
+    amount}}``. Documents without any changes are left out.
+
+    """
+    ids = list(ids)
+    if not ids:
+        return {}
+
+    pipe = r.pipeline(transaction=False)
+    for _id in ids:
+        pipe.hgetall(COUNTER_KEYS[collection].format(_id))
+
+    return dict((_id, dict((field, int(amount))
+                           for field, amount in changes.items()))
+                for _id, changes in zip(ids, pipe.execute()) if changes)
+
+
+def apply_counters(collection, docs):
+    """Add the waiting changes to the counters of `docs`, in place.
+
+    :param collection: The collection the documents are from
+    :type collection: str
+    :param docs: Documents from MongoDB, None is skipped
+    :type docs: list
+    :returns: `docs`
+    :rtype: list
+
+    """
+    changes = get_counters(collection, [doc.get('_id') for doc in docs
+                                        if doc is not None])
+
+    for doc in docs:
+        if doc is not None:
+            for field, amount in changes.get(doc.get('_id'), {}).items():
+                doc[field] = doc.get(field, 0) + amount
+
+    return docs
+
+
+def take_counters(collection, ids):
+    """Remove and return the waiting changes for `ids`. Each document is read
+    and cleared in a transaction so no change is lost or taken twice.
+
+    """
+    pipe = r.pipeline()
+    for _id in ids:
+        pipe.hgetall(COUNTER_KEYS[collection].format(_id))
+        pipe.delete(COUNTER_KEYS[collection].format(_id))
+    results = pipe.execute()[::2]
+
+    return [(_id, dict((field, int(amount))
+                       for field, amount in changes.items()))
+            for _id, changes in zip(ids, results) if changes]
+
+
+def give_back_counters(collection, changes):
+    """Put `changes` taken with `take_counters` back to be written later."""
+    if not changes:
+        return
+
+    pipe = r.pipeline(transaction=False)
+    for _id, fields in changes:
+        for field, amount in fields.items():
+            pipe.hincrby(COUNTER_KEYS[collection].format(_id), field, amount)
+        pipe.sadd(k.DIRTY_COUNTERS.format(collection), _id)
+    pipe.execute()
+
+
+def flush_collection(collection, batch_size=None):
+    """Write the waiting changes of one collection to MongoDB.
+
+    :returns: The number of documents changes were written for
+    :rtype: int
+
+    """
+    if batch_size is None:
+        batch_size = app.config.get('COUNTERS_BATCH_SIZE', 500)
+
+    flushed = 0
+    while True:
+        ids = r.spop(k.DIRTY_COUNTERS.format(collection), batch_size)
+        if not ids:
+            break
+
+        changes = take_counters(collection, ids)
+        if not changes:
+            continue
+
+        try:
+            m.db[collection].bulk_write([
+                UpdateOne({'_id': _id}, {'$inc': fields})
+                for _id, fields in changes
+            ], ordered=False)
+        except BulkWriteError as e:
+            # Only the updates which failed need trying again
+            failed = set(error.get('index')
+                         for error in e.details.get('writeErrors', []))
+            give_back_counters(collection, [
+                change for i, change in enumerate(changes) if i in failed])
+            raise
+        except PyMongoError:
+            give_back_counters(collection, changes)
+            raise
+
+        ids = [_id for _id, _ in changes]
+        if collection == 'posts':
+            post_cache.invalidate(*ids)
+        elif collection == 'users':
+            # Same as `forget_user`, the signed in users copy is out of date
+            pipe = r.pipeline(transaction=False)
+            for _id in ids:
+                pipe.incr(k.USER_VERSION.format(_id))
+            pipe.execute()
+
+        flushed += len(changes)
+
+    return flushed
+
+
+@celery.task()
+def flush_counters(collection=None):
+    """Write all waiting counter changes to MongoDB. Celery beat runs this
+    every ``COUNTERS_FLUSH_INTERVAL`` seconds.
+
+    :param collection: Only flush this collection, all of them if None
+    :type collection: str
+    :returns: The number of documents changes were written for
+    :rtype: int
+
+    """
+    collections = [collection] if collection else sorted(COUNTER_KEYS)
+    return sum(flush_collection(name) for name in collections)
+
+
+def vote_total(votes):
+    """Returns the score from a posts votes, as stored in ``POST_VOTES``."""
+    return sum(1 if vote > 0 else -1 for _, vote in votes)
+
+
+def reconcile_scores(batch_size=1000):
+    """Rebuild the score of every post from its votes in Redis and the score
+    of every user from the scores of their posts.
+
+    Waiting changes are flushed first. Votes made while this runs may be
+    counted twice, run it while the site is quiet.
+
+    :returns: The number of posts and users whose score was wrong
+    :rtype: tuple
+
+    """
+    flush_counters()
+
+    user_scores = {}
+    fixed_posts = 0
+    posts = []
+
+    def fix_posts(posts):
+        pipe = r.pipeline(transaction=False)
+        for post in posts:
+            pipe.zrange(k.POST_VOTES.format(post.get('_id')), 0, -1,
+                        withscores=True)
+
+        scores = {}
+        for post, votes in zip(posts, pipe.execute()):
+            score = vote_total(votes)
+            user_id = post.get('user_id')
+            user_scores[user_id] = user_scores.get(user_id, 0) + score
+
+            if post.get('score', 0) != score:
+                scores[post.get('_id')] = score
+
+        if scores:
+            m.db.posts.bulk_write([
+                UpdateOne({'_id': _id}, {'$set': {'score': score}})
+                for _id, score in scores.items()
+            ], ordered=False)
+            post_cache.invalidate(*scores)
+        return len(scores)
+
+    for post in m.db.posts.find({}, {'user_id': True, 'score': True}):
+        posts.append(post)
+        if len(posts) >= batch_size:
+            fixed_posts += fix_posts(posts)
+            posts = []
+
+    if posts:
+        fixed_posts += fix_posts(posts)
+
+    scores = {}
+    for user in m.db.users.find({}, {'score': True}):
+        score = user_scores.get(user.get('_id'), 0)
+        if user.get('score', 0) != score:
+            scores[user.get('_id')] = score
+
+    updates = [UpdateOne({'_id': _id}, {'$set': {'score': score}})
+               for _id, score in scores.items()]
+    for i in range(0, len(updates), batch_size):
+        m.db.users.bulk_write(updates[i:i + batch_size], ordered=False)
+
+    pipe = r.pipeline(transaction=False)
+    for _id in scores:
+        pipe.incr(k.USER_VERSION.format(_id))
+    pipe.execute()
+
+    return fixed_posts, len(scores)
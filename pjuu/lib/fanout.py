@@ -0,0 +1,230 @@
+# -*- coding: utf8 -*-
+
+"""Fan-out engine. Pushes a post in to the feed of every member of a
+followers sorted set.
+
+Followers are read with ZSCAN so the whole set is never loaded at once and
+the feeds are written and trimmed by a Lua script in batches of
+``FANOUT_BATCH_SIZE``. Audiences larger than ``FANOUT_TASK_SIZE`` are split
+in to Celery sub-tasks so they can be worked on in parallel. The cost of a
+post grows with the number of batches not the number of followers.
+
+Followers who have not been seen for ``FEED_DORMANT_DAYS`` are skipped, their
+feeds are left to expire and are rebuilt when they come back (see
+`pjuu.posts.backend.touch_feed`). Users from before last seen was recorded
+are given their last login by `seed_last_seen`.
+
+:license: AGPL v3, see LICENSE for more details
+:copyright: 2014-2023 Joe Doherty
+
+"""
+
+# 3rd party imports
+from flask import current_app as app
+# Pjuu imports
+from pjuu import celery, mongo as m, redis as r, scripts
+from pjuu.lib import keys as k, timestamp
+
+
+def get_fan_out_settings():
+    """Returns the settings `fan_out` uses. They are read by the web app and
+    passed to the tasks so workers do not need the same config.
+
+    """
+    return {
+        'batch_size': app.config.get('FANOUT_BATCH_SIZE', 500),
+        'task_size': app.config.get('FANOUT_TASK_SIZE', 10000),
+        'dormant_seconds': get_dormant_seconds()
+    }
+
+
+def fan_out(followers_key, post_id, post_time, settings=None):
+    """Push `post_id` in to the feed of every user in the `followers_key`
+    sorted set.
+
+    :param followers_key: Redis key of the followers zset to read
+    :type followers_key: str
+    :param post_id: The post to add to the feeds
+    :type post_id: str
+    :param post_time: The score the post is added with
+    :type post_time: float
+    :param settings: See `get_fan_out_settings`, read from the config if
+                     not given
+    :type settings: dict
+    :returns: The number of followers, sub-tasks used and time taken
+    :rtype: dict
+
+    """
+    start = timestamp()
+
+    if settings is None:
+        settings = get_fan_out_settings()
+
+    batch_size = settings.get('batch_size')
+    task_size = settings.get('task_size')
+    dormant_seconds = settings.get('dormant_seconds')
+
+    followers = 0
+    subtasks = 0
+    chunk = []
+
+    for follower_id, _ in r.zscan_iter(followers_key, count=batch_size):
+        chunk.append(follower_id)
+
+        # Hand full chunks off to the workers as soon as we have them
+        if len(chunk) >= task_size:
+            push_to_feeds.delay(chunk, post_id, post_time, batch_size,
+                                dormant_seconds)
+            followers += len(chunk)
+            subtasks += 1
+            chunk = []
+
+    # The remainder (or the whole audience if it is small) is written here
+    if chunk:
+        push_to_feeds(chunk, post_id, post_time, batch_size,
+                      dormant_seconds)
+        followers += len(chunk)
+
+    stats = {
+        'followers': followers,
+        'subtasks': subtasks,
+        'seconds': timestamp() - start
+    }
+    record_fan_out(post_id, stats)
+
+    return stats
+
+
+@celery.task()
+def push_to_feeds(user_ids, post_id, post_time, batch_size=None,
+                  dormant_seconds=None):
+    """Add `post_id` to the feeds of `user_ids`. One script call is made to
+    Redis per ``FANOUT_BATCH_SIZE`` users.
+
+    """
+    if batch_size is None:
+        batch_size = app.config.get('FANOUT_BATCH_SIZE', 500)
+
+    for i in range(0, len(user_ids), batch_size):
+        add_to_feeds([k.USER_FEED.format(user_id)
+                      for user_id in active_users(user_ids[i:i + batch_size],
+                                                  dormant_seconds)],
+                     {str(post_id): post_time})
+
+
+def get_dormant_seconds():
+    """Returns how long a user has to be away before they are dormant, 0 if
+    users are never dormant.
+
+    """
+    return app.config.get('FEED_DORMANT_DAYS', 90) * k.EXPIRE_24HRS
+
+
+def active_users(user_ids, dormant_seconds=None):
+    """Returns the users in `user_ids` who are not dormant. Users who have
+    never been seen are active.
+
+    """
+    if dormant_seconds is None:
+        dormant_seconds = get_dormant_seconds()
+    if not dormant_seconds or not user_ids:
+        return user_ids
+
+    pipe = r.pipeline(transaction=False)
+    for user_id in user_ids:
+        pipe.zscore(k.USERS_LAST_SEEN, user_id)
+    last_seen = pipe.execute()
+
+    cutoff = timestamp() - dormant_seconds
+    return [user_id for user_id, seen in zip(user_ids, last_seen)
+            if seen is None or seen >= cutoff]
+
+
+def seed_last_seen():
+    """Give every user who has not been seen since last seen was recorded
+    their last login, or when they signed up if they never have, so users
+    who have left can become dormant.
+
+    Users who have been seen are left alone.
+
+    :returns: The number of users seeded
+    :rtype: int
+
+    """
+    batch_size = app.config.get('FANOUT_BATCH_SIZE', 500)
+    users = m.db.users.find({}, {'created': True, 'last_login': True})
+
+    seeded = 0
+    pipe = r.pipeline(transaction=False)
+    for i, user in enumerate(users, 1):
+        seen = max(user.get('last_login', -1), user.get('created', 0))
+        pipe.zadd(k.USERS_LAST_SEEN, {user.get('_id'): seen}, nx=True)
+
+        if i % batch_size == 0:
+            seeded += sum(pipe.execute())
+
+    seeded += sum(pipe.execute())
+    return seeded
+
+
+def add_to_feeds(feed_keys, posts, max_size=None):
+    """Add `posts` to every feed in `feed_keys` and trim them, all in a single
+    call to Redis.
+
+    Feeds are only trimmed back to `max_size` (``FEED_MAX_SIZE`` by default)
+    once they are more than ``FEED_TRIM_SLACK`` over it.
+
+    :param feed_keys: The Redis keys of the feeds
+    :type feed_keys: list
+    :param posts: `{post_id: timestamp}` to add to the feeds
+    :type posts: dict
+    :param max_size: The size to trim the feeds to
+    :type max_size: int
+
+    """
+    if not feed_keys or not posts:
+        return 0
+
+    if max_size is None:
+        max_size = app.config.get('FEED_MAX_SIZE', 1000)
+
+    args = [max_size, app.config.get('FEED_TRIM_SLACK', 100)]
+    for post_id, post_time in posts.items():
+        args.extend([post_time, post_id])
+
+    return scripts.feed_add(keys=feed_keys, args=args)
+
+
+def record_fan_out(post_id, stats):
+    """Log the timing of a fan-out and add it to the running totals shown on
+    the dashboard.
+
+    """
+    app.logger.info('Fan-out of post %s to %d followers (%d sub-tasks) '
+                    'took %.4fs', post_id, stats['followers'],
+                    stats['subtasks'], stats['seconds'])
+
+    pipe = r.pipeline(transaction=False)
+    pipe.hincrby(k.FANOUT_STATS, 'posts', 1)
+    pipe.hincrby(k.FANOUT_STATS, 'followers', stats['followers'])
+    pipe.hincrby(k.FANOUT_STATS, 'subtasks', stats['subtasks'])
+    pipe.hincrbyfloat(k.FANOUT_STATS, 'seconds', stats['seconds'])
+    pipe.hset(k.FANOUT_STATS, 'last_seconds', stats['seconds'])
+    pipe.execute()
+
+
+def get_fan_out_stats():
+    """Returns the running fan-out totals as a dict."""
+    stats = r.hgetall(k.FANOUT_STATS)
+
+    posts = int(stats.get('posts', 0))
+    seconds = float(stats.get('seconds', 0))
+
+    return {
+        'posts': posts,
+        'followers': int(stats.get('followers', 0)),
+        'subtasks': int(stats.get('subtasks', 0)),
+        'seconds': seconds,
+        'average_seconds': seconds / posts if posts else 0,
+        'last_seconds': float(stats.get('last_seconds', 0))
+    }
@@ -0,0 +1,172 @@
+# -*- coding: utf8 -*-
+
+"""Hot feed, posts ranked by their points and age.
+
+A posts points are its score plus ``HOT_COMMENT_POINTS`` for each comment.
+Its hot score is::
+
+    sign(points) * log10(max(abs(points), 1)) + created / HOT_DECAY
+
+Time only appears as when the post was created so scores never need working
+out again as posts get older, newer posts simply start higher. Every
+``HOT_DECAY`` seconds a post needs 10 times the points to stay level.
+
+The scores are kept in a sorted set per global permission level (the same
+levels as the global timelines) holding the top ``HOT_MAX_SIZE`` posts. They
+are changed by Lua scripts as posts are voted on and commented on.
+``scripts/rebuild_timelines.py`` rebuilds them from MongoDB.
+
+:license: AGPL v3, see LICENSE for more details
+:copyright: 2014-2023 Joe Doherty
+
+"""
+
+# Stdlib imports
+import math
+# 3rd party imports
+from flask import current_app as app
+# Pjuu imports
+from pjuu import mongo as m, redis as r, scripts
+from pjuu.lib import keys as k
+from pjuu.lib.counters import apply_counters
+from pjuu.lib.timelines import GLOBAL_LEVELS
+
+
+def hot_score(points, created):
+    """Returns the hot score of a post with `points` created at `created`.
+    This is what the Lua scripts work out.
+
+    """
+    order = math.log10(max(abs(points), 1))
+    sign = (points > 0) - (points < 0)
+    return sign * order + created / app.config.get('HOT_DECAY', 45000)
+
+
+def _hot_keys(levels):
+    keys = []
+    for level in levels:
+        keys.extend((k.HOT_FEED.format(level), k.HOT_POINTS.format(level)))
+    return keys
+
+
+def get_hot_keys(post):
+    """Returns the hot set and points keys of every hot feed `post` belongs
+    in, as pairs in one list.
+
+    """
+    if 'reply_to' in post:
+        return []
+
+    permission = post.get('permission', k.PERM_PUBLIC)
+    return _hot_keys([level for level in GLOBAL_LEVELS
+                      if permission <= level])
+
+
+def add_to_hot(post):
+    """Add a newly created post to its hot feeds."""
+    keys = get_hot_keys(post)
+    if not keys:
+        return 0
+
+    return scripts.hot_add(keys=keys, args=[
+        post.get('_id'), repr(hot_score(0, post.get('created'))),
+        app.config.get('HOT_MAX_SIZE', 1000),
+        app.config.get('FEED_TRIM_SLACK', 100)])
+
+
+def change_points(post_id, amount):
+    """Add `amount` points to a post. Posts which are not in a hot feed,
+    replies and posts which have dropped out, are left alone.
+
+    :returns: The number of hot feeds the post is in
+    :rtype: int
+
+    """
+    return scripts.hot_update(keys=_hot_keys(GLOBAL_LEVELS),
+                              args=[post_id, amount])
+
+
+def remove_from_hot(post):
+    """Remove a deleted post from its hot feeds."""
+    keys = get_hot_keys(post)
+    if not keys:
+        return
+
+    pipe = r.pipeline(transaction=False)
+    for i in range(0, len(keys), 2):
+        pipe.zrem(keys[i], post.get('_id'))
+        pipe.hdel(keys[i + 1], post.get('_id'))
+    pipe.execute()
+
+
+def clean_hot_feed(perm, post_ids):
+    """Remove `post_ids`, which no longer exist, from the hot feed for
+    `perm`.
+
+    """
+    post_ids = list(post_ids)
+    pipe = r.pipeline(transaction=False)
+    pipe.zrem(k.HOT_FEED.format(perm), *post_ids)
+    pipe.hdel(k.HOT_POINTS.format(perm), *post_ids)
+    pipe.execute()
+
+
+def get_hot_page(perm, page, per_page):
+    """Returns the total and the post ids on `page` of the hot feed for
+    `perm`, hottest first.
+
+    """
+    key = k.HOT_FEED.format(perm)
+    pipe = r.pipeline(transaction=False)
+    pipe.zcard(key)
+    pipe.zrevrange(key, (page - 1) * per_page, (page * per_page) - 1)
+    return tuple(pipe.execute())
+
+
+def rebuild_hot_feed(perm):
+    """Rebuild the hot feed for `perm` from the newest ``HOT_MAX_SIZE``
+    posts in MongoDB. The old feed is replaced in a single transaction.
+
+    :returns: The number of posts in the hot feed
+    :rtype: int
+
+    """
+    comment_points = app.config.get('HOT_COMMENT_POINTS', 1)
+
+    cursor = m.db.posts.find(
+        {'reply_to': {'$exists': False}, 'permission': {'$lte': perm}},
+        {'created': True, 'score': True, 'comment_count': True}
+    ).sort([('created', -1), ('_id', -1)]).limit(
+        app.config.get('HOT_MAX_SIZE', 1000))
+    posts = apply_counters('posts', list(cursor))
+
+    scores = {}
+    points = {}
+    for post in posts:
+        points[post.get('_id')] = post.get('score', 0) + \
+            comment_points * post.get('comment_count', 0)
+        scores[post.get('_id')] = hot_score(points[post.get('_id')],
+                                            post.get('created'))
+
+    feed_key = k.HOT_FEED.format(perm)
+    points_key = k.HOT_POINTS.format(perm)
+    pipe = r.pipeline()
+    pipe.delete(feed_key, points_key)
+    if posts:
+        pipe.zadd(feed_key, scores)
+        pipe.hset(points_key, mapping=points)
+    pipe.execute()
+
+    return len(posts)
+
+
+def rebuild_hot_feeds():
+    """Rebuild the hot feed for every global permission level.
+
+    :returns: The number of hot feeds rebuilt
+    :rtype: int
+
+    """
+    for level in GLOBAL_LEVELS:
+        rebuild_hot_feed(level)
+    return len(GLOBAL_LEVELS)
@@ -3,18 +3,144 @@
 """Creates the MongoDB indexes. This can be run each time the app is deployed
 it will have no effect on indexes which are already there.
 
+Every query Pjuu runs all the time has its shape listed in `QUERY_SHAPES`
+and an index in `INDEXES` which answers it without scanning the collection
+or sorting in memory. ``tests/test_indexes.py`` checks this with `explain`.
+
 :license: AGPL v3, see LICENSE for more details
 :copyright: 2014-2023 Joe Doherty
 
 """
 
+# Stdlib imports
+from collections import namedtuple
 # 3rd party imports
 import pymongo
+from pymongo.errors import OperationFailure
 # Pjuu imports
 from pjuu import mongo as m
 from pjuu.lib import keys as k
 
 
+# Listings are sorted by `(created, _id)` so they can be paged through with a
+# cursor (see pjuu.lib.pagination.keyset_query)
+LISTING_SORT = [('created', pymongo.DESCENDING), ('_id', pymongo.DESCENDING)]
+
+
+# Indexes for each collection as `(keys, options)`.
+#
+# Post indexes are ordered equality fields, sort fields then range fields.
+# Top level posts are found with `{'reply_to': {'$exists': False}}`. This
+# can not be a partial index filter so they use the null part of the
+# `reply_to` indexes.
+INDEXES = {
+    'users': [
+        # User name and e-mail address have to be unique across the database
+        ([('username', pymongo.DESCENDING)], {'unique': True}),
+        ([('email', pymongo.DESCENDING)], {'unique': True}),
+        # Set TTL indexes for newly created users (24 hour TTL)
+        ([('ttl', pymongo.DESCENDING)],
+         {'expireAfterSeconds': k.EXPIRE_24HRS}),
+    ],
+    'posts': [
+        # Newest posts
+        ([('created', pymongo.DESCENDING), ('_id', pymongo.DESCENDING)], {}),
+        # A users posts, their followers feeds and deleting their account
+        ([('user_id', pymongo.DESCENDING), ('reply_to', pymongo.DESCENDING),
+          ('created', pymongo.DESCENDING), ('_id', pymongo.DESCENDING),
+          ('permission', pymongo.ASCENDING)], {}),
+        # A posts replies and top level posts (see above)
+        ([('reply_to', pymongo.DESCENDING), ('created', pymongo.DESCENDING),
+          ('_id', pymongo.DESCENDING), ('permission', pymongo.ASCENDING)],
+         {}),
+        # Posts with a hashtag
+        ([('hashtags.hashtag', pymongo.DESCENDING),
+          ('created', pymongo.DESCENDING), ('_id', pymongo.DESCENDING)], {}),
+        # Flagged posts on the dashboard, only a few posts are ever flagged
+        ([('flags', pymongo.DESCENDING)],
+         {'partialFilterExpression': {'flags': {'$gt': 0}}}),
+    ],
+}
+
+# Indexes from older versions which are covered by the ones above
+REDUNDANT_INDEXES = {
+    'posts': ['user_id_-1', 'reply_to_-1', 'hashtags.hashtag_-1',
+              'user_id_-1_created_-1__id_-1',
+              'reply_to_-1_created_-1__id_-1'],
+}
+
+
+QueryShape = namedtuple('QueryShape', 'collection lookup sort')
+
+# The shape of the queries run all the time. Values do not matter, only which
+# fields are used and how.
+QUERY_SHAPES = {
+    # pjuu.posts.backend.get_global_feed, pjuu.lib.timelines and
+    # pjuu.lib.hot.rebuild_hot_feed
+    'global_feed': QueryShape('posts', {
+        'reply_to': {'$exists': False},
+        'permission': {'$lte': k.PERM_PJUU}
+    }, LISTING_SORT),
+    # pjuu.posts.backend.get_posts
+    'user_posts': QueryShape('posts', {
+        'user_id': 'user_id',
+        'reply_to': {'$exists': False},
+        'permission': {'$lte': k.PERM_APPROVED}
+    }, LISTING_SORT),
+    # pjuu.posts.backend.back_feed
+    'back_feed': QueryShape('posts', {
+        'user_id': 'user_id',
+        'reply_to': None,
+        'permission': {'$lte': k.PERM_PJUU}
+    }, [('created', pymongo.DESCENDING)]),
+    # pjuu.posts.backend.rebuild_feed and
+    # pjuu.users.backend.merge_pulled_posts
+    'followed_posts': QueryShape('posts', {
+        'user_id': {'$in': ['user_id1', 'user_id2']},
+        'reply_to': {'$exists': False},
+        '$or': [
+            {'permission': {'$lte': k.PERM_PJUU}},
+            {'user_id': {'$in': ['user_id1']}}
+        ]
+    }, [('created', pymongo.DESCENDING)]),
+    # pjuu.posts.backend.get_replies
+    'replies': QueryShape('posts', {
+        'reply_to': 'post_id'
+    }, LISTING_SORT),
+    # pjuu.posts.backend.get_hashtagged_posts
+    'hashtag': QueryShape('posts', {
+        'hashtags.hashtag': 'hashtag',
+        'reply_to': {'$exists': False}
+    }, LISTING_SORT),
+    # pjuu.posts.stats.get_stats
+    'flagged': QueryShape('posts', {
+        'flags': {'$gt': 0}
+    }, [('flags', pymongo.DESCENDING)]),
+}
+
+
+def drop_redundant_indexes():
+    """Drop indexes left by older versions of Pjuu which are covered by
+    `INDEXES`.
+
+    :returns: The number of indexes dropped
+    :rtype: int
+
+    """
+    dropped = 0
+    for collection, names in REDUNDANT_INDEXES.items():
+        existing = m.db[collection].index_information()
+        for name in names:
+            if name in existing:
+                try:
+                    m.db[collection].drop_index(name)
+                    dropped += 1
+                except OperationFailure:  # pragma: no cover
+                    # Someone else got there first
+                    pass
+    return dropped
+
+
 def ensure_indexes():
     """Creates all our MongoDB indexes.
 
@@ -22,35 +148,11 @@ def ensure_indexes():
     lookup a document by a field that is not in here, ensure you need it! If
     it is a one off like how many users are banned it doesn't need to be here.
     If you look up by a key all the time (new feature) it will probably need to
-    be indexed.
+    be indexed, add it and its shape to `QUERY_SHAPES`.
 
     """
-    # User indexes
-    # User name and e-mail address have to be unique across the database
-    m.db.users.ensure_index(
-        [('username', pymongo.DESCENDING)],
-        unique=True
-    )
-    m.db.users.ensure_index(
-        [('email', pymongo.DESCENDING)],
-        unique=True
-    )
-    # Set TTL indexes for newly created users (24 hour TTL)
-    m.db.users.ensure_index(
-        [('ttl', pymongo.DESCENDING)],
-        expireAfterSeconds=k.EXPIRE_24HRS
-    )
-
-    # Post indexes
-    # Allow us to see all posts made by a user
-    m.db.posts.ensure_index(
-        [('user_id', pymongo.DESCENDING)]
-    )
-    # Allow us to find all replies on a post
-    m.db.posts.ensure_index(
-        [('reply_to', pymongo.DESCENDING)]
-    )
-    # Index hash tags within posts
-    m.db.posts.ensure_index(
-        [('hashtags.hashtag', pymongo.DESCENDING)]
-    )
+    for collection, indexes in INDEXES.items():
+        for keys, options in indexes:
+            m.db[collection].ensure_index(keys, **options)
+
+    drop_redundant_indexes()
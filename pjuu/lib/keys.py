@@ -61,6 +61,26 @@ USER_APPROVED = "{{user:{0}}}:approved"
 # Returns: zset
 USER_ALERTS = "{{user:{0}}}:alerts"
 
+# Number of alerts the user has not seen yet
+# Returns: str (int)
+USER_ALERTS_UNREAD = "{{user:{0}}}:alerts:unread"
+
+# Bumped every time the user document changes
+# Returns: str (int)
+USER_VERSION = "{{user:{0}}}:version"
+
+# Short lived copy of the user for loading the signed in user (JSON)
+# Returns: str
+USER_SESSION = "{{user:{0}}}:session"
+
+# Cached author card of the user (username, avatar, donated and active)
+# Returns: hash
+AUTHOR_CACHE = "{{user:{0}}}:author"
+
+# Changes to the users counters (score) not yet written to MongoDB
+# Returns: hash
+USER_COUNTERS = "{{user:{0}}}:counters"
+
 # Post related keys
 
 # Returns: zset
@@ -72,17 +92,107 @@ POST_SUBSCRIBERS = "{{post:{0}}}:subscribers"
 # Returns: zset
 POST_FLAGS = "{{post:{0}}}:flags"
 
+# Cached copy of the post document (JSON)
+# Returns: str
+POST_CACHE = "{{post:{0}}}:cache"
+
+# Changes to the posts counters (score, comment_count and flags) not yet
+# written to MongoDB
+# Returns: hash
+POST_COUNTERS = "{{post:{0}}}:counters"
+
+# The alert id of the alert of type {1} new alerts about the post are merged
+# in to, expires at the end of the window
+# Returns: str
+POST_ALERT_AGGREGATE = "{{post:{0}}}:alerts:{1}"
+
 # Alert related keys
 
 # Return: hash
 ALERT = "{{alert:{0}}}"
 
+# Users who caused a merged alert, scored by when they first did
+# Return: zset
+ALERT_ACTORS = "{{alert:{0}}}:actors"
+
 # Other keys
 
 # Authentication tokens
 # Return: str
 TOKEN = "{{token:{0}}}"
 
+# When each user was last seen. Users who are not in here are never dormant.
+# Return: zset
+USERS_LAST_SEEN = "{users}:last_seen"
+
+# Every users score, the leaderboard
+# Return: zset
+USERS_LEADERBOARD = "{users}:leaderboard"
+
+# Documents with counter changes waiting to be written, formatted with the
+# collection name
+# Return: set
+DIRTY_COUNTERS = "{{counters:{0}}}:dirty"
+
+# Authors whose posts are pulled in to feeds on read rather than fanned out
+# Return: set
+PULL_AUTHORS = "{feeds}:pull"
+
+# Newest posts in the global feed, formatted with the permission level
+# Returns: zset
+GLOBAL_TIMELINE = "{{global:{0}}}:timeline"
+
+# Posts ranked by their hot score, formatted with the permission level
+# Returns: zset
+HOT_FEED = "{{hot:{0}}}:feed"
+
+# The points (score and comments) of each post in the hot feed
+# Returns: hash
+HOT_POINTS = "{{hot:{0}}}:points"
+
+# Newest posts with a hashtag
+# Returns: zset
+HASHTAG_TIMELINE = "{{hashtag:{0}}}:timeline"
+
+# Set once a timeline has been built and can be read, formatted with the
+# timelines key
+# Returns: str
+TIMELINE_BUILT = "{0}:built"
+
+# Lock held while a timeline is rebuilt, formatted with the timelines key
+# Returns: str
+TIMELINE_REBUILD = "{0}:rebuild"
+
+# Cached number of posts in the global feed, formatted with the permission
+# Return: str
+GLOBAL_COUNT = "{{global:{0}}}:count"
+
+# Cached number of posts with a hashtag
+# Return: str
+HASHTAG_COUNT = "{{hashtag:{0}}}:count"
+
+# Number of posts made with each hashtag in a time bucket, formatted with the
+# permission level, the bucket size (minute or hour) and the bucket number
+# Returns: zset
+TRENDING_BUCKET = "{{trending:{0}}}:{1}:{2}"
+
+# Cached trending hashtags, formatted with the permission level and the
+# window (hour or day)
+# Returns: zset
+TRENDING = "{{trending:{0}}}:{1}"
+
+# Hit and miss counts of the post cache
+# Return: hash
+POST_CACHE_STATS = "{cache:posts}:stats"
+
+# Hit and miss counts of the author card cache
+# Return: hash
+AUTHOR_CACHE_STATS = "{cache:authors}:stats"
+
+# Running totals of feed fan-out timings
+# Return: hash
+FANOUT_STATS = "{fanout}:stats"
+
 # Tip names
 # Uses around the site to discover valid tip name
 # NOT TECHNICALLY A KEY BUT WE NEED TO KNOW
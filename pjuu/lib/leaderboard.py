@@ -0,0 +1,124 @@
+# -*- coding: utf8 -*-
+
+"""Leaderboard of users by score.
+
+The score of every user is mirrored in the Redis sorted set
+``USERS_LEADERBOARD`` so the top users and a users rank can be read without
+sorting the users collection. Users are added when their account is created,
+scores change with `vote_post` and users leave when their account is
+deleted.
+
+``scripts/rebuild_leaderboard.py`` rebuilds it from MongoDB, run it after
+Redis has lost data and when deploying the leaderboard for the first time.
+
+:license: AGPL v3, see LICENSE for more details
+:copyright: 2014-2023 Joe Doherty
+
+"""
+
+# Pjuu imports
+from pjuu import author_cache, mongo as m, redis as r
+from pjuu.lib import keys as k
+from pjuu.lib.counters import flush_counters
+from pjuu.lib.pagination import Pagination
+
+
+def add_user(user_id, score=0):
+    """Add a user to the leaderboard."""
+    r.zadd(k.USERS_LEADERBOARD, {user_id: score})
+
+
+def change_score(user_id, amount):
+    """Add `amount` (which may be negative) to a users score."""
+    r.zincrby(k.USERS_LEADERBOARD, amount, user_id)
+
+
+def remove_user(user_id):
+    """Take a user off the leaderboard."""
+    r.zrem(k.USERS_LEADERBOARD, user_id)
+
+
+def get_rank(user_id):
+    """Returns the rank of a user, 1 is the top, or None if they are not on
+    the leaderboard.
+
+    """
+    rank = r.zrevrank(k.USERS_LEADERBOARD, user_id)
+    return rank + 1 if rank is not None else None
+
+
+def get_top_users(page=1, per_page=25):
+    """Returns a page of the leaderboard, highest score first.
+
+    Each item has the users `_id`, `username`, `avatar`, `score` and
+    `rank`. Users who no longer exist are removed.
+
+    :rtype: Pagination
+
+    """
+    start = (page - 1) * per_page
+
+    pipe = r.pipeline(transaction=False)
+    pipe.zcard(k.USERS_LEADERBOARD)
+    pipe.zrevrange(k.USERS_LEADERBOARD, start, start + per_page - 1,
+                   withscores=True)
+    total, scores = pipe.execute()
+
+    cards = author_cache.get_many([user_id for user_id, _ in scores])
+
+    users = []
+    for rank, (user_id, score) in enumerate(scores, start + 1):
+        card = cards.get(user_id)
+        if card is not None:
+            users.append({
+                '_id': user_id,
+                'username': card.get('username'),
+                'avatar': card.get('avatar'),
+                'score': int(score),
+                'rank': rank
+            })
+
+    # Self cleaning sorted set
+    if len(users) < len(scores):
+        r.zrem(k.USERS_LEADERBOARD,
+               *(set(user_id for user_id, _ in scores) - set(cards)))
+
+    return Pagination(users, total, page, per_page)
+
+
+def rebuild_leaderboard(batch_size=1000):
+    """Rebuild the leaderboard from the scores in MongoDB.
+
+    The new leaderboard is built to the side and swapped in when it is done.
+    Votes made while this runs are lost, they will be back next time it runs.
+
+    :returns: The number of users on the leaderboard
+    :rtype: int
+
+    """
+    # Make sure MongoDB has every score change
+    flush_counters('users')
+
+    building = k.USERS_LEADERBOARD + ':rebuild'
+    r.delete(building)
+
+    total = 0
+    scores = {}
+    for user in m.db.users.find({}, {'score': True}):
+        scores[user.get('_id')] = user.get('score', 0)
+
+        if len(scores) >= batch_size:
+            r.zadd(building, scores)
+            total += len(scores)
+            scores = {}
+
+    if scores:
+        r.zadd(building, scores)
+        total += len(scores)
+
+    if total:
+        r.rename(building, k.USERS_LEADERBOARD)
+    else:
+        r.delete(k.USERS_LEADERBOARD)
+
+    return total
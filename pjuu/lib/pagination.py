@@ -11,23 +11,40 @@ interface to handle the issue.
 """
 
 # Stdlib imports
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+import binascii
+import json
 from math import ceil
 
 
 # Max number of pages (don't worry thats a lot of posts/followers)
 MAX_PAGES = 4294967295
 
+# Cursor pointing past the end of a listing. `before=END` is the last page.
+END = 'end'
+
 
 class Pagination(object):
     """Pagination object. Every page which supports the 'page' should
     use this to provide a consistency.
 
+    Listings which support keyset pagination pass in `prev_cursor` and
+    `next_cursor`. The links then use `before`/`after` cursors and the page
+    number is only used to get to the first page.
+
+    `total` can be a function. It is only called the first time the total is
+    needed, keyset links never need it so it is never counted on those.
+
     """
 
-    def __init__(self, items, total, page=1, per_page=50):
+    def __init__(self, items, total, page=1, per_page=50, prev_cursor=None,
+                 next_cursor=None, keyset=False):
         self.items = items
-        self.total = total
+        self._total = total
         self.per_page = per_page
+        self.prev_cursor = prev_cursor
+        self.next_cursor = next_cursor
+        self.keyset = keyset
         # Ensure page can not be lower than 1
         if page < 1:
             self.page = 1
@@ -38,6 +55,16 @@ class Pagination(object):
         else:
             self.page = page
 
+    @property
+    def total(self):
+        if callable(self._total):
+            self._total = self._total()
+        return self._total
+
+    @total.setter
+    def total(self, value):
+        self._total = value
+
     @property
     def pages(self):
         """Calculate the total number of pages
@@ -51,6 +78,9 @@ class Pagination(object):
 
     @property
     def has_pages(self):
+        if self.keyset:
+            return self.prev_cursor is not None or \
+                self.next_cursor is not None or self.page > 1
         return (self.page < self.pages) or (self.page > 1)
 
     @property
@@ -75,6 +105,36 @@ class Pagination(object):
     def last_page(self):
         return self.pages
 
+    # Query string arguments for the links to other pages, None if there is
+    # no such page.
+
+    @property
+    def first_args(self):
+        return {'page': self.first_page}
+
+    @property
+    def prev_args(self):
+        if self.keyset and self.prev_cursor is not None:
+            return {'before': self.prev_cursor}
+        elif self.prev_page:
+            return {'page': self.prev_page}
+        return None
+
+    @property
+    def next_args(self):
+        if self.keyset:
+            if self.next_cursor is not None:
+                return {'after': self.next_cursor}
+        elif self.next_page:
+            return {'page': self.next_page}
+        return None
+
+    @property
+    def last_args(self):
+        if self.keyset:
+            return {'before': END}
+        return {'page': self.last_page}
+
 
 def handle_page(request):
     """Will handle passing 'page' to an view and ensure it is safe
@@ -95,3 +155,84 @@ def handle_page(request):
         # If there was a problem presume the page is 1
         page = 1
     return page
+
+
+def encode_cursor(document):
+    """Returns an opaque cursor for the position of `document` in a listing
+    sorted by `(created, _id)`.
+
+    """
+    value = json.dumps([document.get('created'), document.get('_id')],
+                       separators=(',', ':'))
+    return urlsafe_b64encode(value.encode('utf-8')).decode('ascii') \
+        .rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Returns the `(created, _id)` from a cursor made by `encode_cursor`,
+    `END` if it is the end cursor or None if it is not valid.
+
+    """
+    if cursor == END:
+        return END
+
+    try:
+        cursor = cursor.encode('ascii')
+        cursor += b'=' * (-len(cursor) % 4)
+        value = json.loads(urlsafe_b64decode(cursor))
+        created, _id = value
+        float(created)
+        if not isinstance(_id, str):
+            raise ValueError
+    except (AttributeError, TypeError, ValueError, UnicodeError,
+            binascii.Error):
+        return None
+
+    return created, _id
+
+
+def handle_cursor(request):
+    """Will handle passing the `before` and `after` cursors to a view.
+
+    :returns: dict of the decoded cursors, pass it to the backend as kwargs
+    :rtype: dict
+
+    """
+    return {
+        'before': decode_cursor(request.args.get('before')),
+        'after': decode_cursor(request.args.get('after'))
+    }
+
+
+def keyset_query(lookup, sort_order=-1, before=None, after=None):
+    """Extends the MongoDB `lookup` so it only matches documents either side
+    of a cursor. The query can be answered from an index on
+    `(..., created, _id)` no matter how deep in to the listing it is.
+
+    `after` are the documents which follow the cursor in the listing order,
+    `before` the ones which come ahead of it. `before=END` is the last page.
+
+    :returns: The lookup, the sort and if the results have to be reversed
+              to be in listing order.
+    :rtype: tuple
+
+    """
+    sort_order = 1 if sort_order > 0 else -1
+    reverse = before is not None
+
+    if reverse:
+        cursor = before
+        direction = -sort_order
+    else:
+        cursor = after
+        direction = sort_order
+
+    if cursor is not None and cursor != END:
+        op = '$gt' if direction > 0 else '$lt'
+        created, _id = cursor
+        lookup = {'$and': [lookup, {'$or': [
+            {'created': {op: created}},
+            {'created': created, '_id': {op: _id}}
+        ]}]}
+
+    return lookup, [('created', direction), ('_id', direction)], reverse
@@ -0,0 +1,360 @@
+# -*- coding: utf8 -*-
+
+"""Lua scripts which run inside Redis.
+
+Scripts are loaded once when the application is created and are then called
+by their SHA with EVALSHA. If Redis has lost the script (restart, SCRIPT
+FLUSH) it is loaded again automatically by redis-py.
+
+:license: AGPL v3, see LICENSE for more details
+:copyright: 2014-2023 Joe Doherty
+
+"""
+
+# 3rd party imports
+from redis.exceptions import ConnectionError
+
+
+# Add one or more posts to one or more feeds and trim them.
+#
+# Trimming is amortized, it only happens when a feed is larger than its cap
+# plus some slack. It is then cut back to the cap.
+#
+# KEYS: The feeds to add the posts to
+# ARGV[1]: Maximum feed size
+# ARGV[2]: Number of items a feed may grow over its maximum before trimming
+# ARGV[3...]: score, post_id pairs (as ZADD)
+FEED_ADD = """
+local cap = tonumber(ARGV[1])
+local limit = cap + tonumber(ARGV[2])
+
+for _, key in ipairs(KEYS) do
+    redis.call('ZADD', key, unpack(ARGV, 3))
+    if redis.call('ZCARD', key) > limit then
+        redis.call('ZREMRANGEBYRANK', key, 0, -(cap + 1))
+    end
+end
+
+return #KEYS
+"""
+
+
+# Write a document read from MongoDB to a cache, unless it was invalidated
+# since the read started.
+#
+# KEYS[1]: The cached document
+# KEYS[2]: The documents generation, changed by every invalidate
+# ARGV[1]: The generation read before MongoDB was read, '' if there was none
+# ARGV[2]: Seconds until the document expires
+# ARGV[3]: The document as JSON or
+# ARGV[3...]: field, value pairs for a hash (as HSET)
+CACHE_SET = """
+if (redis.call('GET', KEYS[2]) or '') ~= ARGV[1] then
+    return 0
+end
+
+if #ARGV == 3 then
+    redis.call('SETEX', KEYS[1], ARGV[2], ARGV[3])
+else
+    redis.call('DEL', KEYS[1])
+    redis.call('HSET', KEYS[1], unpack(ARGV, 3))
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+
+return 1
+"""
+
+
+# Add a post to one or more hashtag timelines and trim them.
+#
+# Only timelines which are built, or are being built, are written to. The
+# rest are read from MongoDB. A timeline has the same expiry as its built
+# marker.
+#
+# KEYS: timeline, built marker, rebuild lock triples
+# ARGV[1]: Maximum timeline size
+# ARGV[2]: Number of posts a timeline may grow over its maximum before
+#          trimming
+# ARGV[3]: The posts created time
+# ARGV[4]: The post id
+TIMELINE_ADD = """
+local cap = tonumber(ARGV[1])
+local limit = cap + tonumber(ARGV[2])
+local added = 0
+
+for i = 1, #KEYS, 3 do
+    if redis.call('EXISTS', KEYS[i + 1], KEYS[i + 2]) > 0 then
+        redis.call('ZADD', KEYS[i], ARGV[3], ARGV[4])
+        if redis.call('ZCARD', KEYS[i]) > limit then
+            redis.call('ZREMRANGEBYRANK', KEYS[i], 0, -(cap + 1))
+        end
+
+        local ttl = redis.call('PTTL', KEYS[i + 1])
+        if ttl > 0 then
+            redis.call('PEXPIRE', KEYS[i], ttl)
+        end
+
+        added = added + 1
+    end
+end
+
+return added
+"""
+
+
+# Merge a new alert in to an existing one.
+#
+# The user who caused the new alert is added to the actors and the alert takes
+# on the new alerts fields, so it shows the most recent user and time. Actors
+# keep the time they first caused the alert. Nothing happens if the alert no
+# longer exists.
+#
+# KEYS[1]: The alert hash
+# KEYS[2]: The alerts actors
+# ARGV[1]: The user id of the new actor
+# ARGV[2]: The timestamp of the new alert
+# ARGV[3]: Seconds until the alert expires
+# ARGV[4...]: field, value pairs to set on the alert (as HSET)
+ALERT_MERGE = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+
+redis.call('ZADD', KEYS[2], 'NX', ARGV[2], ARGV[1])
+redis.call('HSET', KEYS[1], 'actors', redis.call('ZCARD', KEYS[2]),
+           unpack(ARGV, 4))
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+
+return 1
+"""
+
+
+# Take alerts which could not be shown off a users unread count.
+#
+# The count is never taken below zero. A count which does not exist is left
+# alone, it is counted again from the users alerts when it is next needed.
+#
+# KEYS[1]: The users unread count
+# ARGV[1]: The number of alerts to take off
+# Returns: The unread count now or nil if there is no count
+UNREAD_DECR = """
+local unread = tonumber(redis.call('GET', KEYS[1]))
+if unread == nil then
+    return false
+end
+
+unread = math.max(unread - tonumber(ARGV[1]), 0)
+redis.call('SET', KEYS[1], unread)
+
+return unread
+"""
+
+
+# Vote on a post.
+#
+# Votes are stored as the time of the vote with the sign of the vote. A vote
+# may be changed or reversed until it is older than the timeout.
+#
+# KEYS[1]: The posts votes
+# ARGV[1]: The user id of the voter
+# ARGV[2]: The user id of the posts author
+# ARGV[3]: The vote (1 or -1)
+# ARGV[4]: The time of the vote
+# ARGV[5]: The time to check the timeout against
+# ARGV[6]: Seconds a vote can be changed for
+# Returns: {status, result, delta}. Status is 0 if the vote counted, 1 if it
+#          is the authors own post and 2 if the user has already voted. Result
+#          is the users vote now and delta the change to the posts score.
+VOTE = """
+local amount = tonumber(ARGV[3])
+local voted = redis.call('ZSCORE', KEYS[1], ARGV[1])
+
+if not voted then
+    if ARGV[1] == ARGV[2] then
+        return {1, 0, 0}
+    end
+
+    redis.call('ZADD', KEYS[1], amount * tonumber(ARGV[4]), ARGV[1])
+    return {0, amount, amount}
+end
+
+voted = tonumber(voted)
+if math.abs(voted) + tonumber(ARGV[6]) <= tonumber(ARGV[5]) then
+    return {2, 0, 0}
+end
+
+local previous = 1
+if voted < 0 then
+    previous = -1
+end
+
+-- Voting the same way again reverses the vote
+if amount == previous then
+    redis.call('ZREM', KEYS[1], ARGV[1])
+    return {0, 0, -previous}
+end
+
+redis.call('ZADD', KEYS[1], amount * tonumber(ARGV[4]), ARGV[1])
+return {0, amount, amount * 2}
+"""
+
+
+# The part of a hot score which comes from a posts points, log10 so the first
+# 10 points count as much as the next 90.
+HOT_ORDER = """
+local function order(points)
+    local sign = 0
+    if points > 0 then
+        sign = 1
+    elseif points < 0 then
+        sign = -1
+    end
+    return sign * math.log10(math.max(math.abs(points), 1))
+end
+"""
+
+
+# Add a new post to one or more hot sets and trim them.
+#
+# Posts start with no points. Posts trimmed from a set lose their points.
+#
+# KEYS: hot set, points hash pairs
+# ARGV[1]: The post id
+# ARGV[2]: The posts score with no points (its age part)
+# ARGV[3]: Maximum hot set size
+# ARGV[4]: Number of posts a set may grow over its maximum before trimming
+HOT_ADD = """
+local cap = tonumber(ARGV[3])
+local limit = cap + tonumber(ARGV[4])
+
+for i = 1, #KEYS, 2 do
+    redis.call('ZADD', KEYS[i], ARGV[2], ARGV[1])
+    redis.call('HSET', KEYS[i + 1], ARGV[1], 0)
+
+    if redis.call('ZCARD', KEYS[i]) > limit then
+        local removed = redis.call('ZRANGE', KEYS[i], 0, -(cap + 1))
+        redis.call('ZREMRANGEBYRANK', KEYS[i], 0, -(cap + 1))
+        redis.call('HDEL', KEYS[i + 1], unpack(removed))
+    end
+end
+
+return #KEYS / 2
+"""
+
+
+# Change the points of a post in the hot sets it is in.
+#
+# The age part of the score is what is left after taking away the order of
+# the old points, so it never has to be worked out again.
+#
+# KEYS: hot set, points hash pairs
+# ARGV[1]: The post id
+# ARGV[2]: The change in points
+HOT_UPDATE = HOT_ORDER + """
+local changed = 0
+
+for i = 1, #KEYS, 2 do
+    local score = redis.call('ZSCORE', KEYS[i], ARGV[1])
+    if score then
+        local old = tonumber(redis.call('HGET', KEYS[i + 1], ARGV[1]) or 0)
+        local new = old + tonumber(ARGV[2])
+        redis.call('HSET', KEYS[i + 1], ARGV[1], new)
+        redis.call('ZADD', KEYS[i], tonumber(score) - order(old) + order(new),
+                   ARGV[1])
+        changed = changed + 1
+    end
+end
+
+return changed
+"""
+
+
+# Count hashtags in one or more trending buckets and trim them.
+#
+# Counts which drop to 0 are removed. Buckets only have their expiry set and
+# are only trimmed when counting up, trimming drops the least used hashtags.
+#
+# KEYS: Trending buckets
+# ARGV[1]: The amount to add to each hashtag, 1 or -1
+# ARGV[2]: Maximum hashtags in a bucket
+# ARGV[3]: Number of hashtags a bucket may grow over its maximum before
+#          trimming
+# ARGV[4...]: The seconds each bucket in KEYS expires after, then the
+#             hashtags
+TRENDING_COUNT = """
+local amount = tonumber(ARGV[1])
+local cap = tonumber(ARGV[2])
+local limit = cap + tonumber(ARGV[3])
+local first = 4 + #KEYS
+
+for i, key in ipairs(KEYS) do
+    for j = first, #ARGV do
+        local count = tonumber(redis.call('ZINCRBY', key, amount, ARGV[j]))
+        if count <= 0 then
+            redis.call('ZREM', key, ARGV[j])
+        end
+    end
+
+    if amount > 0 then
+        redis.call('EXPIRE', key, ARGV[3 + i])
+
+        if redis.call('ZCARD', key) > limit then
+            redis.call('ZREMRANGEBYRANK', key, 0, -(cap + 1))
+        end
+    end
+end
+
+return #KEYS
+"""
+
+
+SOURCES = {
+    'alert_merge': ALERT_MERGE,
+    'cache_set': CACHE_SET,
+    'feed_add': FEED_ADD,
+    'hot_add': HOT_ADD,
+    'hot_update': HOT_UPDATE,
+    'timeline_add': TIMELINE_ADD,
+    'trending_count': TRENDING_COUNT,
+    'unread_decr': UNREAD_DECR,
+    'vote': VOTE,
+}
+
+
+class Scripts(object):
+    """Registry of Pjuu's Lua scripts.
+
+    Scripts are available as attributes named after their entry in
+    ``SOURCES``, eg. ``scripts.feed_add(keys=[...], args=[...])``.
+
+    :param app: Flask instance
+    """
+
+    def __init__(self, app=None):
+        self.app = app
+        self.scripts = {}
+
+    def init_app(self, app, redis):
+        self.app = app
+
+        # There is no application context yet so get the connection the
+        # Flask-Redis object created for this app
+        connection = app.extensions['redis'][redis.config_prefix]
+
+        for name, source in SOURCES.items():
+            self.scripts[name] = connection.register_script(source)
+
+        # Load the scripts up front so the first call is an EVALSHA. If Redis
+        # is not there yet they will be loaded on first use.
+        try:
+            for script in self.scripts.values():
+                connection.script_load(script.script)
+        except ConnectionError:  # pragma: no cover
+            pass
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__['scripts'][name]
+        except KeyError:
+            raise AttributeError(name)
@@ -0,0 +1,250 @@
+# -*- coding: utf8 -*-
+
+"""Materialized timelines for the global and hashtag feeds.
+
+Each timeline is a sorted set of the newest ``TIMELINE_MAX_SIZE`` top-level
+post ids scored by their `created` time. There is one global timeline per
+permission level (holding every post the level can see) and one per hashtag.
+They are written in `create_post` and cleaned up in `delete_post`.
+
+A timeline is only read once it has been built from MongoDB, until then (and
+for anything older than what the timeline holds) MongoDB answers the query.
+Cold timelines are rebuilt in the background the first time they are read,
+``scripts/rebuild_timelines.py`` rebuilds the global ones and those of the
+trending hashtags.
+
+Hashtag timelines expire if they are not read for ``HASHTAG_TIMELINE_TTL``
+seconds so only the hashtags people are reading are kept in Redis. Posts are
+not written to hashtag timelines which are not built.
+
+:license: AGPL v3, see LICENSE for more details
+:copyright: 2014-2023 Joe Doherty
+
+"""
+
+# 3rd party imports
+from flask import current_app as app
+# Pjuu imports
+from pjuu import celery, mongo as m, redis as r, scripts
+from pjuu.lib import keys as k
+from pjuu.lib.fanout import add_to_feeds
+from pjuu.lib.pagination import END, encode_cursor
+
+
+# Permission levels which have a global timeline
+GLOBAL_LEVELS = (k.PERM_PUBLIC, k.PERM_PJUU)
+
+
+def get_global_keys(post):
+    """Returns the keys of the global timelines `post` belongs in."""
+    if 'reply_to' in post:
+        return []
+
+    permission = post.get('permission', k.PERM_PUBLIC)
+    return [k.GLOBAL_TIMELINE.format(level) for level in GLOBAL_LEVELS
+            if permission <= level]
+
+
+def get_hashtag_keys(post):
+    """Returns the keys of the hashtag timelines `post` belongs in."""
+    if 'reply_to' in post:
+        return []
+
+    hashtags = set(hashtag.get('hashtag')
+                   for hashtag in post.get('hashtags', []))
+    return [k.HASHTAG_TIMELINE.format(hashtag) for hashtag in hashtags]
+
+
+def get_timeline_keys(post):
+    """Returns the keys of every timeline `post` belongs in."""
+    return get_global_keys(post) + get_hashtag_keys(post)
+
+
+def add_to_timelines(post):
+    """Add a newly created post to its global timelines and those of its
+    hashtag timelines which are built.
+
+    """
+    max_size = app.config.get('TIMELINE_MAX_SIZE', 1000)
+
+    add_to_feeds(get_global_keys(post),
+                 {post.get('_id'): post.get('created')}, max_size)
+
+    keys = []
+    for key in get_hashtag_keys(post):
+        keys.extend((key, k.TIMELINE_BUILT.format(key),
+                     k.TIMELINE_REBUILD.format(key)))
+
+    if keys:
+        scripts.timeline_add(keys=keys, args=[
+            max_size, app.config.get('FEED_TRIM_SLACK', 100),
+            post.get('created'), post.get('_id')])
+
+
+def remove_from_timelines(post):
+    """Remove a deleted post from its timelines."""
+    pipe = r.pipeline(transaction=False)
+    for key in get_timeline_keys(post):
+        pipe.zrem(key, post.get('_id'))
+    pipe.execute()
+
+
+def build_timeline(key, lookup, max_size=None, ttl=None):
+    """Fill the timeline `key` with the newest posts matching `lookup` and
+    mark it as ready to be read. If there is a `ttl` the timeline expires
+    after that many seconds unless it is read.
+
+    Posts are added to what is already there, anything created while this
+    runs is kept.
+
+    """
+    if max_size is None:
+        max_size = app.config.get('TIMELINE_MAX_SIZE', 1000)
+
+    # Posts created while MongoDB is read are written to the timeline as long
+    # as the lock is held
+    r.set(k.TIMELINE_REBUILD.format(key), 1, ex=60)
+
+    cursor = m.db.posts.find(lookup, {'created': True}).sort(
+        [('created', -1), ('_id', -1)]).limit(max_size)
+    posts = dict((post.get('_id'), post.get('created')) for post in cursor)
+
+    pipe = r.pipeline(transaction=False)
+    if posts:
+        pipe.zadd(key, posts)
+    pipe.zremrangebyrank(key, 0, -(max_size + 1))
+    pipe.set(k.TIMELINE_BUILT.format(key), 1, ex=ttl)
+    if ttl:
+        pipe.expire(key, ttl)
+    pipe.delete(k.TIMELINE_REBUILD.format(key))
+    pipe.execute()
+
+    return len(posts)
+
+
+@celery.task()
+def rebuild_global_timeline(perm, max_size=None):
+    """(Re)build the global timeline for the permission level `perm`.
+
+    The web app passes `max_size` so the worker does not need the same
+    settings.
+
+    """
+    return build_timeline(k.GLOBAL_TIMELINE.format(perm), {
+        'reply_to': {'$exists': False},
+        'permission': {'$lte': perm}
+    }, max_size)
+
+
+@celery.task()
+def rebuild_hashtag_timeline(hashtag, max_size=None, ttl=None):
+    """(Re)build the timeline for `hashtag`."""
+    if ttl is None:
+        ttl = app.config.get('HASHTAG_TIMELINE_TTL', 86400)
+
+    return build_timeline(k.HASHTAG_TIMELINE.format(hashtag), {
+        'hashtags.hashtag': hashtag,
+        'reply_to': {'$exists': False}
+    }, max_size, ttl)
+
+
+def rebuild_timelines(hashtags=()):
+    """Rebuild every global timeline and the timelines of `hashtags`. Other
+    hashtags are built when they are next read.
+
+    :returns: The number of timelines built
+    :rtype: int
+
+    """
+    max_size = app.config.get('TIMELINE_MAX_SIZE', 1000)
+    ttl = app.config.get('HASHTAG_TIMELINE_TTL', 86400)
+
+    for perm in GLOBAL_LEVELS:
+        rebuild_global_timeline(perm, max_size)
+
+    for hashtag in hashtags:
+        rebuild_hashtag_timeline(hashtag, max_size, ttl)
+
+    return len(GLOBAL_LEVELS) + len(hashtags)
+
+
+def get_timeline_page(key, rebuild, page=1, per_page=25, before=None,
+                      after=None, ttl=None):
+    """Returns a page of post ids from the timeline `key`, newest first.
+
+    Takes the same `page`, `before` and `after` arguments as
+    `pjuu.posts.backend.find_page`.
+
+    :param rebuild: Function which rebuilds this timeline if it is cold
+    :param ttl: Seconds the timeline is kept for after this read, if it
+                expires
+    :returns: The post ids and the cursors for the previous and next pages
+              or None if MongoDB has to answer this page.
+    :rtype: tuple or None
+
+    """
+    cursor = before if before is not None else after
+    if cursor == END:
+        cursor = None
+
+    pipe = r.pipeline(transaction=False)
+    if ttl:
+        pipe.expire(key, ttl)
+        pipe.expire(k.TIMELINE_BUILT.format(key), ttl)
+    pipe.exists(k.TIMELINE_BUILT.format(key))
+    pipe.zcard(key)
+    if cursor is not None:
+        pipe.zrevrank(key, cursor[1])
+    results = pipe.execute()
+    built, size, *rank = results[2:] if ttl else results
+
+    if not built:
+        # Only one request has to start the rebuild
+        if r.set(k.TIMELINE_REBUILD.format(key), 1, nx=True, ex=60):
+            rebuild()
+        return None
+
+    # Once the timeline has been trimmed older posts are only in MongoDB
+    complete = size < app.config.get('TIMELINE_MAX_SIZE', 1000)
+
+    # We do not know where the cursor is, it's either deleted or trimmed
+    if cursor is not None and rank[0] is None:
+        return None
+
+    if before == END:
+        if not complete:
+            return None
+        start = max(0, size - per_page)
+        stop = size - 1
+    elif before is not None:
+        start = max(0, rank[0] - per_page)
+        stop = rank[0] - 1
+    elif after is not None:
+        start = rank[0] + 1
+        stop = start + per_page
+    else:
+        start = (page - 1) * per_page
+        stop = start + per_page
+
+    # `stop` asks for one extra post when going forward so we know if there
+    # is another page.
+    if stop >= size and not complete:
+        return None
+
+    posts = r.zrevrange(key, start, stop, withscores=True) \
+        if stop >= start else []
+
+    if before is not None:
+        has_prev, has_next = start > 0, before != END
+    else:
+        has_prev = after is not None or page > 1
+        has_next = len(posts) > per_page
+        posts = posts[:per_page]
+
+    posts = [{'_id': post_id, 'created': created}
+             for post_id, created in posts]
+
+    prev_cursor = encode_cursor(posts[0]) if has_prev and posts else None
+    next_cursor = encode_cursor(posts[-1]) if has_next and posts else None
+
+    return [post.get('_id') for post in posts], prev_cursor, next_cursor
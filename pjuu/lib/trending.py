@@ -0,0 +1,108 @@
+# -*- coding: utf8 -*-
+
+"""Trending hashtags.
+
+Posts are counted against each of their hashtags in a sorted set per minute
+and per hour (a bucket) for each global permission level. Buckets only keep
+their ``TRENDING_BUCKET_SIZE`` most used hashtags, the rest are trimmed, and
+expire once they are too old to be in a window.
+
+A window (the past hour or day) is made by adding up its minute or hour
+buckets. The result is cached for ``TRENDING_CACHE_TTL`` seconds, along with
+a placeholder so a window without any hashtags is cached too.
+
+:license: AGPL v3, see LICENSE for more details
+:copyright: 2014-2023 Joe Doherty
+
+"""
+
+# 3rd party imports
+from flask import current_app as app
+# Pjuu imports
+from pjuu import redis as r, scripts
+from pjuu.lib import keys as k, timestamp
+from pjuu.lib.timelines import GLOBAL_LEVELS
+
+
+# Window name to the bucket it is made of, the buckets size in seconds and how
+# many buckets make the window
+WINDOWS = {
+    'hour': ('minute', 60, 60),
+    'day': ('hour', 3600, 24),
+}
+
+
+def _bucket_keys(level, created):
+    """Returns the bucket keys `created` is counted in with the seconds each
+    expires after.
+
+    """
+    keys = []
+    for bucket, seconds, count in WINDOWS.values():
+        keys.append((k.TRENDING_BUCKET.format(level, bucket,
+                                              int(created // seconds)),
+                     seconds * (count + 1)))
+    return keys
+
+
+def count_hashtags(post, amount=1):
+    """Count the hashtags of `post` in the buckets for when it was created.
+    `amount` is -1 when the post is deleted. Replies are not counted.
+
+    """
+    hashtags = sorted(set(hashtag.get('hashtag')
+                          for hashtag in post.get('hashtags', [])))
+    if not hashtags or 'reply_to' in post:
+        return 0
+
+    permission = post.get('permission', k.PERM_PUBLIC)
+    buckets = []
+    for level in GLOBAL_LEVELS:
+        if permission <= level:
+            buckets.extend(_bucket_keys(level, post.get('created')))
+
+    if not buckets:
+        return 0
+
+    keys, ttls = zip(*buckets)
+    return scripts.trending_count(keys=list(keys), args=[
+        amount, app.config.get('TRENDING_BUCKET_SIZE', 1000),
+        app.config.get('TRENDING_TRIM_SLACK', 100)] + list(ttls) + hashtags)
+
+
+def get_trending(perm, window='hour', count=None):
+    """Returns the most used hashtags in posts `perm` can see over the past
+    `window` (hour or day), most used first.
+
+    :returns: `(hashtag, posts)` tuples
+    :rtype: list
+
+    """
+    if count is None:
+        count = app.config.get('TRENDING_ITEMS', 10)
+
+    key = k.TRENDING.format(perm, window)
+    pipe = r.pipeline(transaction=False)
+    pipe.exists(key)
+    pipe.zrevrange(key, 0, count - 1, withscores=True)
+    exists, hashtags = pipe.execute()
+
+    if not exists:
+        bucket, seconds, buckets = WINDOWS[window]
+        now = int(timestamp() // seconds)
+
+        pipe = r.pipeline()
+        pipe.zunionstore(key, [
+            k.TRENDING_BUCKET.format(perm, bucket, number)
+            for number in range(now - buckets + 1, now + 1)])
+        pipe.zremrangebyrank(
+            key, 0, -(app.config.get('TRENDING_BUCKET_SIZE', 1000) + 1))
+        # An empty union is not stored, the placeholder keeps it. It is always
+        # last and is never a hashtag, they are lower case.
+        pipe.zadd(key, {k.NIL_VALUE: float('-inf')})
+        pipe.expire(key, app.config.get('TRENDING_CACHE_TTL', 60))
+        pipe.zrevrange(key, 0, count - 1, withscores=True)
+        hashtags = pipe.execute()[-1]
+
+    return [(hashtag, int(posts)) for hashtag, posts in hashtags
+            if hashtag != k.NIL_VALUE]
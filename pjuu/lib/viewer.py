@@ -0,0 +1,96 @@
+# -*- coding: utf8 -*-
+
+"""Viewer state for a page of posts or users.
+
+The `voted`, `subscribed`, `flagged`, `following`, `follower` and `trusted`
+template filters each need a Redis lookup for every item they are used on.
+`prefetch_viewer_state` does every lookup for a page in one pipeline and
+stores the answers on the items under ``viewer_state``. The filters use these
+and only go to Redis for items which were not prefetched.
+
+:license: AGPL v3, see LICENSE for more details
+:copyright: 2014-2023 Joe Doherty
+
+"""
+
+# Pjuu imports
+from pjuu import redis as r
+from pjuu.lib import keys as k
+
+
+def _post_lookups(pipe, user_id, post_id):
+    """Queue the lookups for a post and return how to store the answers."""
+    pipe.zscore(k.POST_VOTES.format(post_id), user_id)
+    pipe.zrank(k.POST_SUBSCRIBERS.format(post_id), user_id)
+    pipe.zrank(k.POST_FLAGS.format(post_id), user_id)
+    return lambda voted, subscribed, flagged: {
+        'voted': voted or 0,
+        'subscribed': subscribed is not None,
+        'flagged': flagged is not None,
+    }
+
+
+def _user_lookups(pipe, user_id, profile_id):
+    """Queue the lookups for a user and return how to store the answers."""
+    pipe.zrank(k.USER_FOLLOWING.format(user_id), profile_id)
+    pipe.zrank(k.USER_FOLLOWING.format(profile_id), user_id)
+    pipe.zrank(k.USER_APPROVED.format(user_id), profile_id)
+    return lambda following, follower, trusted: {
+        'following': following is not None,
+        'follower': follower is not None,
+        'trusted': trusted is not None,
+    }
+
+
+def prefetch_viewer_state(user_id, items):
+    """Look up how `user_id` relates to each of `items` in a single Redis
+    pipeline and store it in each item's ``viewer_state``.
+
+    Items are posts (and replies) or users, anything else is left alone. For
+    posts this is if the user has voted (the vote as `has_voted` returns it),
+    subscribed or flagged. For users it is if the user follows them, they
+    follow the user and if the user trusts them.
+
+    :param user_id: The user viewing the page, nothing happens if None
+    :type user_id: str
+    :param items: Post and/or user dicts, changed in place
+    :type items: list
+    :returns: The `items`
+    :rtype: list
+
+    """
+    if user_id is None:
+        return items
+
+    pipe = r.pipeline(transaction=False)
+    pending = []
+    for item in items:
+        if not isinstance(item, dict) or item.get('_id') is None:
+            continue
+
+        if item.get('user_id') is not None:
+            pending.append((item, _post_lookups(pipe, user_id,
+                                                item.get('_id'))))
+        elif item.get('username') is not None:
+            pending.append((item, _user_lookups(pipe, user_id,
+                                                item.get('_id'))))
+
+    if not pending:
+        return items
+
+    results = iter(pipe.execute())
+    for item, store in pending:
+        item['viewer_state'] = store(next(results), next(results),
+                                     next(results))
+
+    return items
+
+
+def get_viewer_state(item, name):
+    """Returns the prefetched `name` state of `item` or None if there is
+    not one and the caller needs to look it up itself.
+
+    """
+    if isinstance(item, dict):
+        return item.get('viewer_state', {}).get(name)
+    return None
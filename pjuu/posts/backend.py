@@ -10,15 +10,32 @@ within Redis and MongoDB
 
 
 # 3rd party imports
-from flask import current_app as app, url_for
+from flask import current_app as app
 from jinja2.filters import do_capitalize
+from werkzeug.utils import cached_property
 
 # Pjuu imports
-from pjuu import mongo as m, redis as r, celery, storage
+from pjuu import (mongo as m, redis as r, celery, scripts, storage,
+                  post_cache)
+from pjuu.auth.utils import get_user, hydrate_authors
 from pjuu.lib import keys as k, timestamp, get_uuid
-from pjuu.lib.alerts import BaseAlert, AlertManager
-from pjuu.lib.pagination import Pagination
+from pjuu.lib.alerts import (BaseAlert, AlertManager, alert_link,
+                             register_alert)
+from pjuu.lib.counters import (apply_counters, clear_counter,
+                               delete_counters, incr_counter, incr_counters)
+from pjuu.lib.fanout import (active_users, add_to_feeds, fan_out,
+                             get_dormant_seconds, get_fan_out_settings)
+from pjuu.lib.hot import (add_to_hot, change_points, clean_hot_feed,
+                          get_hot_page, remove_from_hot)
+from pjuu.lib.leaderboard import change_score
+from pjuu.lib.pagination import (END, Pagination, encode_cursor,
+                                 keyset_query)
 from pjuu.lib.parser import parse_post
+from pjuu.lib.timelines import (add_to_timelines, get_timeline_page,
+                                remove_from_timelines,
+                                rebuild_global_timeline,
+                                rebuild_hashtag_timeline)
+from pjuu.lib.trending import count_hashtags
 from pjuu.lib.uploads import process_upload
 
 
@@ -67,34 +84,70 @@ class PostingAlert(BaseAlert):
 
     """
 
-    def __init__(self, user_id, post_id):
+    fields = ('post_id',)
+    captured = BaseAlert.captured + ('author',)
+
+    def __init__(self, user_id, post_id, username=None, author=None):
         # Call the BaseAlert __init__ method
-        super(PostingAlert, self).__init__(user_id)
+        super(PostingAlert, self).__init__(user_id, username)
         self.post_id = post_id
+        if author is not None:
+            self.author = author
 
     def url(self):
-        """Get the user object or the original author for the post.
+        """The link to the post, built from the stored `post_id` and `author`.
 
         Eg. Bob may have tagged you in the post but Brian posted the original
             post. This is needed to generate the URL.
 
         """
-        # Get the author of the posts username so that we can build the URL
-        author = m.db.posts.find_one({'_id': self.post_id},
-                                     {'username': True, '_id': False})
+        return alert_link('posts.view_post', username=self.author,
+                          post_id=self.post_id)
+
+    @cached_property
+    def author(self):
+        """The username of the author of the post. This is captured when the
+        alert is created, it is only looked up for alerts stored without it.
 
-        # Return the username or None
-        return url_for('posts.view_post', username=author.get('username'),
-                       post_id=self.post_id)
+        """
+        # Get the author of the posts username so that we can build the URL
+        post = m.db.posts.find_one({'_id': self.post_id},
+                                   {'username': True, '_id': False})
+        return post.get('username') if post is not None else None
 
     def verify(self):
         """Overwrites the verify() of BaseAlert to check the post exists
 
         """
-        return m.db.users.find_one({'_id': self.user_id}, {}) and \
+        return get_user(self.user_id) is not None and \
             m.db.posts.find_one({'_id': self.post_id}, {})
 
+    @classmethod
+    def verify_many(cls, alerts):
+        """Overwrites the verify_many() of BaseAlert to check the posts exist
+        with one query. This also fills in the `author` used by `url()` if it
+        was not captured.
+
+        """
+        alerts = super(PostingAlert, cls).verify_many(alerts)
+
+        cursor = m.db.posts.find(
+            {'_id': {'$in': list(set(alert.post_id for alert in alerts))}},
+            {'username': True})
+        authors = dict((post.get('_id'), post.get('username'))
+                       for post in cursor)
+
+        valid = []
+        for alert in alerts:
+            if alert.post_id in authors:
+                if 'author' not in alert.__dict__:
+                    alert.author = authors.get(alert.post_id)
+                valid.append(alert)
+
+        return valid
 
+
+@register_alert('tag')
 class TaggingAlert(PostingAlert):
     """Form of all tagging alert messages
 
@@ -102,19 +155,59 @@ class TaggingAlert(PostingAlert):
 
     def prettify(self, for_uid=None):
         return '<a href="{0}">{1}</a> tagged you in a <a href="{2}">post</a>' \
-               .format(url_for('users.profile',
-                               username=self.user.get('username')),
-                       do_capitalize(self.user.get('username')), self.url())
+               .format(self.profile_url(), do_capitalize(self.username),
+                       self.url())
 
 
+@register_alert('comment')
 class CommentingAlert(PostingAlert):
-    """Form of all commenting alert messages
+    """Form of all commenting alert messages. Comments on the same post are
+    merged in to one alert.
 
     """
 
+    # Why the user being shown the alert is subscribed, see `prepare_many`
+    reason = None
+
+    def aggregate_key(self):
+        return k.POST_ALERT_AGGREGATE.format(self.post_id, self.type_code)
+
+    @classmethod
+    def prepare_many(cls, alerts, for_uid):
+        """Overwrites the prepare_many() of BaseAlert to find out why the user
+        is subscribed to each post in one pipeline.
+
+        Users subscribed by commenting were subscribed when they first
+        commented, only the users who commented after them and the user shown
+        are counted.
+
+        """
+        super(CommentingAlert, cls).prepare_many(alerts, for_uid)
+
+        pipe = r.pipeline(transaction=False)
+        for alert in alerts:
+            pipe.zscore(k.POST_SUBSCRIBERS.format(alert.post_id), for_uid)
+            if alert.acted is not None:
+                actors_key = k.ALERT_ACTORS.format(alert.alert_id)
+                pipe.zcount(actors_key, '({}'.format(repr(alert.acted)),
+                            '+inf')
+                pipe.zscore(actors_key, alert.user_id)
+        results = iter(pipe.execute())
+
+        for alert in alerts:
+            alert.reason = next(results)
+            if alert.acted is not None:
+                actors, shown = next(results), next(results)
+                if alert.reason == SubscriptionReasons.COMMENTER:
+                    # The user shown may have first commented before them
+                    alert.actors = actors + int(
+                        shown is not None and shown <= alert.acted)
+
     def prettify(self, for_uid=None):
         # Let's try and work out why this user is being notified of a comment
-        reason = subscription_reason(for_uid, self.post_id)
+        reason = self.reason
+        if reason is None:
+            reason = subscription_reason(for_uid, self.post_id)
 
         if reason == SubscriptionReasons.POSTER:
             sr = 'posted'
@@ -126,12 +219,17 @@ class CommentingAlert(PostingAlert):
             # This should never really happen but let's play ball eh?
             sr = 'are subscribed to'
 
-        return '<a href="{0}">{1}</a> ' \
-               'commented on a <a href="{2}">post</a> you {3}' \
-               .format(url_for('users.profile',
-                               username=self.user.get('username')),
-                       do_capitalize(self.user.get('username')), self.url(),
-                       sr)
+        others = self.others()
+        if others:
+            others = ' and {0} other{1}'.format(others,
+                                                's' if others > 1 else '')
+        else:
+            others = ''
+
+        return '<a href="{0}">{1}</a>{2} ' \
+               'commented on a <a href="{3}">post</a> you {4}' \
+               .format(self.profile_url(), do_capitalize(self.username),
+                       others, self.url(), sr)
 
 
 def create_post(user_id, username, body, reply_to=None, upload=None,
@@ -217,52 +315,68 @@ def create_post(user_id, username, body, reply_to=None, upload=None,
     # Only carry out the rest of the actions if the insert was successful
     if result:
         if reply_to is None:
-            # Add post to authors feed
-            r.zadd(k.USER_FEED.format(user_id), {str(post_id): post_time})
-            # Ensure the feed does not grow to large
-            r.zremrangebyrank(k.USER_FEED.format(user_id), 0, -1000)
+            # Add post to authors feed, this will also ensure the feed does
+            # not grow to large
+            add_to_feeds([k.USER_FEED.format(user_id)],
+                         {str(post_id): post_time})
+
+            # Add the post to the global and hashtag timelines
+            add_to_timelines(post)
+            add_to_hot(post)
+            count_hashtags(post)
 
             # Subscribe the poster to there post
             subscribe(user_id, post_id, SubscriptionReasons.POSTER)
 
             # Alert everyone tagged in the post
-            alert_tagees(mentions, user_id, post_id)
+            alert_tagees(mentions, user_id, post_id, username, username)
 
-            # Append to all followers feeds or approved followers based
-            # on the posts permission
-            if permission < k.PERM_APPROVED:
-                populate_followers_feeds.delay(user_id, post_id, post_time)
+            # Authors with very large audiences are not fanned out. Their
+            # posts are merged in to their followers feeds when they are read
+            # see `users.backend.get_feed`.
+            if is_pull_author(user_id):
+                r.sadd(k.PULL_AUTHORS, user_id)
             else:
-                populate_approved_followers_feeds.delay(
-                    user_id, post_id, post_time
-                )
+                # Posts made while the author was pulled were never pushed,
+                # they are pushed before the author stops being pulled
+                if r.sismember(k.PULL_AUTHORS, user_id):
+                    push_pulled_posts.delay(user_id)
+
+                # Append to all followers feeds or approved followers based
+                # on the posts permission
+                if permission < k.PERM_APPROVED:
+                    populate_followers_feeds.delay(user_id, post_id,
+                                                   post_time,
+                                                   get_fan_out_settings())
+                else:
+                    populate_approved_followers_feeds.delay(
+                        user_id, post_id, post_time, get_fan_out_settings()
+                    )
 
         else:
             # To reduce database look ups on the read path we will increment
             # the reply_to's comment count.
-            m.db.posts.update({'_id': reply_to},
-                              {'$inc': {'comment_count': 1}})
+            incr_counter('posts', reply_to, 'comment_count')
+            change_points(reply_to, app.config.get('HOT_COMMENT_POINTS', 1))
+            # The authors username is kept for the alert below
+            reply_to_post = post_cache.get(reply_to)
 
             # Alert all subscribers to the post that a new comment has been
             # added. We do this before subscribing anyone new
-            alert = CommentingAlert(user_id, reply_to)
-
-            subscribers = []
-            # Iterate through subscribers and let them know about the comment
-            for subscriber_id in get_subscribers(reply_to):
-                # Ensure we don't get alerted for our own comments
-                if subscriber_id != user_id:
-                    subscribers.append(subscriber_id)
+            alert = CommentingAlert(user_id, reply_to, username,
+                                    (reply_to_post or {}).get('username'))
 
-            # Push the comment alert out to all subscribers
-            AlertManager().alert(alert, subscribers)
+            # Push the comment alert out to all subscribers, the manager
+            # ensures we don't get alerted for our own comments
+            AlertManager().alert(alert, get_subscribers(reply_to))
 
             # Subscribe the user to the post, will not change anything if they
             # are already subscribed
             subscribe(user_id, reply_to, SubscriptionReasons.COMMENTER)
 
             # Alert everyone tagged in the post
-            alert_tagees(mentions, user_id, reply_to)
+            alert_tagees(mentions, user_id, reply_to, username,
+                         (reply_to_post or {}).get('username'))
 
         return post_id
 
@@ -270,39 +384,84 @@ def create_post(user_id, username, body, reply_to=None, upload=None,
     return None  # pragma: no cover
 
 
+def is_pull_author(user_id):
+    """Does `user_id` have enough followers that their posts should be pulled
+    in to feeds when read rather than pushed when posted?
+
+    This is controlled by ``FEED_PULL_THRESHOLD``, 0 turns pulling off.
+
+    """
+    threshold = app.config.get('FEED_PULL_THRESHOLD', 0)
+    if not threshold:
+        return False
+
+    return r.zcard(k.USER_FOLLOWERS.format(user_id)) >= threshold
+
+
 @celery.task()
-def populate_followers_feeds(user_id, post_id, timestamp):
+def populate_followers_feeds(user_id, post_id, timestamp, settings=None):
     """Fan out a post_id to all the users followers.
 
     This can be run on a worker to speed the process up.
 
     """
-    # Get a list of ALL users who are following a user
-    followers = r.zrange(k.USER_FOLLOWERS.format(user_id), 0, -1)
-    # This is not transactional as to not hold Redis up.
-    for follower_id in followers:
-        # Add the pid to the list
-        r.zadd(k.USER_FEED.format(follower_id), {str(post_id): timestamp})
-        # Stop followers feeds from growing to large, doesn't matter if it
-        # doesn't exist
-        r.zremrangebyrank(k.USER_FEED.format(follower_id), 0, -1000)
+    fan_out(k.USER_FOLLOWERS.format(user_id), post_id, timestamp, settings)
 
 
 @celery.task()
-def populate_approved_followers_feeds(user_id, post_id, timestamp):
+def populate_approved_followers_feeds(user_id, post_id, timestamp,
+                                      settings=None):
     """Fan out a post_id to all the users approved followers."""
-    # Get a list of ALL users who are following a user
-    followers = r.zrange(k.USER_APPROVED.format(user_id), 0, -1)
-    # This is not transactional as to not hold Redis up.
-    for follower_id in followers:
-        # Add the pid to the list
-        r.zadd(k.USER_FEED.format(follower_id), {str(post_id): timestamp})
-        # Stop followers feeds from growing to large, doesn't matter if it
-        # doesn't exist
-        r.zremrangebyrank(k.USER_FEED.format(follower_id), 0, -1000)
-
-
-def alert_tagees(tagees, user_id, post_id):
+    fan_out(k.USER_APPROVED.format(user_id), post_id, timestamp, settings)
+
+
+@celery.task()
+def push_pulled_posts(user_id):
+    """Push the newest posts of a pulled author in to their followers feeds
+    and then stop pulling their posts. Run when the author drops below
+    ``FEED_PULL_THRESHOLD`` (or it is changed) so the posts they made while
+    they were pulled do not vanish from their followers feeds.
+
+    :returns: The number of posts pushed
+    :rtype: int
+
+    """
+    batch_size = app.config.get('FANOUT_BATCH_SIZE', 500)
+
+    cursor = m.db.posts.find(
+        {'user_id': user_id, 'reply_to': {'$exists': False}},
+        {'created': True, 'permission': True}
+    ).sort('created', -1).limit(app.config.get('FEED_MAX_SIZE', 1000))
+
+    # Approved followers also get the approved only posts
+    posts = {}
+    approved_posts = {}
+    for post in cursor:
+        if post.get('permission', k.PERM_PUBLIC) < k.PERM_APPROVED:
+            posts[post.get('_id')] = post.get('created')
+        approved_posts[post.get('_id')] = post.get('created')
+
+    for key, feed_posts in ((k.USER_FOLLOWERS, posts),
+                            (k.USER_APPROVED, approved_posts)):
+        chunk = []
+        for follower_id, _ in r.zscan_iter(key.format(user_id),
+                                           count=batch_size):
+            chunk.append(follower_id)
+            if len(chunk) >= batch_size:
+                add_to_feeds([k.USER_FEED.format(chunk_id)
+                              for chunk_id in active_users(chunk)],
+                             feed_posts)
+                chunk = []
+
+        add_to_feeds([k.USER_FEED.format(chunk_id)
+                      for chunk_id in active_users(chunk)], feed_posts)
+
+    r.srem(k.PULL_AUTHORS, user_id)
+
+    return len(approved_posts)
+
+
+def alert_tagees(tagees, user_id, post_id, username=None, author=None):
     """Creates a new tagging alert from `user_id` and `post_id` and alerts all
     in the `tagees` list.
 
@@ -312,9 +471,13 @@ def alert_tagees(tagees, user_id, post_id):
     :type tagees: list
     :type user_id: str
     :type post_id: str
+    :param username: The posters username, shown in the alert
+    :type username: str
+    :param author: The username of the author of `post_id`
+    :type author: str
 
     """
-    alert = TaggingAlert(user_id, post_id)
+    alert = TaggingAlert(user_id, post_id, username, author)
 
     seen_user_ids = []
     for tagee in tagees:
@@ -362,14 +525,84 @@ def back_feed(who_id, whom_id):
         {'_id': True, 'created': True},
     ).sort('created', -1).limit(5)
 
-    # Iterate the cursor and append the posts to the users feed
-    for post in posts:
-        timestamp = post.get('created')
-        post_id = post.get('_id')
-        # Place on the feed
-        r.zadd(k.USER_FEED.format(who_id), {str(post_id): timestamp})
-        # Trim the feed to the 1000 max
-        r.zremrangebyrank(k.USER_FEED.format(who_id), 0, -1000)
+    # Append all the posts to the users feed and trim it in one go
+    add_to_feeds([k.USER_FEED.format(who_id)],
+                 dict((str(post.get('_id')), post.get('created'))
+                      for post in posts))
+
+
+def rebuild_feed(user_id):
+    """Rebuild the feed of `user_id` from MongoDB using the users they follow.
+
+    Used when a dormant user comes back and after Redis has lost data. Posts
+    are added to anything already in the feed.
+
+    :returns: The number of posts added to the feed
+    :rtype: int
+
+    """
+    authors = r.zrange(k.USER_FOLLOWING.format(user_id), 0, -1)
+
+    # Approved only posts are included from authors who trust the user
+    pipe = r.pipeline(transaction=False)
+    for author_id in authors:
+        pipe.zscore(k.USER_APPROVED.format(author_id), user_id)
+    trusted_ids = [author_id for author_id, trusted
+                   in zip(authors, pipe.execute()) if trusted is not None]
+
+    # The users own posts are always in their feed
+    authors.append(user_id)
+    trusted_ids.append(user_id)
+
+    posts = m.db.posts.find({
+        'user_id': {'$in': authors},
+        'reply_to': {'$exists': False},
+        '$or': [
+            {'permission': {'$lte': k.PERM_PJUU}},
+            {'user_id': {'$in': trusted_ids}}
+        ]
+    }, {'created': True}).sort('created', -1).limit(
+        app.config.get('FEED_MAX_SIZE', 1000))
+    posts = dict((post.get('_id'), post.get('created')) for post in posts)
+
+    add_to_feeds([k.USER_FEED.format(user_id)], posts)
+
+    dormant_seconds = get_dormant_seconds()
+    if dormant_seconds:
+        r.expire(k.USER_FEED.format(user_id), dormant_seconds)
+
+    return len(posts)
+
+
+def touch_feed(user_id):
+    """Mark `user_id` as seen. Call this whenever a user signs in or reads
+    their feed.
+
+    Feeds expire once their user has been dormant for ``FEED_DORMANT_DAYS``
+    and are no longer fanned out to, so the feed of a returning user is
+    rebuilt.
+
+    :returns: True if the feed was rebuilt
+    :rtype: bool
+
+    """
+    dormant_seconds = get_dormant_seconds()
+    if not dormant_seconds:
+        return False
+
+    now = timestamp()
+
+    pipe = r.pipeline(transaction=False)
+    pipe.zscore(k.USERS_LAST_SEEN, user_id)
+    pipe.zadd(k.USERS_LAST_SEEN, {str(user_id): now})
+    pipe.expire(k.USER_FEED.format(user_id), dormant_seconds)
+    last_seen = pipe.execute()[0]
+
+    if last_seen is not None and last_seen < now - dormant_seconds:
+        rebuild_feed(user_id)
+        return True
+
+    return False
 
 
 def check_post(user_id, post_id, reply_id=None):
@@ -403,12 +636,13 @@ def get_post(post_id):
     """Returns a post. Simple helper function
 
     """
-    post = m.db.posts.find_one({'_id': post_id})
+    post = post_cache.get(post_id)
     # Attach in the e-mail (will be removed with image uploads)
 
     if post is not None:
-        user = m.db.users.find_one({'_id': post.get('user_id')},
-                                   {'avatar': True, 'donated': True})
+        apply_counters('posts', [post])
+
+        user = get_user(post.get('user_id'))
         if user is not None:
             post['user_avatar'] = user.get('avatar')
             post['user_donated'] = user.get('donated', False)
@@ -416,7 +650,107 @@ def get_post(post_id):
     return post
 
 
-def get_global_feed(page=1, per_page=None, perm=0):
+def get_cached_posts(post_ids):
+    """Returns the posts for `post_ids`, in that order, from the post cache.
+    Posts which no longer exist are left out.
+
+    """
+    posts = post_cache.get_many(post_ids)
+    return [posts[post_id] for post_id in post_ids if post_id in posts]
+
+
+def count_posts(lookup, cache_key=None):
+    """Returns a function which counts the posts matching `lookup`, pass it
+    to `Pagination` so the count only happens if the total is used.
+
+    If there is a `cache_key` the count is kept in Redis for
+    ``COUNT_CACHE_TTL`` seconds. Use this for listings which are expensive to
+    count, the total can be that many seconds out of date.
+
+    """
+    def count():
+        if cache_key is not None:
+            total = r.get(cache_key)
+            if total is not None:
+                return int(total)
+
+        total = m.db.posts.find(lookup).count()
+
+        if cache_key is not None:
+            r.setex(cache_key, app.config.get('COUNT_CACHE_TTL', 60), total)
+
+        return total
+
+    return count
+
+
+def find_page(lookup, page=1, per_page=25, sort_order=-1, before=None,
+              after=None, projection=None):
+    """Returns a page of the posts matching `lookup` sorted by `created`.
+
+    If there is a `before` or `after` cursor (see `pjuu.lib.pagination`) the
+    page is found with an index range scan, otherwise `page` is skipped to.
+
+    :returns: The posts and the cursors for the previous and next pages
+    :rtype: tuple
+
+    """
+    query, sort, reverse = keyset_query(lookup, sort_order, before, after)
+
+    cursor = m.db.posts.find(query, projection).sort(sort)
+    if before is None and after is None:
+        cursor = cursor.skip((page - 1) * per_page)
+
+    # The extra post tells us if there is another page
+    posts = list(cursor.limit(per_page + 1))
+    more = len(posts) > per_page
+    posts = posts[:per_page]
+
+    if reverse:
+        posts.reverse()
+        has_prev, has_next = more, before != END
+    else:
+        has_prev, has_next = after is not None or page > 1, more
+
+    prev_cursor = encode_cursor(posts[0]) if has_prev and posts else None
+    next_cursor = encode_cursor(posts[-1]) if has_next and posts else None
+
+    return posts, prev_cursor, next_cursor
+
+
+def find_timeline_page(key, rebuild, lookup, page=1, per_page=25,
+                       before=None, after=None, ttl=None):
+    """Returns a page of posts from the timeline `key`. MongoDB is queried
+    with `lookup` when the timeline can not answer the page.
+
+    See `pjuu.lib.timelines.get_timeline_page`.
+
+    :returns: The posts and the cursors for the previous and next pages
+    :rtype: tuple
+
+    """
+    result = get_timeline_page(key, rebuild, page, per_page, before, after,
+                               ttl)
+
+    if result is None:
+        posts, prev_cursor, next_cursor = find_page(
+            lookup, page, per_page, before=before, after=after,
+            projection={'created': True})
+        return (get_cached_posts([post.get('_id') for post in posts]),
+                prev_cursor, next_cursor)
+
+    post_ids, prev_cursor, next_cursor = result
+    posts = get_cached_posts(post_ids)
+
+    # Remove anything which has gone from MongoDB behind our back
+    if len(posts) < len(post_ids):
+        found = set([post.get('_id') for post in posts])
+        r.zrem(key, *(set(post_ids) - found))
+
+    return posts, prev_cursor, next_cursor
+
+
+def get_global_feed(page=1, per_page=None, perm=0, before=None, after=None):
     if per_page is None:  # pragma: no cover
         per_page = app.config.get('FEED_ITEMS_PER_PAGE')
 
@@ -425,44 +759,44 @@ def get_global_feed(page=1, per_page=None, perm=0):
         'permission': {'$lte': perm}
     }
 
-    total = m.db.posts.find(lookup_dict).count()
-    cursor = m.db.posts.find(lookup_dict).sort(
-        'created', -1).skip((page - 1) * per_page).limit(per_page)
+    total = count_posts(lookup_dict, k.GLOBAL_COUNT.format(perm))
+    posts, prev_cursor, next_cursor = find_timeline_page(
+        k.GLOBAL_TIMELINE.format(perm),
+        lambda: rebuild_global_timeline.delay(
+            perm, app.config.get('TIMELINE_MAX_SIZE', 1000)),
+        lookup_dict, page, per_page, before, after)
 
-    posts = []
-    for post in cursor:
-        posts.append(post)
-
-    # Get a list of unique `user_id`s from all the post.
-    user_ids = list(set([post.get('user_id') for post in posts]))
-    cursor = m.db.users.find({'_id': {'$in': user_ids}},
-                             {'avatar': True, 'donated': True})
-    # Create a lookup dict `{username: email}`
-    users = \
-        dict((user.get('_id'), {
-            'avatar': user.get('avatar'),
-            'donated': user.get('donated', False)
-        }) for user in cursor)
-
-    # Add the e-mails to the posts
-    processed_posts = []
-    for post in posts:
-        post['user_avatar'] = users.get(post.get('user_id')).get('avatar')
-        post['user_donated'] = users.get(post.get('user_id')).get('donated')
-        processed_posts.append(post)
+    posts = hydrate_authors(posts)
+
+    return Pagination(posts, total, page, per_page, prev_cursor, next_cursor,
+                      keyset=True)
+
+
+def get_hot_feed(page=1, per_page=None, perm=0):
+    """Returns the posts `perm` can see ranked by how hot they are as a
+    pagination object. See `pjuu.lib.hot`.
+
+    """
+    if per_page is None:  # pragma: no cover
+        per_page = app.config.get('FEED_ITEMS_PER_PAGE')
+
+    total, pids = get_hot_page(perm, page, per_page)
+    posts = hydrate_authors(get_cached_posts(pids))
+
+    # Clean up posts which no longer exist
+    if len(posts) < len(pids):
+        clean_hot_feed(perm, set(pids) - set(post.get('_id')
+                                             for post in posts))
 
     return Pagination(posts, total, page, per_page)
 
 
-def get_posts(user_id, page=1, per_page=None, perm=0):
+def get_posts(user_id, page=1, per_page=None, perm=0, before=None,
+              after=None):
     """Returns a users posts as a pagination object."""
     if per_page is None:
         per_page = app.config.get('FEED_ITEMS_PER_PAGE')
 
-    # Get the user object we need the email for Gravatar.
-    user = m.db.users.find_one({'_id': user_id},
-                               {'avatar': True, 'donated': True})
-
     lookup_dict = {
         'user_id': user_id,
         'reply_to': {'$exists': False}
@@ -470,70 +804,59 @@ def get_posts(user_id, page=1, per_page=None, perm=0):
 
     lookup_dict['permission'] = {'$lte': perm}
 
-    total = m.db.posts.find(lookup_dict).count()
-    cursor = m.db.posts.find(lookup_dict).sort(
-        'created', -1).skip((page - 1) * per_page).limit(per_page)
+    total = count_posts(lookup_dict)
+    posts, prev_cursor, next_cursor = find_page(
+        lookup_dict, page, per_page, before=before, after=after,
+        projection={'created': True})
 
-    posts = []
-    for post in cursor:
-        post['user_avatar'] = user.get('avatar')
-        post['user_donated'] = user.get('donated', False)
-        posts.append(post)
+    posts = hydrate_authors(
+        get_cached_posts([post.get('_id') for post in posts]))
 
-    return Pagination(posts, total, page, per_page)
+    return Pagination(posts, total, page, per_page, prev_cursor, next_cursor,
+                      keyset=True)
 
 
-def get_replies(post_id, page=1, per_page=None, sort_order=-1):
+def get_replies(post_id, page=1, per_page=None, sort_order=-1, before=None,
+                after=None):
     """Returns all a posts replies as a pagination object."""
     if per_page is None:
         per_page = app.config.get('REPLIES_ITEMS_PER_PAGE')
 
-    total = m.db.posts.find_one({'_id': post_id}).get('comment_count')
-    cursor = m.db.posts.find(
-        {'reply_to': post_id}
-    ).sort(
-        [('created', sort_order)]
-    ).skip((page - 1) * per_page).limit(per_page)
-
-    replies = []
-    for reply in cursor:
-        # We have to get the users email for each post for the gravatar
-        user = m.db.users.find_one(
-            {'_id': reply.get('user_id')},
-            {'avatar': True, 'donated': True})
+    total = apply_counters('posts', [m.db.posts.find_one(
+        {'_id': post_id}, {'comment_count': True})])[0].get('comment_count')
+    posts, prev_cursor, next_cursor = find_page(
+        {'reply_to': post_id}, page, per_page, sort_order, before, after)
 
-        if user is not None:  # pragma: no branch
-            reply['user_avatar'] = user.get('avatar')
-            reply['user_donated'] = user.get('donated', False)
-            replies.append(reply)
+    replies = hydrate_authors(posts)
 
-    return Pagination(replies, total, page, per_page)
+    return Pagination(replies, total, page, per_page, prev_cursor,
+                      next_cursor, keyset=True)
 
 
-def get_hashtagged_posts(hashtag, page=1, per_page=None):
+def get_hashtagged_posts(hashtag, page=1, per_page=None, before=None,
+                         after=None):
     """Returns all posts with `hashtag` in date order."""
     if per_page is None:
         per_page = app.config.get('FEED_ITEMS_PER_PAGE')
 
-    total = m.db.posts.find({
-        'hashtags.hashtag': hashtag,
-        'reply_to': {'$exists': False}}).count()
-    cursor = m.db.posts.find({
+    lookup_dict = {
         'hashtags.hashtag': hashtag,
         'reply_to': {'$exists': False}
-    }).sort('created', -1).skip((page - 1) * per_page).limit(per_page)
+    }
 
-    posts = []
-    for post in cursor:
-        user = m.db.users.find_one(
-            {'_id': post.get('user_id')},
-            {'avatar': True})
+    ttl = app.config.get('HASHTAG_TIMELINE_TTL', 86400)
 
-        if post is not None:  # pragma: no branch
-            post['user_avatar'] = user.get('avatar')
-            posts.append(post)
+    total = count_posts(lookup_dict, k.HASHTAG_COUNT.format(hashtag))
+    posts, prev_cursor, next_cursor = find_timeline_page(
+        k.HASHTAG_TIMELINE.format(hashtag),
+        lambda: rebuild_hashtag_timeline.delay(
+            hashtag, app.config.get('TIMELINE_MAX_SIZE', 1000), ttl),
+        lookup_dict, page, per_page, before, after, ttl)
 
-    return Pagination(posts, total, page, per_page)
+    posts = hydrate_authors(posts)
+
+    return Pagination(posts, total, page, per_page, prev_cursor, next_cursor,
+                      keyset=True)
 
 
 def has_voted(user_id, post_id):
@@ -543,9 +866,12 @@ def has_voted(user_id, post_id):
     return r.zscore(k.POST_VOTES.format(post_id), user_id)
 
 
-def vote_post(user_id, post_id, amount=1, ts=None):
+def vote_post(user_id, post_id, amount=1, ts=None, author_id=None):
     """Handles voting on posts
 
+    The vote is checked and stored by a single Lua script so racing votes
+    from the same user can not be counted twice.
+
     :param user_id: User who is voting
     :type user_id: str
     :param post_id: ID of the post the user is voting on
@@ -554,80 +880,40 @@ def vote_post(user_id, post_id, amount=1, ts=None):
     :type amount: int
     :param ts: Timestamp to use for vote (ONLY FOR TESTING)
     :type ts: int
+    :param author_id: The user id of the posts author if it is already known,
+                      saves looking up the post
+    :type author_id: str
     :returns: -1 if downvote, 0 if reverse vote and +1 if upvote
 
     """
     if ts is None:
         ts = timestamp()
 
-    # Get the comment so we can check who the author is
-    author_uid = get_post(post_id).get('user_id')
+    if author_id is None:
+        # Get the comment so we can check who the author is
+        author_id = get_post(post_id).get('user_id')
 
     # Votes can ONLY ever be -1 or 1 and nothing else
     # we use the sign to store the time and score in one zset score
     amount = 1 if amount >= 0 else -1
 
-    voted = has_voted(user_id, post_id)
-
-    if not voted:
-        if author_uid != user_id:
-            # Store the timestamp of the vote with the sign of the vote
-            r.zadd(k.POST_VOTES.format(post_id), {
-                str(user_id): amount * timestamp()
-            })
-
-            # Update post score
-            m.db.posts.update({'_id': post_id},
-                              {'$inc': {'score': amount}})
-
-            # Update user score
-            m.db.users.update({'_id': author_uid},
-                              {'$inc': {'score': amount}})
-
-            return amount
-        else:
-            raise CantVoteOnOwn
-    elif voted and abs(voted) + k.VOTE_TIMEOUT > ts:
-        # No need to check if user is current user because it can't
-        # happen in the first place
-        # Remove the vote from Redis
-        r.zrem(k.POST_VOTES.format(post_id), user_id)
-
-        previous_vote = -1 if voted < 0 else 1
-
-        # Calculate how much to increment/decrement the scores by
-        # Saves multiple trips to Mongo
-        if amount == previous_vote:
-            if previous_vote < 0:
-                amount = 1
-                result = 0
-            else:
-                amount = -1
-                result = 0
-        else:
-            # We will only register the new vote if it is NOT a vote reversal.
-            r.zadd(k.POST_VOTES.format(post_id), {
-                str(user_id): amount * timestamp()
-            })
-
-            if previous_vote < 0:
-                amount = 2
-                result = 1
-            else:
-                amount = -2
-                result = -1
+    status, result, delta = scripts.vote(
+        keys=[k.POST_VOTES.format(post_id)],
+        args=[user_id, author_id, amount, repr(timestamp()), repr(ts),
+              k.VOTE_TIMEOUT])
 
-        # Update post score
-        m.db.posts.update({'_id': post_id},
-                          {'$inc': {'score': amount}})
+    if status == 1:
+        raise CantVoteOnOwn
+    elif status == 2:
+        raise AlreadyVoted
 
-        # Update user score
-        m.db.users.update({'_id': author_uid},
-                          {'$inc': {'score': amount}})
+    # Update the post and user scores, written to MongoDB later
+    incr_counters([('posts', post_id, 'score', delta),
+                   ('users', author_id, 'score', delta)])
+    change_score(author_id, delta)
+    change_points(post_id, delta)
 
-        return result
-    else:
-        raise AlreadyVoted
+    return result
 
 
 def delete_post(post_id):
@@ -644,15 +930,22 @@ def delete_post(post_id):
 
         # Delete the post from MongoDB
         m.db.posts.remove({'_id': post_id})
+        post_cache.invalidate(post_id)
+        delete_counters('posts', post_id)
 
         if 'upload' in post:
             # If there is an upload, delete it!
             storage.delete(post['upload'])
 
         if 'reply_to' in post:
-            m.db.posts.update({'_id': post['reply_to']},
-                              {'$inc': {'comment_count': -1}})
+            incr_counter('posts', post['reply_to'], 'comment_count', -1)
+            change_points(post['reply_to'],
+                          -app.config.get('HOT_COMMENT_POINTS', 1))
         else:
+            remove_from_timelines(post)
+            remove_from_hot(post)
+            count_hashtags(post, -1)
+
             # Trigger deletion all posts comments if this post isn't a reply
             r.delete(k.POST_SUBSCRIBERS.format(post.get('_id')))
             delete_post_replies(post_id)
@@ -674,6 +967,8 @@ def delete_post_replies(post_id):
 
         # Delete the comment itself from MongoDB
         m.db.posts.remove({'_id': reply_id})
+        post_cache.invalidate(reply_id)
+        delete_counters('posts', reply_id)
 
         # Remove any uploaded files
         if 'upload' in reply:
@@ -721,8 +1016,11 @@ def flag_post(user_id, post_id):
             r.zadd(k.POST_FLAGS.format(post_id), {
                 str(user_id): timestamp()
             })
+            # Flags are rare and the dashboard sorts by them in MongoDB, they
+            # are not left waiting with the other counters
             m.db.posts.update({'_id': post_id},
                               {'$inc': {'flags': 1}})
+            post_cache.invalidate(post_id)
         else:
             raise AlreadyFlagged
     else:
@@ -734,7 +1032,10 @@ def unflag_post(post_id):
 
     .. note: This is an OP user only action from the dashboard.
     """
-    return m.db.posts.update({'_id': post_id}, {'$set': {'flags': 0}})
+    result = m.db.posts.update({'_id': post_id}, {'$set': {'flags': 0}})
+    clear_counter('posts', post_id, 'flags')
+    post_cache.invalidate(post_id)
+    return result
 
 
 def get_subscribers(post_id):
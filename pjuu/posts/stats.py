@@ -10,8 +10,9 @@
 from flask import url_for
 import pymongo
 
-from pjuu import mongo as m
+from pjuu import mongo as m, post_cache
 from pjuu.users.views import timeify_filter
+from pjuu.lib.fanout import get_fan_out_stats
 from pjuu.posts.backend import get_post
 
 
@@ -68,9 +69,23 @@ def get_stats():
     if len(flagged_posts) == 0:
         flagged_posts.append('Empty')
 
+    fan_out_stats = get_fan_out_stats()
+    cache_stats = post_cache.get_stats()
+
     return [
         ('Total posts', total_posts),
         ('Total uploads', total_uploads),
         ('Last post', last_post_time),
-        ('Flagged posts', flagged_posts)
+        ('Flagged posts', flagged_posts),
+        ('Fan-outs', fan_out_stats.get('posts')),
+        ('Fan-out followers', fan_out_stats.get('followers')),
+        ('Fan-out average time',
+         '{0:.4f}s'.format(fan_out_stats.get('average_seconds'))),
+        ('Fan-out last time',
+         '{0:.4f}s'.format(fan_out_stats.get('last_seconds'))),
+        ('Post cache hits (process/Redis)', '{0}/{1}'.format(
+            cache_stats.get('local_hits'), cache_stats.get('redis_hits'))),
+        ('Post cache misses', cache_stats.get('misses')),
+        ('Post cache hit rate',
+         '{0:.1%}'.format(cache_stats.get('hit_rate')))
     ]
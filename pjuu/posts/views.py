@@ -16,13 +16,16 @@ from pjuu import storage
 from pjuu.auth import current_user
 from pjuu.auth.decorators import login_required
 from pjuu.lib import handle_next, keys as k, timestamp, xflash, is_xhr
-from pjuu.lib.pagination import handle_page
+from pjuu.lib.pagination import handle_cursor, handle_page
+from pjuu.lib.trending import get_trending
+from pjuu.lib.viewer import get_viewer_state, prefetch_viewer_state
 from .backend import (create_post, check_post, has_voted, is_subscribed,
                       vote_post, get_post, delete_post as be_delete_post,
                       get_replies, unsubscribe as be_unsubscribe,
                       CantVoteOnOwn, AlreadyVoted, get_hashtagged_posts,
                       flag_post, has_flagged, CantFlagOwn, AlreadyFlagged,
-                      unflag_post as be_unflag_post, get_global_feed)
+                      unflag_post as be_unflag_post, get_global_feed,
+                      get_hot_feed)
 from .forms import PostForm
 from pjuu.auth.utils import get_user, get_uid
 from pjuu.users.backend import get_user_permission
@@ -97,20 +100,29 @@ def postify_filter(post, limit_lines=False):
     return post_body
 
 
+def _post_id(post):
+    """The filters take a post or just its id."""
+    return post.get('_id') if isinstance(post, dict) else post
+
+
 @posts_bp.app_template_filter('voted')
-def voted_filter(post_id):
+def voted_filter(post):
     """Checks to see if current_user has voted on the post pid.
 
     To check a post simply:
-        item.post_id|voted
+        item|voted
 
-    These may be reffered to as items.X in lists.
+    These may be reffered to as items.X in lists. A post id can be passed in
+    place of the post but this will always ask Redis.
 
     Will return 1 on upvote, -1 on downvote and 0 if not voted
 
     """
     if current_user:
-        return has_voted(current_user.get('_id'), post_id) or 0
+        voted = get_viewer_state(post, 'voted')
+        if voted is not None:
+            return voted
+        return has_voted(current_user.get('_id'), _post_id(post)) or 0
     return False
 
 
@@ -124,20 +136,26 @@ def reversable_filter(vote):
 
 
 @posts_bp.app_template_filter('subscribed')
-def subscribed_filter(post_id):
+def subscribed_filter(post):
     """A simple filter to check if the current user is subscribed to a post
 
     """
     if current_user:
-        return is_subscribed(current_user.get('_id'), post_id)
+        subscribed = get_viewer_state(post, 'subscribed')
+        if subscribed is not None:
+            return subscribed
+        return is_subscribed(current_user.get('_id'), _post_id(post))
     return False
 
 
 @posts_bp.app_template_filter('flagged')
-def flagged_filter(post_id):
+def flagged_filter(post):
     """Check if a user flagged the post with post id"""
     if current_user:
-        return has_flagged(current_user.get('_id'), post_id)
+        flagged = get_viewer_state(post, 'flagged')
+        if flagged is not None:
+            return flagged
+        return has_flagged(current_user.get('_id'), _post_id(post))
     return False
 
 
@@ -200,7 +218,9 @@ def view_post(username, post_id):
     else:
         page_size = app.config.get('REPLIES_ITEMS_PER_PAGE', 25)
 
-    pagination = get_replies(post_id, page, page_size, sort)
+    pagination = get_replies(post_id, page, page_size, sort,
+                             **handle_cursor(request))
+    prefetch_viewer_state(current_user_id, [_post] + pagination.items)
 
     post_form = PostForm()
     return render_template('view_post.html', post=_post,
@@ -350,7 +370,8 @@ def vote(username, post_id, reply_id=None):
 
     try:
         if reply_id is None:
-            result = vote_post(current_user['_id'], post_id, amount=amount)
+            result = vote_post(current_user['_id'], post_id, amount=amount,
+                               author_id=_post.get('user_id'))
         else:
             result = vote_post(current_user['_id'], reply_id, amount=amount)
     except AlreadyVoted:
@@ -516,17 +537,25 @@ def unflag_post(post_id):
 @posts_bp.route('/hashtags/<hashtag>', methods=['GET'])
 @login_required
 def hashtags(hashtag=None):
-    """Used to view a list of posts which contain a specific hashtag.
+    """Used to view a list of posts which contain a specific hashtag. Shows
+    the trending hashtags if there is no hashtag.
 
     """
+    if hashtag is None:
+        return render_template('trending.html',
+                               hour=get_trending(k.PERM_PJUU, 'hour'),
+                               day=get_trending(k.PERM_PJUU, 'day'))
+
     # We need to check the conditions for a valid hashtag if not we will
     # perform a 404 ourselves.
-    if not hashtag or len(hashtag) < 2:
+    if len(hashtag) < 2:
         return abort(404)
 
     # Pagination
     page = handle_page(request)
-    pagination = get_hashtagged_posts(hashtag.lower(), page)
+    pagination = get_hashtagged_posts(hashtag.lower(), page,
+                                      **handle_cursor(request))
+    prefetch_viewer_state(current_user.get('_id'), pagination.items)
 
     return render_template('hashtags.html', hashtag=hashtag,
                            pagination=pagination)
@@ -550,8 +579,37 @@ def global_feed():
 
     page = handle_page(request)
 
-    _posts = get_global_feed(page, page_size, perm=permission)
+    _posts = get_global_feed(page, page_size, perm=permission,
+                             **handle_cursor(request))
+    if current_user:
+        prefetch_viewer_state(current_user.get('_id'), _posts.items)
+
+    post_form = PostForm()
+    return render_template('global_feed.html', pagination=_posts,
+                           post_form=post_form,
+                           trending=get_trending(permission))
+
+
+@posts_bp.route('/global/hot', methods=['GET'])
+def hot_feed():
+    """Show the public/pjuu only posts depending if the user is logged in or
+    not ranked by how hot they are.
+    """
+    if current_user:
+        page_size = current_user.get('feed_pagination_size',
+                                     app.config.get('FEED_ITEMS_PER_PAGE', 25))
+        permission = k.PERM_PJUU
+    else:
+        page_size = app.config.get('FEED_ITEMS_PER_PAGE', 25)
+        permission = k.PERM_PUBLIC
+
+    page = handle_page(request)
+
+    _posts = get_hot_feed(page, page_size, perm=permission)
+    if current_user:
+        prefetch_viewer_state(current_user.get('_id'), _posts.items)
 
     post_form = PostForm()
     return render_template('global_feed.html', pagination=_posts,
-                           post_form=post_form)
+                           post_form=post_form, hot=True,
+                           trending=get_trending(permission))
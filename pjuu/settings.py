@@ -82,6 +82,96 @@ WTF_CSRF_SESSION_KEY = SECRET_KEY
 FEED_ITEMS_PER_PAGE = 25
 REPLIES_ITEMS_PER_PAGE = 25
 ALERT_ITEMS_PER_PAGE = 50
+# Seconds the totals of expensive listings (global feed, hashtags) are cached
+COUNT_CACHE_TTL = env.int('COUNT_CACHE_TTL', 60)
+
+# Feeds
+# The number of posts kept in a users feed
+FEED_MAX_SIZE = env.int('FEED_MAX_SIZE', 1000)
+# A feed can grow this far over FEED_MAX_SIZE before it is trimmed back
+FEED_TRIM_SLACK = env.int('FEED_TRIM_SLACK', 100)
+
+# Users who have not been seen for this many days are not fanned out to and
+# their feeds expire. Their feed is rebuilt when they come back. 0 turns this
+# off.
+FEED_DORMANT_DAYS = env.int('FEED_DORMANT_DAYS', 90)
+
+# The number of posts kept in the global and each hashtag timeline. Older
+# posts are read from MongoDB.
+TIMELINE_MAX_SIZE = env.int('TIMELINE_MAX_SIZE', 1000)
+# Hashtag timelines are dropped when they have not been read for this many
+# seconds. Posts with the hashtag are then read from MongoDB until it is read
+# again.
+HASHTAG_TIMELINE_TTL = env.int('HASHTAG_TIMELINE_TTL', 86400)
+
+# Hot feed
+# The number of posts kept in the hot feed
+HOT_MAX_SIZE = env.int('HOT_MAX_SIZE', 1000)
+# Every this many seconds newer posts need 10 times the points to rank
+# above older ones
+HOT_DECAY = env.int('HOT_DECAY', 45000)
+# Points for each comment on a post, each vote is a point
+HOT_COMMENT_POINTS = env.int('HOT_COMMENT_POINTS', 1)
+
+# Trending hashtags
+# Posts are counted in minute and hour buckets. Each bucket keeps this many of
+# its most used hashtags.
+TRENDING_BUCKET_SIZE = env.int('TRENDING_BUCKET_SIZE', 1000)
+# A bucket can grow this far over TRENDING_BUCKET_SIZE before it is trimmed
+TRENDING_TRIM_SLACK = env.int('TRENDING_TRIM_SLACK', 100)
+# Number of trending hashtags shown
+TRENDING_ITEMS = env.int('TRENDING_ITEMS', 10)
+# Seconds the trending hashtags are cached for
+TRENDING_CACHE_TTL = env.int('TRENDING_CACHE_TTL', 60)
+
+# Fan-out
+# Followers are read and written to feeds in batches of this size
+FANOUT_BATCH_SIZE = env.int('FANOUT_BATCH_SIZE', 500)
+# Audiences larger than this are split in to parallel Celery sub-tasks
+FANOUT_TASK_SIZE = env.int('FANOUT_TASK_SIZE', 10000)
+
+# Alerts
+# Alerts are added to users in pipelines of this many users
+ALERT_BATCH_SIZE = env.int('ALERT_BATCH_SIZE', 500)
+# Alerts for more users than this are delivered by a Celery task
+ALERT_TASK_SIZE = env.int('ALERT_TASK_SIZE', 1000)
+# Alerts which can be merged (eg. comments on the same post) are merged in to
+# the first one for this many seconds. 0 will never merge.
+ALERT_AGGREGATE_WINDOW = env.int('ALERT_AGGREGATE_WINDOW', 3600)
+
+# Counters
+# Score, comment and flag counts are written to MongoDB every this many
+# seconds by Celery beat
+COUNTERS_FLUSH_INTERVAL = env.int('COUNTERS_FLUSH_INTERVAL', 10)
+# Documents are written in bulk updates of this many
+COUNTERS_BATCH_SIZE = env.int('COUNTERS_BATCH_SIZE', 500)
+
+# Authors with at least this many followers are not fanned out, their posts
+# are merged in to their followers feeds when read. 0 will always fan out.
+FEED_PULL_THRESHOLD = env.int('FEED_PULL_THRESHOLD', 10000)
+
+# Post cache
+# Post documents are cached in each process and in Redis when they are read
+POST_CACHE_ENABLED = env.bool('POST_CACHE_ENABLED', True)
+# Number of posts each process keeps and for how many seconds. A process can
+# not see changes made by another process for this long. Never longer than
+# COUNTERS_FLUSH_INTERVAL.
+POST_CACHE_SIZE = env.int('POST_CACHE_SIZE', 1024)
+POST_CACHE_LOCAL_TTL = env.int('POST_CACHE_LOCAL_TTL', 5)
+# Seconds a post is kept in Redis
+POST_CACHE_TTL = env.int('POST_CACHE_TTL', 600)
+
+# Seconds the signed in user is kept in Redis between requests. Changes to the
+# user are seen straight away. 0 loads the user from MongoDB every request.
+SESSION_USER_TTL = env.int('SESSION_USER_TTL', 30)
+
+# Author card cache
+# The username, avatar, donated and active flags of post authors, cached the
+# same way as posts.
+AUTHOR_CACHE_ENABLED = env.bool('AUTHOR_CACHE_ENABLED', True)
+AUTHOR_CACHE_SIZE = env.int('AUTHOR_CACHE_SIZE', 1024)
+AUTHOR_CACHE_LOCAL_TTL = env.int('AUTHOR_CACHE_LOCAL_TTL', 5)
+AUTHOR_CACHE_TTL = env.int('AUTHOR_CACHE_TTL', 3600)
 
 # Max search items is needed to work pagination across search terms
 MAX_SEARCH_ITEMS = 500
@@ -95,3 +185,10 @@ SENTRY_DSN = env.str('SENTRY_DSN', '')
 # Celery config
 CELERY_BROKER_URL = env.str('CELERY_BROKER_URL', '')
 CELERY_ALWAYS_EAGER = env.bool('CELERY_ALWAYS_EAGER', True)
+# Periodic tasks, run `celery -A pjuu.celery_app beat` alongside the workers
+CELERYBEAT_SCHEDULE = {
+    'flush-counters': {
+        'task': 'pjuu.lib.counters.flush_counters',
+        'schedule': COUNTERS_FLUSH_INTERVAL,
+    },
+}
@@ -8,19 +8,21 @@ Redis and MongoDB.
 
 """
 
+import heapq
 import re
 
-from flask import current_app as app, url_for
+from flask import current_app as app
 from jinja2.filters import do_capitalize
 import pymongo
 
-from pjuu import mongo as m, redis as r, storage
-from pjuu.auth.utils import get_user
+from pjuu import author_cache, mongo as m, redis as r, storage, post_cache
+from pjuu.auth.utils import get_user, get_users, hydrate_authors, update_user
 from pjuu.lib import keys as k, timestamp, fix_url
-from pjuu.lib.alerts import BaseAlert, AlertManager
+from pjuu.lib.alerts import BaseAlert, AlertManager, register_alert
+from pjuu.lib.leaderboard import get_top_users
 from pjuu.lib.pagination import Pagination
 from pjuu.lib.uploads import process_upload
-from pjuu.posts.backend import back_feed
+from pjuu.posts.backend import back_feed, touch_feed
 
 
 # Regular expressions
@@ -28,14 +30,13 @@ SEARCH_PATTERN = r'[^\w]'
 SEARCH_RE = re.compile(SEARCH_PATTERN)
 
 
+@register_alert('follow')
 class FollowAlert(BaseAlert):
     """A simple class for a following alert."""
 
     def prettify(self, for_uid=None):
         return '<a href="{0}">{1}</a> has started following you' \
-               .format(url_for('users.profile',
-                               username=self.user.get('username')),
-                       do_capitalize(self.user.get('username')))
+               .format(self.profile_url(), do_capitalize(self.username))
 
 
 def get_user_permission(who_id, whom_id):
@@ -60,7 +61,7 @@ def get_user_permission(who_id, whom_id):
 
 def get_profile(user_id):
     """Returns a user dict with add post_count, follow_count and following."""
-    profile = m.db.users.find_one({'_id': user_id})
+    profile = get_user(user_id)
 
     if profile:
         # Count the users posts in MongoDB
@@ -84,35 +85,27 @@ def get_feed(user_id, page=1, per_page=None):
     if per_page is None:
         per_page = app.config.get('FEED_ITEMS_PER_PAGE')
 
-    # Get the total number of item in the feed and the subset for the current
-    # page.
-    total = r.zcard(k.USER_FEED.format(user_id))
-    pids = r.zrevrange(k.USER_FEED.format(user_id), (page - 1) * per_page,
-                       (page * per_page) - 1)
-
-    # Get all the posts in one call to MongoDB
-    posts = []
-    cursor = m.db.posts.find({'_id': {'$in': pids}}).sort(
-        'created', pymongo.DESCENDING)
+    # Rebuilds the feed if the user has been away for a while
+    touch_feed(user_id)
 
-    for post in cursor:
-        posts.append(post)
+    pulled_authors = get_pulled_authors(user_id)
 
-    # Get a list of unique `user_id`s from all the post.
-    user_ids = list(set([post.get('user_id') for post in posts]))
-    cursor = m.db.users.find({'_id': {'$in': user_ids}},
-                             {'avatar': True, 'donated': True})
+    if pulled_authors:
+        total, pids = merge_pulled_posts(user_id, pulled_authors, page,
+                                         per_page)
+    else:
+        # Get the total number of item in the feed and the subset for the
+        # current page.
+        total = r.zcard(k.USER_FEED.format(user_id))
+        pids = r.zrevrange(k.USER_FEED.format(user_id),
+                           (page - 1) * per_page, (page * per_page) - 1)
 
-    users = dict((user.get('_id'), {
-        'avatar': user.get('avatar'),
-        'donated': user.get('donated', False)
-    }) for user in cursor)
+    # Get all the posts in one call to the post cache. The feed is already
+    # in the order we want them.
+    cached = post_cache.get_many(pids)
+    posts = [cached[pid] for pid in pids if pid in cached]
 
-    processed_posts = []
-    for post in posts:
-        post['user_avatar'] = users.get(post.get('user_id')).get('avatar')
-        post['user_donated'] = users.get(post.get('user_id')).get('donated')
-        processed_posts.append(post)
+    processed_posts = hydrate_authors(posts)
 
     # Clean up the list in Redis if the
     if len(processed_posts) < len(pids):
@@ -123,21 +116,101 @@ def get_feed(user_id, page=1, per_page=None):
     return Pagination(processed_posts, total, page, per_page)
 
 
+def get_pulled_authors(user_id):
+    """Returns the authors `user_id` follows whose posts are not fanned out.
+
+    :returns: A dict of `{author_id: trusted}`, where trusted means `user_id`
+              can also see the authors approved only posts.
+    :rtype: dict
+
+    """
+    authors = list(r.smembers(k.PULL_AUTHORS))
+    if not authors:
+        return {}
+
+    pipe = r.pipeline(transaction=False)
+    for author_id in authors:
+        pipe.zscore(k.USER_FOLLOWING.format(user_id), author_id)
+        pipe.zscore(k.USER_APPROVED.format(author_id), user_id)
+    results = pipe.execute()
+
+    pulled_authors = {}
+    for i, author_id in enumerate(authors):
+        following, trusted = results[i * 2], results[i * 2 + 1]
+        if following is not None:
+            pulled_authors[author_id] = trusted is not None
+
+    return pulled_authors
+
+
+def merge_pulled_posts(user_id, pulled_authors, page, per_page):
+    """Merge the recent posts of `pulled_authors` in to the pushed feed of
+    `user_id` for `page`.
+
+    Both sources are already sorted by time so we only need the first
+    `page * per_page` from each. Posts which were pushed before the author
+    crossed ``FEED_PULL_THRESHOLD`` can be in both and are only shown (and
+    counted) once. Like a pushed feed the merged feed is capped at
+    ``FEED_MAX_SIZE``.
+
+    :returns: The total size of the merged feed and the post ids on `page`
+    :rtype: tuple
+
+    """
+    # Pulled posts are capped at the same size as a pushed feed
+    feed_size = app.config.get('FEED_MAX_SIZE', 1000)
+    end = min(page * per_page, feed_size)
+
+    pushed = r.zrevrange(k.USER_FEED.format(user_id), 0, end - 1,
+                         withscores=True)
+
+    trusted_ids = [author_id for author_id, trusted
+                   in pulled_authors.items() if trusted]
+    lookup_dict = {
+        'user_id': {'$in': list(pulled_authors.keys())},
+        'reply_to': {'$exists': False},
+        '$or': [
+            {'permission': {'$lte': k.PERM_PJUU}},
+            {'user_id': {'$in': trusted_ids}}
+        ]
+    }
+
+    cursor = m.db.posts.find(lookup_dict, {'created': True}).sort(
+        'created', pymongo.DESCENDING).limit(feed_size)
+    pulled = [(post.get('_id'), post.get('created')) for post in cursor]
+
+    # Pulled posts which are also in the pushed feed are only counted once
+    pipe = r.pipeline(transaction=False)
+    pipe.zcard(k.USER_FEED.format(user_id))
+    for post_id, _ in pulled:
+        pipe.zscore(k.USER_FEED.format(user_id), post_id)
+    results = pipe.execute()
+    pushed_total = results[0]
+    duplicates = len([score for score in results[1:] if score is not None])
+
+    pids = []
+    seen = set()
+    for post_id, _ in heapq.merge(pushed, pulled[:end],
+                                  key=lambda post: -post[1]):
+        if post_id not in seen:
+            seen.add(post_id)
+            pids.append(post_id)
+
+    total = min(pushed_total + len(pulled) - duplicates, feed_size)
+
+    return total, pids[(page - 1) * per_page:page * per_page]
+
+
 def remove_from_feed(post_id, user_id):
     """Remove ``post_id`` from ``user_id``s feed."""
     return bool(r.zrem(k.USER_FEED.format(user_id), post_id))
 
 
 def top_users_by_score(limit=5):
-    """Get the top 5 users by score.
+    """Get the top 5 users by score from the leaderboard.
     Used to show names on the welcome message.
     """
-    cursor = m.db.users.find(
-        {}, {'_id': -1, 'username': 1}).sort('score', -1).limit(limit)
-    users = []
-    for user in cursor:
-        users.append(user)
-    return users
+    return get_top_users(1, limit).items
 
 
 def follow_user(who_uid, whom_uid):
@@ -154,7 +227,7 @@ def follow_user(who_uid, whom_uid):
     r.zadd(k.USER_FOLLOWERS.format(whom_uid), {str(who_uid): timestamp()})
 
     # Create an alert and inform whom that who is now following them
-    alert = FollowAlert(who_uid)
+    alert = FollowAlert(who_uid, (get_user(who_uid) or {}).get('username'))
     AlertManager().alert(alert, [whom_uid])
 
     # Back fill the who's feed with some posts from whom
@@ -214,15 +287,13 @@ def get_following(uid, page=1, per_page=None):
     total = r.zcard(k.USER_FOLLOWING.format(uid))
     fids = r.zrevrange(k.USER_FOLLOWING.format(uid), (page - 1) * per_page,
                        (page * per_page) - 1)
-    users = []
-    for fid in fids:
-        user = get_user(fid)
-        if user:
-            users.append(user)
-        else:
-            # Self cleaning sorted sets
-            r.zrem(k.USER_FOLLOWING.format(uid), fid)
-            total = r.zcard(k.USER_FOLLOWING.format(id))
+    users = get_users(fids)
+
+    # Self cleaning sorted sets
+    if len(users) < len(fids):
+        found = set(user.get('_id') for user in users)
+        r.zrem(k.USER_FOLLOWING.format(uid), *(set(fids) - found))
+        total = r.zcard(k.USER_FOLLOWING.format(uid))
 
     return Pagination(users, total, page, per_page)
 
@@ -237,15 +308,13 @@ def get_followers(uid, page=1, per_page=None):
     total = r.zcard(k.USER_FOLLOWERS.format(uid))
     fids = r.zrevrange(k.USER_FOLLOWERS.format(uid), (page - 1) * per_page,
                        (page * per_page) - 1)
-    users = []
-    for fid in fids:
-        user = get_user(fid)
-        if user:
-            users.append(user)
-        else:
-            # Self cleaning sorted sets
-            r.zrem(k.USER_FOLLOWERS.format(uid), fid)
-            total = r.zcard(k.USER_FOLLOWERS.format(uid))
+    users = get_users(fids)
+
+    # Self cleaning sorted sets
+    if len(users) < len(fids):
+        found = set(user.get('_id') for user in users)
+        r.zrem(k.USER_FOLLOWERS.format(uid), *(set(fids) - found))
+        total = r.zcard(k.USER_FOLLOWERS.format(uid))
 
     return Pagination(users, total, page, per_page)
 
@@ -260,15 +329,13 @@ def get_trusted(uid, page=1, per_page=None):
     total = r.zcard(k.USER_APPROVED.format(uid))
     fids = r.zrevrange(k.USER_APPROVED.format(uid), (page - 1) * per_page,
                        (page * per_page) - 1)
-    users = []
-    for fid in fids:
-        user = get_user(fid)
-        if user:
-            users.append(user)
-        else:
-            # Self cleaning sorted sets
-            r.zrem(k.USER_FOLLOWERS.format(uid), fid)
-            total = r.zcard(k.USER_FOLLOWERS.format(uid))
+    users = get_users(fids)
+
+    # Self cleaning sorted sets
+    if len(users) < len(fids):
+        found = set(user.get('_id') for user in users)
+        r.zrem(k.USER_APPROVED.format(uid), *(set(fids) - found))
+        total = r.zcard(k.USER_APPROVED.format(uid))
 
     return Pagination(users, total, page, per_page)
 
@@ -342,28 +409,7 @@ def search(query, page=1, per_page=None):
 
             total += cursor.count()
 
-            preprocessed_posts = []
-            user_ids = []
-
-            for hashtag in cursor:
-                user_ids.append(hashtag.get('user_id'))
-                preprocessed_posts.append(hashtag)
-
-            cursor = m.db.users.find({'_id': {'$in': user_ids}},
-                                     {'avatar': True, 'donated': True})
-
-            post_users = dict((user.get('_id'), {
-                'avatar': user.get('avatar'),
-                'donated': user.get('donated', False)
-            }) for user in cursor)
-
-            # Add the e-mails to the posts
-            for post in preprocessed_posts:
-                post['user_avatar'] = \
-                    post_users.get(post.get('user_id')).get('avatar')
-                post['user_donated'] = \
-                    post_users.get(post.get('user_id')).get('donated')
-                posts.append(post)
+            posts = hydrate_authors(list(cursor))
 
         results = users + posts
 
@@ -432,7 +478,8 @@ def update_profile_settings(user_id, about="", hide_feed_images=False,
             storage.delete(user.get('avatar'))
 
     # Update the users profile
-    m.db.users.update({'_id': user_id}, {'$set': update_dict})
+    update_user(user_id, {'$set': update_dict})
+    author_cache.invalidate(user_id)
 
     # Return the user object. We can update the current_user from this
     return get_user(user_id)
@@ -448,9 +495,7 @@ def get_alerts(user_id, page=1, per_page=None):
     # Get the last time the users checked the alerts
     # Try and cast the value to an int so we can boolean compare them
     try:
-        alerts_last_checked = m.db.users.find_one(
-            {'_id': user_id}
-        ).get('alerts_last_checked')
+        alerts_last_checked = get_user(user_id).get('alerts_last_checked')
     except (AttributeError, TypeError, ValueError):
         alerts_last_checked = 0
 
@@ -459,35 +504,27 @@ def get_alerts(user_id, page=1, per_page=None):
     aids = r.zrevrange(k.USER_ALERTS.format(user_id), (page - 1) * per_page,
                        (page * per_page) - 1)
 
-    # Create AlertManager to load the alerts
-    am = AlertManager()
+    # Load and verify every alert on the page in one go. Alerts which can not
+    # be loaded are removed from the users alerts (self cleaning zset).
+    alerts = AlertManager().get_many(aids, user_id)
 
-    alerts = []
+    for alert in alerts:
+        # Check to see if the alert is newer than the time we last checked.
+        # This allows us to highlight in the template
+        # This will assign a new property to the object: `new`
+        if int(alert.timestamp) > alerts_last_checked:
+            alert.new = True
 
-    for aid in aids:
-        # Load the alert in to the alert manager
-        alert = am.get(aid)
-        if alert:
-            # Check to see if the alert is newer than the time we last checked.
-            # This allows us to highlight in the template
-            # This will assign a new property to the object: `new`
-            if int(alert.timestamp) > alerts_last_checked:
-                alert.new = True
+    if len(alerts) < len(aids):
+        total = r.zcard(k.USER_ALERTS.format(user_id))
 
-            # Add the entire alert from the manager on the list
-            alerts.append(alert)
-        else:
-            # Self cleaning zset
-            r.zrem(k.USER_ALERTS.format(user_id), aid)
-            total = r.zcard(k.USER_ALERTS.format(user_id))
-            # May as well delete the alert if there is one
-            r.delete(k.ALERT.format(aid))
-
-    # Update the last time the user checked there alerts
-    # This will allow us to alert a user too new alerts with the /i-has-alerts
-    # url
-    m.db.users.update({'_id': user_id},
-                      {'$set': {'alerts_last_checked': timestamp()}})
+    # The user has seen their alerts, reset the unread count. The last time
+    # they checked is only stored when there was something new to see or
+    # there was no count, it is what a missing count is rebuilt from.
+    unread = r.getset(k.USER_ALERTS_UNREAD.format(user_id), 0)
+
+    if unread is None or int(unread) > 0:
+        update_user(user_id, {'$set': {'alerts_last_checked': timestamp()}})
 
     return Pagination(alerts, total, page, per_page)
 
@@ -503,17 +540,25 @@ def delete_alert(user_id, alert_id):
 def new_alerts(user_id):
     """Checks too see if user has any new alerts since they last got the them.
 
+    The count is kept up to date by `AlertManager.alert` and reset by
+    `get_alerts` so this is normally a single GET. If there is no count
+    (before upgrading or after Redis has lost it) it is counted from the
+    alerts newer than the last time the user checked.
+
     """
-    # Get the stamp since last check from Redis
-    # If this has not been called before make it 0
-    alerts_last_checked = get_user(user_id).get('alerts_last_checked', 0)
+    unread = r.get(k.USER_ALERTS_UNREAD.format(user_id))
+
+    if unread is None:
+        user = get_user(user_id) or {}
+        unread = r.zcount(k.USER_ALERTS.format(user_id),
+                          '({}'.format(user.get('alerts_last_checked', -1)),
+                          '+inf')
+
+        # An alert may have been counted while we were counting
+        if not r.set(k.USER_ALERTS_UNREAD.format(user_id), unread, nx=True):
+            unread = r.get(k.USER_ALERTS_UNREAD.format(user_id))
 
-    # Do the check. This will just see if there is anything returned from the
-    # sorted set newer than the last_checked timestamp, SIMPLES.
-    #
-    # Note: zrevrangebyscore has max and min the wrong way round :P
-    return len(r.zrevrangebyscore(k.USER_ALERTS.format(user_id), '+inf',
-               alerts_last_checked))
+    return max(int(unread or 0), 0)
 
 
 def remove_tip(user_id, tip_name):
@@ -521,7 +566,7 @@ def remove_tip(user_id, tip_name):
 
     .. note: The tipname needs to be checked at the front end
     """
-    return m.db.users.update({'_id': user_id}, {'$set': {
+    return update_user(user_id, {'$set': {
         'tip_{}'.format(tip_name): False
     }})
 
@@ -534,5 +579,5 @@ def reset_tips(user_id):
     for tip_name in k.VALID_TIP_NAMES:
         update_dict['tip_{}'.format(tip_name)] = True
 
-    m.db.users.update({'_id': user_id}, {'$set': update_dict})
+    update_user(user_id, {'$set': update_dict})
     return True
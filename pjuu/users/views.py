@@ -19,10 +19,11 @@ from flask import (
 # Pjuu imports
 from pjuu.auth import current_user
 from pjuu.auth.forms import SignInForm
-from pjuu.auth.utils import get_uid, get_uid_username
+from pjuu.auth.utils import get_uid, get_uid_username, get_user
 from pjuu.auth.decorators import login_required
 from pjuu.lib import handle_next, timestamp, keys as k
-from pjuu.lib.pagination import handle_page
+from pjuu.lib.pagination import handle_cursor, handle_page
+from pjuu.lib.viewer import get_viewer_state, prefetch_viewer_state
 from pjuu.posts.backend import get_posts
 from pjuu.posts.forms import PostForm
 from pjuu.users.forms import ChangeProfileForm, SearchForm
@@ -49,6 +50,9 @@ def load_jinja2_functions():
 def following_filter(_profile):
     """Checks if current user is following the user piped to filter."""
     if current_user:
+        following = get_viewer_state(_profile, 'following')
+        if following is not None:
+            return following
         return is_following(current_user.get('_id'), _profile.get('_id'))
     return False
 
@@ -57,6 +61,9 @@ def following_filter(_profile):
 def follower_filter(_profile):
     """Checks if the user (_profile) is following the current user"""
     if current_user:
+        follower = get_viewer_state(_profile, 'follower')
+        if follower is not None:
+            return follower
         return is_following(_profile.get('_id'), current_user.get('_id'))
     return False
 
@@ -65,6 +72,9 @@ def follower_filter(_profile):
 def trusted_filter(_profile):
     """Checks if current user has approved the user piped to filter."""
     if current_user:
+        trusted = get_viewer_state(_profile, 'trusted')
+        if trusted is not None:
+            return trusted
         return is_trusted(current_user.get('_id'), _profile.get('_id'))
     return False
 
@@ -167,6 +177,7 @@ def feed():
     # Get feed pagination
     pagination = get_feed(current_user.get('_id'), page,
                           current_user.get('feed_pagination_size'))
+    prefetch_viewer_state(current_user.get('_id'), pagination.items)
 
     # Post form
     post_form = PostForm()
@@ -217,7 +228,9 @@ def profile(username):
         current_user_id = None
     permission = get_user_permission(_profile.get('_id'), current_user_id)
 
-    _posts = get_posts(uid, page, page_size, perm=permission)
+    _posts = get_posts(uid, page, page_size, perm=permission,
+                       **handle_cursor(request))
+    prefetch_viewer_state(current_user_id, [_profile] + _posts.items)
 
     # Post form
     post_form = PostForm()
@@ -243,6 +256,7 @@ def following(username):
     # Get a list of users you are following
     _following = get_following(user_id, page,
                                current_user.get('feed_pagination_size'))
+    prefetch_viewer_state(current_user.get('_id'), _following.items)
 
     return render_template('following.html', profile=_profile,
                            pagination=_following)
@@ -266,6 +280,7 @@ def followers(username):
     # Get a list of users you are following
     _followers = get_followers(user_id, page,
                                current_user.get('feed_pagination_size'))
+    prefetch_viewer_state(current_user.get('_id'), _followers.items)
 
     return render_template('followers.html', profile=_profile,
                            pagination=_followers)
@@ -293,6 +308,7 @@ def trusted(username):
     # Get a list of users you are following
     _trusted = get_trusted(user_id, page,
                            current_user.get('feed_pagination_size'))
+    prefetch_viewer_state(current_user.get('_id'), _trusted.items)
 
     return render_template('trusted.html', profile=_profile,
                            pagination=_trusted)
@@ -411,6 +427,7 @@ def search():
 
     _results = be_search(query, page,
                          current_user.get('feed_pagination_size'))
+    prefetch_viewer_state(current_user.get('_id'), _results.items)
 
     return render_template('search.html', form=form, query=query,
                            pagination=_results)
@@ -421,6 +438,11 @@ def search():
 @login_required
 def settings_profile():
     """Allows users to customize their profile direct from this view."""
+    # The about text is not loaded with the signed in user
+    if 'about' not in current_user:
+        current_user['about'] = \
+            get_user(current_user.get('_id')).get('about', '')
+
     # Create the form and initialize the `select` field this can not be done
     # in the template.
     form = ChangeProfileForm(
@@ -538,8 +560,14 @@ def new_alerts():
 
     uid = current_user.get('_id')
 
-    # If a user has alerts then return a 200 else a 404
-    return jsonify({'new_alerts': be_new_alerts(uid)})
+    # The response only depends on the count. Browsers send the ETag back and
+    # get an empty 304 while nothing has changed.
+    count = be_new_alerts(uid)
+    response = jsonify({'new_alerts': count})
+    response.set_etag('alerts-{}'.format(count))
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
 
 @users_bp.route('/tips/<tip_name>/hide', methods=['POST'])
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+
+"""Benchmarks the encode and decode speed and the Redis memory used per alert
+by the hash format against the old jsonpickle blobs.
+
+Run against a throw away Redis database ONLY, it is flushed when finished:
+
+    python scripts/benchmark_alerts.py --alerts 10000
+
+:license: AGPL v3, see LICENSE for more details
+:copyright: 2014-2023 Joe Doherty
+
+"""
+
+import argparse
+import os
+import sys
+import inspect
+import time
+
+import jsonpickle
+
+currentdir = os.path.dirname(
+    os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+
+from pjuu import create_app, redis as r  # noqa
+from pjuu.lib.alerts import (decode_alert, decode_legacy_alert,  # noqa
+                             encode_alert)
+from pjuu.lib import get_uuid  # noqa
+from pjuu.posts.backend import CommentingAlert  # noqa
+
+
+def run(alerts, encode, decode, store, load):
+    """Time encoding, storing, loading and decoding `alerts`.
+
+    :returns: Microseconds per alert to encode and decode and the average
+              bytes of Redis memory per alert
+    :rtype: tuple
+
+    """
+    r.flushdb()
+
+    start = time.time()
+    encoded = [encode(alert) for alert in alerts]
+    encode_time = (time.time() - start) / len(alerts)
+
+    pipe = r.pipeline(transaction=False)
+    for alert, value in zip(alerts, encoded):
+        store(pipe, alert.alert_id, value)
+    pipe.execute()
+
+    pipe = r.pipeline(transaction=False)
+    for alert in alerts:
+        pipe.memory_usage(alert.alert_id)
+    memory = sum(pipe.execute()) / len(alerts)
+
+    pipe = r.pipeline(transaction=False)
+    for alert in alerts:
+        load(pipe, alert.alert_id)
+    stored = pipe.execute()
+
+    start = time.time()
+    for value in stored:
+        decode(value)
+    decode_time = (time.time() - start) / len(alerts)
+
+    return encode_time * 1e6, decode_time * 1e6, memory
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--alerts', type=int, default=10000)
+    args = parser.parse_args()
+
+    app = create_app({
+        'REDIS_URL': os.environ.get(
+            'BENCHMARK_REDIS_URL', 'redis://localhost:6379/4')
+    })
+    ctx = app.app_context()
+    ctx.push()
+
+    alerts = [CommentingAlert(get_uuid(), get_uuid())
+              for i in range(args.alerts)]
+
+    print('{:>12} {:>14} {:>14} {:>14}'.format(
+        'format', 'encode (us)', 'decode (us)', 'bytes/alert'))
+
+    formats = (
+        ('jsonpickle', jsonpickle.encode, decode_legacy_alert,
+         lambda pipe, key, value: pipe.set(key, value),
+         lambda pipe, key: pipe.get(key)),
+        ('hash', encode_alert, decode_alert,
+         lambda pipe, key, value: pipe.hset(key, mapping=value),
+         lambda pipe, key: pipe.hgetall(key)),
+    )
+    for name, encode, decode, store, load in formats:
+        print('{:>12} {:>14.2f} {:>14.2f} {:>14.0f}'.format(
+            name, *run(alerts, encode, decode, store, load)))
+
+    r.flushdb()
+
+    ctx.pop()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+
+"""Benchmarks the write cost (posting) against the read cost (loading a
+followers feed) of the hybrid push/pull feeds at different values of
+``FEED_PULL_THRESHOLD``.
+
+Run against throw away databases ONLY, both are flushed when finished:
+
+    python scripts/benchmark_feeds.py --followers 5000 --thresholds 0 1000
+
+:license: AGPL v3, see LICENSE for more details
+:copyright: 2014-2023 Joe Doherty
+
+"""
+
+import argparse
+import os
+import sys
+import inspect
+import time
+
+currentdir = os.path.dirname(
+    os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+
+from pjuu import create_app, mongo as m, redis as r  # noqa
+from pjuu.auth.backend import create_account  # noqa
+from pjuu.lib import keys as k  # noqa
+from pjuu.posts.backend import create_post  # noqa
+from pjuu.users.backend import get_feed  # noqa
+
+
+def setup_audience(followers):
+    """Create an author and `followers` users following them. The followers
+    are written straight to Redis, creating the accounts is not what we are
+    measuring.
+
+    """
+    author_id = create_account('author', 'author@pjuu.com', 'Password')
+
+    pipe = r.pipeline(transaction=False)
+    for i in range(followers):
+        follower_id = 'follower{}'.format(i)
+        pipe.zadd(k.USER_FOLLOWERS.format(author_id), {follower_id: i})
+        pipe.zadd(k.USER_FOLLOWING.format(follower_id), {author_id: i})
+    pipe.execute()
+
+    return author_id
+
+
+def run(app, followers, threshold, posts, reads):
+    """Post `posts` times then read the first follower's feed `reads` times.
+
+    :returns: Average seconds per post and per feed read
+    :rtype: tuple
+
+    """
+    m.cx.drop_database(m.db.name)
+    r.flushdb()
+
+    app.config['FEED_PULL_THRESHOLD'] = threshold
+    author_id = setup_audience(followers)
+
+    start = time.time()
+    for i in range(posts):
+        create_post(author_id, 'author', 'Post {}'.format(i))
+    write = (time.time() - start) / posts
+
+    start = time.time()
+    for i in range(reads):
+        get_feed('follower0', page=1, per_page=25)
+    read = (time.time() - start) / reads
+
+    return write, read
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--followers', type=int, default=1000)
+    parser.add_argument('--thresholds', type=int, nargs='+',
+                        default=[0, 100, 10000])
+    parser.add_argument('--posts', type=int, default=20)
+    parser.add_argument('--reads', type=int, default=100)
+    args = parser.parse_args()
+
+    app = create_app({
+        'MONGO_URI': os.environ.get(
+            'BENCHMARK_MONGO_URI', 'mongodb://localhost:27017/pjuu_benchmark'),
+        'REDIS_URL': os.environ.get(
+            'BENCHMARK_REDIS_URL', 'redis://localhost:6379/4')
+    })
+    ctx = app.app_context()
+    ctx.push()
+
+    print('{:>10} {:>10} {:>14} {:>14}'.format(
+        'followers', 'threshold', 'post (ms)', 'feed read (ms)'))
+
+    for threshold in args.thresholds:
+        write, read = run(app, args.followers, threshold, args.posts,
+                          args.reads)
+        mode = 'pull' if threshold and args.followers >= threshold \
+            else 'push'
+        print('{:>10} {:>10} {:>14.3f} {:>14.3f} ({})'.format(
+            args.followers, threshold, write * 1000, read * 1000, mode))
+
+    m.cx.drop_database(m.db.name)
+    r.flushdb()
+
+    ctx.pop()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+
+"""Benchmarks the cost of a vote to the hot feed, the time per
+`change_points` call, as the number of posts in the hot feed grows.
+
+Run against a throw away Redis database ONLY, it is flushed when finished:
+
+    python scripts/benchmark_hot.py --votes 10000
+
+:license: AGPL v3, see LICENSE for more details
+:copyright: 2014-2023 Joe Doherty
+
+"""
+
+import argparse
+import os
+import random
+import sys
+import inspect
+import time
+
+currentdir = os.path.dirname(
+    os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+
+from pjuu import create_app, redis as r  # noqa
+from pjuu.lib import get_uuid, timestamp  # noqa
+from pjuu.lib.hot import add_to_hot, change_points  # noqa
+
+
+def run(size, votes):
+    """Fill the hot feed with `size` posts then time `votes` votes on random
+    posts in it.
+
+    :returns: Microseconds per vote
+    :rtype: float
+
+    """
+    r.flushdb()
+
+    now = timestamp()
+    post_ids = [get_uuid() for i in range(size)]
+    for i, post_id in enumerate(post_ids):
+        add_to_hot({'_id': post_id, 'created': now - i, 'permission': 0})
+
+    chosen = [random.choice(post_ids) for i in range(votes)]
+    start = time.time()
+    for post_id in chosen:
+        change_points(post_id, random.choice((1, -1)))
+
+    return (time.time() - start) / votes * 1e6
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--votes', type=int, default=10000)
+    args = parser.parse_args()
+
+    app = create_app({
+        'REDIS_URL': os.environ.get(
+            'BENCHMARK_REDIS_URL', 'redis://localhost:6379/4')
+    })
+    ctx = app.app_context()
+    ctx.push()
+
+    print('{:>12} {:>14}'.format('posts', 'vote (us)'))
+
+    for size in (10, 100, app.config.get('HOT_MAX_SIZE', 1000)):
+        print('{:>12} {:>14.2f}'.format(size, run(size, args.votes)))
+
+    r.flushdb()
+
+    ctx.pop()
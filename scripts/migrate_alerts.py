@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+
+"""Converts alerts stored as jsonpickle blobs to the hash format used by
+`pjuu.lib.alerts`.
+
+Alerts keep their expiry. It is safe to run this while the site is up and to
+run it more than once, alerts which are already hashes are skipped and ones
+which can not be decoded are deleted. Redis has to be 4.0 or newer.
+
+:license: AGPL v3, see LICENSE for more details
+:copyright: 2014-2023 Joe Doherty
+
+"""
+
+import os
+import sys
+import inspect
+
+currentdir = os.path.dirname(
+    os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+
+from pjuu import create_app, redis as r  # noqa
+from pjuu.lib import keys as k  # noqa
+from pjuu.lib.alerts import decode_legacy_alert, encode_alert  # noqa
+# Register every alert type
+import pjuu.posts.backend  # noqa
+import pjuu.users.backend  # noqa
+
+
+def migrate_alert(key):
+    """Convert the alert at `key` if it is still a blob.
+
+    :returns: True if converted, False if deleted and None if skipped
+    :rtype: bool or None
+
+    """
+    # Already a hash
+    key_type = r.type(key)
+    if key_type != 'string':
+        return None
+
+    pipe = r.pipeline(transaction=False)
+    pipe.get(key)
+    pipe.pttl(key)
+    pickled_alert, ttl = pipe.execute()
+
+    alert = decode_legacy_alert(pickled_alert)
+
+    pipe = r.pipeline()
+    pipe.delete(key)
+    if alert is not None:
+        pipe.hset(key, mapping=encode_alert(alert))
+        pipe.pexpire(key, ttl if ttl > 0 else k.EXPIRE_4WKS * 1000)
+    pipe.execute()
+
+    return alert is not None
+
+
+if __name__ == '__main__':
+    app = create_app()
+    ctx = app.app_context()
+    ctx.push()
+
+    counts = {True: 0, False: 0, None: 0}
+    for key in r.scan_iter(match=k.ALERT.format('*'), count=1000):
+        counts[migrate_alert(key)] += 1
+
+    print('Converted {} alerts, deleted {} and skipped {}'.format(
+        counts[True], counts[False], counts[None]))
+
+    ctx.pop()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+
+"""Rebuilds users feeds in Redis from who they follow and MongoDB.
+
+Use this after Redis has lost data:
+
+    python scripts/rebuild_feeds.py joe ant
+    python scripts/rebuild_feeds.py --all
+
+:license: AGPL v3, see LICENSE for more details
+:copyright: 2014-2023 Joe Doherty
+
+"""
+
+import argparse
+import os
+import sys
+import inspect
+
+currentdir = os.path.dirname(
+    os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+
+from pjuu import create_app, mongo as m  # noqa
+from pjuu.auth.utils import get_uid_username  # noqa
+from pjuu.posts.backend import rebuild_feed  # noqa
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('usernames', nargs='*')
+    parser.add_argument('--all', action='store_true',
+                        help='rebuild the feed of every user')
+    args = parser.parse_args()
+
+    if not args.usernames and not args.all:
+        parser.error('give some usernames or --all')
+
+    app = create_app()
+    ctx = app.app_context()
+    ctx.push()
+
+    if args.all:
+        user_ids = [user.get('_id') for user in m.db.users.find({}, {})]
+    else:
+        user_ids = []
+        for username in args.usernames:
+            user_id = get_uid_username(username)
+            if user_id is None:
+                print('No such user: {}'.format(username))
+            else:
+                user_ids.append(user_id)
+
+    for user_id in user_ids:
+        print('{}: {} posts'.format(user_id, rebuild_feed(user_id)))
+
+    ctx.pop()
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+
+"""Rebuilds the leaderboard of users by score in Redis from MongoDB.
+
+Run this after Redis has lost data or scores have been changed in MongoDB
+directly.
+
+:license: AGPL v3, see LICENSE for more details
+:copyright: 2014-2023 Joe Doherty
+
+"""
+
+import os
+import sys
+import inspect
+
+currentdir = os.path.dirname(
+    os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+
+from pjuu import create_app  # noqa
+from pjuu.lib.leaderboard import rebuild_leaderboard  # noqa
+
+
+if __name__ == '__main__':
+    app = create_app()
+    ctx = app.app_context()
+    ctx.push()
+
+    print('Rebuilt the leaderboard with {} users'.format(
+        rebuild_leaderboard()))
+
+    ctx.pop()
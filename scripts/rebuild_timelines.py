@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+
+"""Rebuilds the global timelines, the timelines of the hashtags trending over
+the past day and the hot feeds in Redis from MongoDB. Other hashtag timelines
+are built when they are next read.
+
+Run this after Redis has lost data or posts have been changed in MongoDB
+directly. The site keeps working while it runs, timelines which are not built
+yet are read from MongoDB.
+
+:license: AGPL v3, see LICENSE for more details
+:copyright: 2014-2023 Joe Doherty
+
+"""
+
+import os
+import sys
+import inspect
+
+currentdir = os.path.dirname(
+    os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+
+from pjuu import create_app  # noqa
+from pjuu.lib import keys as k  # noqa
+from pjuu.lib.hot import rebuild_hot_feeds  # noqa
+from pjuu.lib.timelines import rebuild_timelines  # noqa
+from pjuu.lib.trending import get_trending  # noqa
+
+
+if __name__ == '__main__':
+    app = create_app()
+    ctx = app.app_context()
+    ctx.push()
+
+    hashtags = [hashtag for hashtag, _ in get_trending(
+        k.PERM_PJUU, 'day', app.config.get('TRENDING_BUCKET_SIZE', 1000))]
+    print('Rebuilt {} timelines'.format(rebuild_timelines(hashtags)))
+    print('Rebuilt {} hot feeds'.format(rebuild_hot_feeds()))
+
+    ctx.pop()
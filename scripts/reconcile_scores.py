@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+
+"""Rebuilds the score of every post from its votes in Redis and the score of
+every user from their posts, then rebuilds the leaderboard.
+
+Run this after scores in MongoDB have drifted from the votes, e.g. after
+counter changes were lost. Votes made while this runs may be counted twice
+so run it while the site is quiet.
+
+:license: AGPL v3, see LICENSE for more details
+:copyright: 2014-2023 Joe Doherty
+
+"""
+
+import os
+import sys
+import inspect
+
+currentdir = os.path.dirname(
+    os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+
+from pjuu import create_app  # noqa
+from pjuu.lib.counters import reconcile_scores  # noqa
+from pjuu.lib.leaderboard import rebuild_leaderboard  # noqa
+
+
+if __name__ == '__main__':
+    app = create_app()
+    ctx = app.app_context()
+    ctx.push()
+
+    posts, users = reconcile_scores()
+    print('Fixed the score of {} posts and {} users'.format(posts, users))
+    print('Rebuilt the leaderboard with {} users'.format(
+        rebuild_leaderboard()))
+
+    ctx.pop()
@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+
+"""Seeds when each user was last seen from their last login in MongoDB.
+
+Run this once when upgrading to a version which skips dormant users. Until
+then users who have not signed in since the upgrade are never dormant.
+
+:license: AGPL v3, see LICENSE for more details
+:copyright: 2014-2023 Joe Doherty
+
+"""
+
+import os
+import sys
+import inspect
+
+currentdir = os.path.dirname(
+    os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+
+from pjuu import create_app  # noqa
+from pjuu.lib.fanout import seed_last_seen  # noqa
+
+
+if __name__ == '__main__':
+    app = create_app()
+    ctx = app.app_context()
+    ctx.push()
+
+    print('Seeded last seen for {} users'.format(seed_last_seen()))
+
+    ctx.pop()
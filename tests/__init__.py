@@ -2,6 +2,9 @@
 
 """All Pjuu's unit/functional tests.
 
+Celery tasks must only be imported inside of tests. The test loader inspects
+everything a test module imports, which finalizes the Celery config before
+`create_app` has made tasks run eagerly.
 
 :license: AGPL v3, see LICENSE for more details
 :copyright: 2014-2023 Joe Doherty
@@ -8,11 +8,20 @@ backend test for the specific alerts that appear there.
 
 """
 
+# 3rd party imports
+from flask import current_app as app, url_for
+import jsonpickle
 # Pjuu imports
 from pjuu import redis as r
-from pjuu.auth.backend import create_account, delete_account
+from pjuu.auth.backend import activate, create_account, delete_account
 from pjuu.lib import keys as k
-from pjuu.lib.alerts import AlertManager, BaseAlert
+from pjuu.lib.alerts import (AlertManager, BaseAlert, alert_link,
+                             decode_alert, encode_alert)
+from pjuu.posts.backend import (CommentingAlert, PostingAlert,
+                                SubscriptionReasons, TaggingAlert,
+                                create_post, delete_post)
+from pjuu.users.backend import (FollowAlert, follow_user, get_alerts,
+                                new_alerts)
 # Test imports
 from tests import BackendTestCase
 
@@ -99,3 +108,219 @@ class AlertTests(BackendTestCase):
         self.assertIsNone(alert)
 
         # Done for now, may need expanding for coverage
+
+    def test_alertmanager_get_many(self):
+        """Ensure a page of alerts is loaded, verified and cleaned up in one
+        go.
+
+        """
+        am = AlertManager()
+        self.assertEqual(am.get_many([]), [])
+
+        user1 = create_account('user1', 'user1@pjuu.com', 'Password')
+        user2 = create_account('user2', 'user2@pjuu.com', 'Password')
+        activate(user1)
+
+        post1 = create_post(user2, 'user2', 'Hello @user1')
+        follow_user(user2, user1)
+        am.alert(BaseAlert(k.NIL_VALUE), [user1])
+
+        aids = r.zrevrange(k.USER_ALERTS.format(user1), 0, -1)
+        self.assertEqual(len(aids), 3)
+
+        alerts = am.get_many(aids + [k.NIL_VALUE], user1)
+        self.assertEqual([alert.alert_id for alert in alerts], aids[1:])
+        self.assertIsInstance(alerts[0], FollowAlert)
+        self.assertIsInstance(alerts[1], TaggingAlert)
+        self.assertEqual(alerts[0].user.get('username'), 'user2')
+        self.assertEqual(alerts[1].author, 'user2')
+
+        # The alert which did not verify has gone
+        self.assertEqual(r.zrevrange(k.USER_ALERTS.format(user1), 0, -1),
+                         aids[1:])
+        self.assertIsNone(r.get(k.ALERT.format(aids[0])))
+
+        # Alerts about deleted posts go too
+        delete_post(post1)
+        self.assertEqual(len(am.get_many(aids[1:], user1)), 1)
+        self.assertEqual(r.zcard(k.USER_ALERTS.format(user1)), 1)
+
+    def test_alert_format(self):
+        """Ensure alerts survive being stored and old jsonpickle alerts can
+        still be read.
+
+        """
+        user1 = create_account('user1', 'user1@pjuu.com', 'Password')
+
+        alert = TaggingAlert(user1, k.NIL_VALUE)
+        data = encode_alert(alert)
+        self.assertEqual(data.get('_t'), 'tag')
+        self.assertEqual(data.get('post_id'), k.NIL_VALUE)
+
+        decoded = decode_alert(dict((key, str(value))
+                                    for key, value in data.items()))
+        self.assertIsInstance(decoded, TaggingAlert)
+        self.assertEqual(decoded.__dict__, alert.__dict__)
+
+        # None can not be stored, it is left out and read back as None
+        data = encode_alert(TaggingAlert(None, k.NIL_VALUE))
+        self.assertNotIn('user_id', data)
+        self.assertIsNone(decode_alert(data).user_id)
+
+        # Unknown versions and types are not decoded
+        self.assertIsNone(decode_alert(dict(data, _v='0')))
+        self.assertIsNone(decode_alert(dict(data, _t='nope')))
+        self.assertIsNone(decode_alert({}))
+
+        # Unregistered types can not be stored
+        self.assertRaises(ValueError,
+                          lambda: encode_alert(PostingAlert(user1, 'post')))
+
+        # Alerts from before the hash format are still loaded
+        alert = BaseAlert(user1)
+        r.set(k.ALERT.format(alert.alert_id), jsonpickle.encode(alert))
+        self.assertEqual(AlertManager().get(alert.alert_id).user_id, user1)
+
+    def test_alert_delivery(self):
+        """Ensure every user is alerted once however delivery is split in to
+        batches and tasks.
+
+        """
+        # Force small batches and a Celery task
+        app.config['ALERT_BATCH_SIZE'] = 2
+        app.config['ALERT_TASK_SIZE'] = 3
+
+        user1 = create_account('user1', 'user1@pjuu.com', 'Password')
+        user_ids = [create_account('user{}'.format(i),
+                                   'user{}@pjuu.com'.format(i), 'Password')
+                    for i in range(2, 7)]
+
+        am = AlertManager()
+        alert = BaseAlert(user1)
+        # Duplicates and the user themselves are ignored
+        am.alert(alert, user_ids + [user1, user_ids[0]])
+
+        for user_id in user_ids:
+            self.assertEqual(get_alerts(user_id).items[0].alert_id,
+                             alert.alert_id)
+            self.assertEqual(r.zcard(k.USER_ALERTS.format(user_id)), 1)
+        self.assertEqual(r.zcard(k.USER_ALERTS.format(user1)), 0)
+        self.assertEqual(new_alerts(user_ids[0]), 0)
+
+        # Small audiences are delivered in the request
+        alert = BaseAlert(user1)
+        am.alert(alert, user_ids[:2])
+        self.assertEqual(new_alerts(user_ids[0]), 1)
+        self.assertEqual(new_alerts(user_ids[2]), 0)
+
+    def test_alert_display(self):
+        """Ensure alerts keep what they need to be displayed and that why a
+        user is alerted about a comment is looked up when they are loaded.
+
+        """
+        user1 = create_account('user1', 'user1@pjuu.com', 'Password')
+        user2 = create_account('user2', 'user2@pjuu.com', 'Password')
+        activate(user1)
+
+        post1 = create_post(user1, 'user1', 'Test post')
+        create_post(user2, 'user2', 'Hello @user1', post1)
+
+        alerts = get_alerts(user1).items
+        self.assertEqual(len(alerts), 2)
+        for alert in alerts:
+            self.assertEqual(r.hget(k.ALERT.format(alert.alert_id),
+                                    'username'), 'user2')
+            self.assertEqual(r.hget(k.ALERT.format(alert.alert_id),
+                                    'author'), 'user1')
+            self.assertEqual(alert.username, 'user2')
+            self.assertEqual(alert.author, 'user1')
+
+        comment_alert = [alert for alert in alerts
+                         if isinstance(alert, CommentingAlert)][0]
+        self.assertEqual(comment_alert.reason, SubscriptionReasons.POSTER)
+        self.assertIn('you posted', comment_alert.prettify(user1))
+
+        # Links are built from the stored post id and author
+        self.assertIn('<a href="{}">post</a>'.format(
+            url_for('posts.view_post', username='user1', post_id=post1)),
+            comment_alert.prettify(user1))
+        self.assertEqual(alert_link('users.profile', username='user2'),
+                         url_for('users.profile', username='user2'))
+        self.assertEqual(alert_link('users.profile', username='a b'),
+                         url_for('users.profile', username='a b'))
+
+        # Alerts stored without the display data still look it up
+        alert = FollowAlert(user2)
+        AlertManager().alert(alert, [user1])
+        self.assertIsNone(r.hget(k.ALERT.format(alert.alert_id), 'username'))
+        self.assertEqual(AlertManager().get(alert.alert_id).username, 'user2')
+
+    def test_alert_aggregation(self):
+        """Ensure comments on the same post are merged in to one alert."""
+        user1 = create_account('user1', 'user1@pjuu.com', 'Password')
+        user2 = create_account('user2', 'user2@pjuu.com', 'Password')
+        user3 = create_account('user3', 'user3@pjuu.com', 'Password')
+
+        post1 = create_post(user1, 'user1', 'Test post')
+        create_post(user2, 'user2', 'Test reply', post1)
+        create_post(user3, 'user3', 'Test reply', post1)
+        create_post(user2, 'user2', 'Test reply', post1)
+
+        # One alert which shows the most recent user
+        self.assertEqual(r.zcard(k.USER_ALERTS.format(user1)), 1)
+        alert = get_alerts(user1).items[0]
+        self.assertEqual(alert.username, 'user2')
+        self.assertEqual(alert.others(), 1)
+        self.assertIn('and 1 other commented', alert.prettify(user1))
+
+        # Users are not shown themselves as the most recent user or counted
+        # in the others
+        alert = get_alerts(user2).items[0]
+        self.assertEqual(alert.username, 'user3')
+        self.assertEqual(alert.user_id, user3)
+        self.assertEqual(alert.others(), 0)
+        self.assertIn('user3</a> commented', alert.prettify(user2).lower())
+
+        # Other posts and alerts after the window get their own alert
+        app.config['ALERT_AGGREGATE_WINDOW'] = 0
+        post2 = create_post(user1, 'user1', 'Test post')
+        create_post(user2, 'user2', 'Test reply', post2)
+        create_post(user3, 'user3', 'Test reply', post1)
+        self.assertEqual(r.zcard(k.USER_ALERTS.format(user1)), 3)
+
+    def test_alert_aggregation_others(self):
+        """Ensure commenters are only told about the users who commented after
+        they did and are never counted themselves.
+
+        """
+        user1 = create_account('user1', 'user1@pjuu.com', 'Password')
+        user2 = create_account('user2', 'user2@pjuu.com', 'Password')
+        user3 = create_account('user3', 'user3@pjuu.com', 'Password')
+        user4 = create_account('user4', 'user4@pjuu.com', 'Password')
+
+        post1 = create_post(user1, 'user1', 'Test post')
+        create_post(user2, 'user2', 'Test reply', post1)
+        create_post(user3, 'user3', 'Test reply', post1)
+        create_post(user4, 'user4', 'Test reply', post1)
+
+        # The poster was subscribed before anyone commented
+        alert = get_alerts(user1).items[0]
+        self.assertEqual(alert.username, 'user4')
+        self.assertEqual(alert.others(), 2)
+
+        # user2 is not one of their own others
+        alert = get_alerts(user2).items[0]
+        self.assertEqual(alert.username, 'user4')
+        self.assertEqual(alert.others(), 1)
+        self.assertIn('and 1 other commented', alert.prettify(user2))
+
+        # user3 was not subscribed when user2 commented
+        alert = get_alerts(user3).items[0]
+        self.assertEqual(alert.username, 'user4')
+        self.assertEqual(alert.others(), 0)
+
+        # Commenting again does not change when they were first subscribed
+        create_post(user2, 'user2', 'Test reply', post1)
+        alert = get_alerts(user3).items[0]
+        self.assertEqual(alert.username, 'user2')
+        self.assertEqual(alert.others(), 1)
@@ -9,7 +9,7 @@
 
 import json
 
-from flask import current_app as app, session
+from flask import current_app as app, g, session
 
 from pjuu import mongo as m, redis as r
 from pjuu.auth.backend import (
@@ -17,7 +17,9 @@ from pjuu.auth.backend import (
     bite, change_password, change_email, activate, ban, signin, signout,
     user_exists
 )
-from pjuu.auth.utils import get_uid, get_uid_email, get_uid_username
+from pjuu.auth.utils import (IdentityMap, get_session_user, get_uid,
+                             get_uid_email, get_uid_username, get_users,
+                             hydrate_authors, prefetch_users)
 from pjuu.auth.stats import get_stats
 from pjuu.lib import keys as K
 from pjuu.posts.backend import create_post
@@ -288,7 +290,7 @@ class AuthBackendTests(BackendTestCase):
         """Do all posts and replies get removed on deletion of account?
 
         """
-        user1 = create_account('user1', 'user2@pjuu.com', 'Password')
+        user1 = create_account('user1', 'user1@pjuu.com', 'Password')
         user2 = create_account('user2', 'user2@pjuu.com', 'Password')
 
         post1 = create_post(user1, 'user1', 'Test post')
@@ -411,6 +413,117 @@ class AuthBackendTests(BackendTestCase):
         self.assertNotIn(user2, post_json)
         self.assertNotIn(user3, post_json)
 
+    def test_identity_map(self):
+        """Ensure users are only loaded once per request and changes are seen.
+
+        """
+        user1 = create_account('user1', 'user1@pjuu.com', 'Password')
+        user2 = create_account('user2', 'user2@pjuu.com', 'Password')
+        user3 = create_account('user3', 'user3@pjuu.com', 'Password')
+        activate(user1)
+
+        g.identity_map = identity_map = IdentityMap()
+
+        # Looking a user up by name then id only goes to MongoDB once
+        self.assertEqual(get_uid('user1'), user1)
+        self.assertEqual(get_uid('user1@pjuu.com'), user1)
+        self.assertEqual(get_user(user1).get('username'), 'user1')
+        self.assertEqual(identity_map.queries, 1)
+        self.assertEqual(identity_map.saved, 2)
+
+        # Inactive users are still only found when asked for
+        self.assertIsNone(get_uid_username('user2'))
+        self.assertEqual(get_uid_username('user2', non_active=True), user2)
+        self.assertIsNone(get_uid_email('nobody@pjuu.com'))
+        self.assertIsNone(get_uid_email('nobody@pjuu.com'))
+        self.assertEqual(identity_map.queries, 3)
+
+        # Prefetched users are loaded in one query
+        prefetch_users([user2, user3, K.NIL_VALUE])
+        self.assertEqual(get_user(user3).get('username'), 'user3')
+        self.assertIsNone(get_user(K.NIL_VALUE))
+        self.assertEqual(identity_map.queries, 4)
+
+        # Callers get their own copy
+        get_user(user1)['username'] = 'changed'
+        self.assertEqual(get_user(user1).get('username'), 'user1')
+
+        # Writes drop the user from the map
+        mute(user1)
+        self.assertTrue(get_user(user1).get('muted'))
+        self.assertEqual(identity_map.queries, 5)
+
+        delete_account(user3)
+        self.assertIsNone(get_user(user3))
+
+        # Outside of a request there is no map
+        queries = identity_map.queries
+        g.pop('identity_map')
+        self.assertEqual(get_user(user1).get('username'), 'user1')
+        self.assertEqual(identity_map.queries, queries)
+
+    def test_bulk_hydration(self):
+        """Ensure users are loaded in one go and keep their order."""
+        user1 = create_account('user1', 'user1@pjuu.com', 'Password')
+        user2 = create_account('user2', 'user2@pjuu.com', 'Password')
+        m.db.users.update({'_id': user2}, {'$set': {'donated': True}})
+
+        for identity_map in (None, IdentityMap()):
+            if identity_map is not None:
+                g.identity_map = identity_map
+
+            users = get_users([user2, K.NIL_VALUE, user1, user2])
+            self.assertEqual([user.get('_id') for user in users],
+                             [user2, user1, user2])
+
+            posts = hydrate_authors([
+                {'_id': 1, 'user_id': user2},
+                {'_id': 2, 'user_id': K.NIL_VALUE},
+                {'_id': 3, 'user_id': user1}
+            ])
+            self.assertEqual([post.get('_id') for post in posts], [1, 3])
+            self.assertTrue(posts[0].get('user_donated'))
+            self.assertFalse(posts[1].get('user_donated'))
+            self.assertIsNone(posts[1].get('user_avatar'))
+
+        self.assertEqual(identity_map.queries, 1)
+        g.pop('identity_map')
+
+    def test_session_user(self):
+        """Ensure the signed in user is cached without the heavy fields and
+        changes are seen straight away.
+
+        """
+        user1 = create_account('user1', 'user1@pjuu.com', 'Password')
+        activate(user1)
+
+        user = get_session_user(user1)
+        self.assertEqual(user.get('username'), 'user1')
+        self.assertNotIn('password', user)
+        self.assertNotIn('about', user)
+        self.assertIsNotNone(r.get(K.USER_SESSION.format(user1)))
+
+        # The copy in Redis is used while the user has not changed
+        m.db.users.update({'_id': user1}, {'$set': {'banned': True}})
+        self.assertFalse(get_session_user(user1).get('banned'))
+
+        # Every change made through the backend is seen
+        for action, field in ((ban, 'banned'), (mute, 'muted'),
+                              (bite, 'op')):
+            action(user1)
+            self.assertTrue(get_session_user(user1).get(field))
+            action(user1, False)
+            self.assertFalse(get_session_user(user1).get(field))
+
+        delete_account(user1)
+        self.assertIsNone(get_session_user(user1))
+
+        # A TTL of 0 turns the cache off
+        user2 = create_account('user2', 'user2@pjuu.com', 'Password')
+        app.config['SESSION_USER_TTL'] = 0
+        self.assertEqual(get_session_user(user2).get('username'), 'user2')
+        self.assertIsNone(r.get(K.USER_SESSION.format(user2)))
+
     def test_stats(self):
         """Ensure the ``pjuu.auth.stats``s exposed stats are correct.
 
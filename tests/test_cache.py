@@ -0,0 +1,190 @@
+# -*- coding: utf8 -*-
+
+"""Post and author cache tests.
+
+:license: AGPL v3, see LICENSE for more details
+:copyright: 2014-2023 Joe Doherty
+
+"""
+
+# 3rd party imports
+from flask import current_app as app
+# Pjuu imports
+from pjuu import author_cache, mongo as m, redis as r, post_cache
+from pjuu.auth.backend import (activate, create_account, delete_account,
+                               donated)
+from pjuu.lib import keys as k
+from pjuu.lib.cache import DocumentCache, LRUCache
+from pjuu.posts.backend import (create_post, delete_post, flag_post,
+                                get_post, unflag_post, vote_post)
+from pjuu.users.backend import (follow_user, get_feed,
+                                update_profile_settings)
+# Test imports
+from tests import BackendTestCase
+
+
+class CacheTests(BackendTestCase):
+
+    def test_lru_cache(self):
+        """Ensure the process cache evicts the least recently used entry and
+        entries expire.
+
+        """
+        cache = LRUCache(maxsize=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        # Using 'a' makes 'b' the oldest
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(len(cache), 2)
+
+        cache.delete('a')
+        self.assertIsNone(cache.get('a'))
+
+        # Expired entries are not returned
+        cache = LRUCache(maxsize=2, ttl=-1)
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a', 'missing'), 'missing')
+        self.assertEqual(len(cache), 0)
+
+    def test_post_cache(self):
+        """Ensure posts are read through the cache and changes invalidate
+        them.
+
+        """
+        user1 = create_account('user1', 'user1@pjuu.com', 'Password')
+        user2 = create_account('user2', 'user2@pjuu.com', 'Password')
+        follow_user(user2, user1)
+        post1 = create_post(user1, 'user1', 'Test post')
+
+        # First read is a miss and fills both tiers
+        self.assertEqual(get_post(post1).get('body'), 'Test post')
+        self.assertIsNotNone(r.get(k.POST_CACHE.format(post1)))
+        self.assertEqual(post_cache.get_stats().get('misses'), 1)
+
+        # Second read is served by this process
+        self.assertEqual(get_feed(user2).items[0].get('_id'), post1)
+        self.assertEqual(post_cache.get_stats().get('local_hits'), 1)
+
+        # Then from Redis once the process has forgotten it
+        post_cache.local.clear()
+        get_post(post1)
+        self.assertEqual(post_cache.get_stats().get('redis_hits'), 1)
+
+        # Callers get their own copy
+        get_post(post1)['body'] = 'Changed'
+        self.assertEqual(get_post(post1).get('body'), 'Test post')
+
+        # Every change is seen straight away
+        vote_post(user2, post1)
+        self.assertEqual(get_post(post1).get('score'), 1)
+
+        flag_post(user2, post1)
+        self.assertEqual(get_post(post1).get('flags'), 1)
+
+        unflag_post(post1)
+        self.assertEqual(get_post(post1).get('flags'), 0)
+
+        comment1 = create_post(user2, 'user2', 'Test comment', post1)
+        self.assertEqual(get_post(comment1).get('reply_to'), post1)
+        self.assertEqual(get_post(post1).get('comment_count'), 1)
+
+        delete_post(comment1)
+        self.assertIsNone(get_post(comment1))
+        self.assertEqual(get_post(post1).get('comment_count'), 0)
+
+        # An invalidate while MongoDB is being read is not undone
+        find = post_cache.find
+
+        def racing_find(ids):
+            docs = list(find(ids))
+            post_cache.invalidate(*ids)
+            return docs
+
+        post_cache.invalidate(post1)
+        post_cache.find = racing_find
+        try:
+            self.assertEqual(get_post(post1).get('body'), 'Test post')
+        finally:
+            del post_cache.find
+        self.assertIsNone(r.get(k.POST_CACHE.format(post1)))
+        self.assertIsNone(post_cache.local.get(post1))
+
+        delete_post(post1)
+        self.assertIsNone(get_post(post1))
+        self.assertIsNone(r.get(k.POST_CACHE.format(post1)))
+        self.assertEqual(get_feed(user2).items, [])
+
+    def test_post_cache_disabled(self):
+        """Ensure the cache can be turned off."""
+        user1 = create_account('user1', 'user1@pjuu.com', 'Password')
+        post1 = create_post(user1, 'user1', 'Test post')
+
+        app.config['POST_CACHE_ENABLED'] = False
+        post_cache.init_app(app, m, r)
+
+        self.assertEqual(get_post(post1).get('body'), 'Test post')
+        self.assertIsNone(r.get(k.POST_CACHE.format(post1)))
+        self.assertEqual(post_cache.get_stats().get('misses'), 0)
+
+    def test_author_cache(self):
+        """Ensure author cards are cached as hashes and changes to the user
+        invalidate them.
+
+        """
+        user1 = create_account('user1', 'user1@pjuu.com', 'Password')
+        user2 = create_account('user2', 'user2@pjuu.com', 'Password')
+        activate(user1)
+        follow_user(user2, user1)
+        create_post(user1, 'user1', 'Test post')
+
+        self.assertFalse(get_feed(user2).items[0].get('user_donated'))
+        self.assertEqual(r.hgetall(k.AUTHOR_CACHE.format(user1)), {
+            'username': '"user1"',
+            'avatar': 'null',
+            'donated': 'null',
+            'active': 'true'
+        })
+        self.assertEqual(author_cache.get(user1), {
+            'username': 'user1',
+            'avatar': None,
+            'donated': None,
+            'active': True
+        })
+        self.assertEqual(author_cache.get_stats().get('misses'), 1)
+
+        # Then from Redis once the process has forgotten it
+        author_cache.local.clear()
+        get_feed(user2)
+        self.assertEqual(author_cache.get_stats().get('redis_hits'), 1)
+
+        # Changes are seen straight away
+        donated(user1)
+        self.assertTrue(get_feed(user2).items[0].get('user_donated'))
+
+        update_profile_settings(user1, about='Test')
+        self.assertFalse(r.exists(k.AUTHOR_CACHE.format(user1)))
+
+        activate(user1, False)
+        self.assertFalse(author_cache.get(user1).get('active'))
+
+        delete_account(user1)
+        self.assertIsNone(author_cache.get(user1))
+        self.assertEqual(get_feed(user2).items, [])
+
+    def test_counted_local_ttl(self):
+        """Ensure documents with counters are not kept in the process for
+        longer than it takes to flush the counters.
+
+        """
+        app.config['TEST_CACHE_LOCAL_TTL'] = 60
+        app.config['COUNTERS_FLUSH_INTERVAL'] = 10
+
+        for counted, ttl in ((False, 60), (True, 10)):
+            cache = DocumentCache('posts', k.POST_CACHE, k.POST_CACHE_STATS,
+                                  'TEST_CACHE', counted=counted)
+            cache.init_app(app._get_current_object(), m, r)
+            self.assertEqual(cache.local.ttl, ttl)
@@ -0,0 +1,87 @@
+# -*- coding: utf8 -*-
+
+"""Write-behind counter tests.
+
+:license: AGPL v3, see LICENSE for more details
+:copyright: 2014-2023 Joe Doherty
+
+"""
+
+# Pjuu imports
+from pjuu import mongo as m, redis as r
+from pjuu.auth.backend import create_account
+from pjuu.lib import keys as k
+from pjuu.lib.counters import apply_counters, incr_counter, reconcile_scores
+from pjuu.posts.backend import create_post, get_post, get_posts, vote_post
+from pjuu.users.backend import get_profile
+# Test imports
+from tests import BackendTestCase
+
+
+class CounterTests(BackendTestCase):
+
+    def test_counters(self):
+        """Ensure counter changes are seen straight away and written to
+        MongoDB when flushed.
+
+        """
+        from pjuu.lib.counters import flush_counters
+
+        user1 = create_account('user1', 'user1@pjuu.com', 'Password')
+        user2 = create_account('user2', 'user2@pjuu.com', 'Password')
+
+        post1 = create_post(user1, 'user1', 'Test post')
+        create_post(user2, 'user2', 'Test reply', post1)
+        vote_post(user2, post1)
+
+        # Nothing has been written yet
+        self.assertEqual(m.db.posts.find_one({'_id': post1}).get('score'), 0)
+        self.assertEqual(
+            m.db.posts.find_one({'_id': post1}).get('comment_count'), 0)
+        self.assertEqual(m.db.users.find_one({'_id': user1}).get('score'), 0)
+
+        # Reads add what is waiting
+        self.assertEqual(get_post(post1).get('score'), 1)
+        self.assertEqual(get_post(post1).get('comment_count'), 1)
+        self.assertEqual(get_posts(user1).items[0].get('score'), 1)
+        self.assertEqual(get_profile(user1).get('score'), 1)
+        self.assertEqual(apply_counters('posts', [None]), [None])
+
+        self.assertEqual(flush_counters(), 2)
+        self.assertEqual(flush_counters(), 0)
+        self.assertEqual(r.scard(k.DIRTY_COUNTERS.format('posts')), 0)
+
+        self.assertEqual(m.db.posts.find_one({'_id': post1}).get('score'), 1)
+        self.assertEqual(
+            m.db.posts.find_one({'_id': post1}).get('comment_count'), 1)
+        self.assertEqual(m.db.users.find_one({'_id': user1}).get('score'), 1)
+        self.assertEqual(get_post(post1).get('score'), 1)
+        self.assertEqual(get_profile(user1).get('score'), 1)
+
+        # Counters are only added to the documents they belong to
+        incr_counter('posts', k.NIL_VALUE, 'score')
+        self.assertEqual(flush_counters('posts'), 1)
+        self.assertIsNone(m.db.posts.find_one({'_id': k.NIL_VALUE}))
+
+    def test_reconcile_scores(self):
+        """Ensure scores are rebuilt from the votes."""
+        user1 = create_account('user1', 'user1@pjuu.com', 'Password')
+        user2 = create_account('user2', 'user2@pjuu.com', 'Password')
+        user3 = create_account('user3', 'user3@pjuu.com', 'Password')
+
+        post1 = create_post(user1, 'user1', 'Test post')
+        post2 = create_post(user1, 'user1', 'Test post')
+        vote_post(user2, post1)
+        vote_post(user3, post1)
+        vote_post(user2, post2, amount=-1)
+
+        # Lose some of the changes
+        r.delete(k.POST_COUNTERS.format(post1))
+        m.db.users.update({'_id': user2}, {'$set': {'score': 5}})
+
+        self.assertEqual(reconcile_scores(), (1, 1))
+        self.assertEqual(get_post(post1).get('score'), 2)
+        self.assertEqual(get_post(post2).get('score'), -1)
+        self.assertEqual(get_profile(user1).get('score'), 1)
+        self.assertEqual(get_profile(user2).get('score'), 0)
+        self.assertEqual(reconcile_scores(), (0, 0))
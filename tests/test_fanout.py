@@ -0,0 +1,181 @@
+# -*- coding: utf8 -*-
+
+"""Fan-out engine tests.
+
+:license: AGPL v3, see LICENSE for more details
+:copyright: 2014-2023 Joe Doherty
+
+"""
+
+# 3rd party imports
+from flask import current_app as app
+# Pjuu imports
+from pjuu import mongo as m, redis as r, scripts
+from pjuu.auth.backend import create_account
+from pjuu.lib import keys as k, timestamp
+from pjuu.lib.fanout import (active_users, add_to_feeds, fan_out,
+                             get_fan_out_stats, seed_last_seen)
+from pjuu.posts.backend import create_post, rebuild_feed, touch_feed
+from pjuu.users.backend import approve_user, follow_user, get_feed
+# Test imports
+from tests import BackendTestCase
+
+
+class FanOutTests(BackendTestCase):
+
+    def test_fan_out(self):
+        """Ensure every follower gets the post no matter how the audience is
+        split in to batches and sub-tasks.
+
+        """
+        # Force lots of small batches and sub-tasks
+        app.config['FANOUT_BATCH_SIZE'] = 2
+        app.config['FANOUT_TASK_SIZE'] = 3
+
+        user1 = create_account('user1', 'user1@pjuu.com', 'Password')
+
+        followers = []
+        for i in range(7):
+            user_id = create_account('follower{}'.format(i),
+                                     'follower{}@pjuu.com'.format(i),
+                                     'Password')
+            follow_user(user_id, user1)
+            followers.append(user_id)
+
+        post1 = create_post(user1, 'user1', 'Test post')
+
+        for follower_id in followers:
+            self.assertIn(post1,
+                          r.zrange(k.USER_FEED.format(follower_id), 0, -1))
+
+        # Call the engine directly to check what it reports
+        stats = fan_out(k.USER_FOLLOWERS.format(user1), 'post_id', 1)
+        self.assertEqual(stats.get('followers'), 7)
+        self.assertEqual(stats.get('subtasks'), 2)
+        self.assertGreaterEqual(stats.get('seconds'), 0)
+
+        # An empty audience is fine
+        stats = fan_out(k.USER_FOLLOWERS.format(k.NIL_VALUE), 'post_id', 1)
+        self.assertEqual(stats.get('followers'), 0)
+        self.assertEqual(stats.get('subtasks'), 0)
+
+        # Both posts and the calls above are in the running totals
+        stats = get_fan_out_stats()
+        self.assertEqual(stats.get('posts'), 3)
+        self.assertEqual(stats.get('followers'), 14)
+        self.assertEqual(stats.get('subtasks'), 4)
+
+    def test_add_to_feeds(self):
+        """Ensure posts are added to many feeds in one go and the feeds are
+        only trimmed once they are over the slack.
+
+        """
+        app.config['FEED_MAX_SIZE'] = 5
+        app.config['FEED_TRIM_SLACK'] = 2
+
+        # The script was loaded when the app was created
+        self.assertEqual(r.script_exists(scripts.feed_add.sha), [True])
+
+        feeds = [k.USER_FEED.format('user1'), k.USER_FEED.format('user2')]
+
+        for i in range(7):
+            self.assertEqual(add_to_feeds(feeds, {'post{}'.format(i): i}), 2)
+
+        # We are at the max size plus the slack, nothing has been removed
+        for feed in feeds:
+            self.assertEqual(r.zcard(feed), 7)
+
+        # One more pushes us over and we are cut back to the max size
+        add_to_feeds(feeds[:1], {'post7': 7})
+        self.assertEqual(r.zrange(feeds[0], 0, -1),
+                         ['post3', 'post4', 'post5', 'post6', 'post7'])
+        self.assertEqual(r.zcard(feeds[1]), 7)
+
+        # Many posts can be added to a single feed
+        add_to_feeds(feeds[1:], {'post8': 8, 'post9': 9})
+        self.assertEqual(r.zrange(feeds[1], 0, -1),
+                         ['post4', 'post5', 'post6', 'post8', 'post9'])
+
+        # Nothing to do
+        self.assertEqual(add_to_feeds([], {'post10': 10}), 0)
+        self.assertEqual(add_to_feeds(feeds, {}), 0)
+
+        # Redis losing the script is not a problem
+        r.script_flush()
+        add_to_feeds(feeds[:1], {'post10': 10})
+        self.assertIn('post10', r.zrange(feeds[0], 0, -1))
+
+    def test_dormant_users(self):
+        """Ensure dormant users are not fanned out to and get their feed back
+        when they return.
+
+        """
+        app.config['FEED_DORMANT_DAYS'] = 1
+
+        user1 = create_account('user1', 'user1@pjuu.com', 'Password')
+        user2 = create_account('user2', 'user2@pjuu.com', 'Password')
+        user3 = create_account('user3', 'user3@pjuu.com', 'Password')
+        follow_user(user2, user1)
+        follow_user(user3, user1)
+        approve_user(user1, user3)
+
+        # user2 has never been seen so is active, user3 left 2 days ago
+        r.zadd(k.USERS_LAST_SEEN, {user3: timestamp() - 2 * k.EXPIRE_24HRS})
+        self.assertEqual(active_users([user2, user3]), [user2])
+
+        post1 = create_post(user1, 'user1', 'Test post')
+        post2 = create_post(user1, 'user1', 'Test post',
+                            permission=k.PERM_APPROVED)
+        self.assertEqual(r.zrevrange(k.USER_FEED.format(user2), 0, -1),
+                         [post1])
+        self.assertEqual(r.zcard(k.USER_FEED.format(user3)), 0)
+
+        # Coming back rebuilds the feed, including the approved post user3
+        # is trusted with. The feed will expire if they leave again.
+        self.assertEqual([post.get('_id') for post in get_feed(user3).items],
+                         [post2, post1])
+        self.assertGreater(r.ttl(k.USER_FEED.format(user3)), 0)
+        self.assertEqual(active_users([user2, user3]), [user2, user3])
+        self.assertFalse(touch_feed(user3))
+
+        # Rebuild a feed after losing it
+        r.delete(k.USER_FEED.format(user2))
+        self.assertEqual(rebuild_feed(user2), 1)
+        self.assertEqual(r.zrevrange(k.USER_FEED.format(user2), 0, -1),
+                         [post1])
+
+        # Turned off everyone is active
+        app.config['FEED_DORMANT_DAYS'] = 0
+        r.zadd(k.USERS_LAST_SEEN, {user3: 0})
+        self.assertEqual(active_users([user2, user3]), [user2, user3])
+        self.assertFalse(touch_feed(user3))
+
+    def test_seed_last_seen(self):
+        """Ensure users from before last seen was recorded can become dormant
+        and users who have been seen are left alone.
+
+        """
+        app.config['FEED_DORMANT_DAYS'] = 1
+        now = timestamp()
+
+        user1 = create_account('user1', 'user1@pjuu.com', 'Password')
+        user2 = create_account('user2', 'user2@pjuu.com', 'Password')
+        user3 = create_account('user3', 'user3@pjuu.com', 'Password')
+        m.db.users.update_one({'_id': user1}, {'$set': {
+            'created': now - 3 * k.EXPIRE_24HRS,
+            'last_login': now - 2 * k.EXPIRE_24HRS}})
+        m.db.users.update_one({'_id': user2}, {'$set': {
+            'created': now - 3 * k.EXPIRE_24HRS}})
+        touch_feed(user3)
+        self.assertEqual(active_users([user1, user2, user3]),
+                         [user1, user2, user3])
+
+        self.assertEqual(seed_last_seen(), 2)
+        self.assertEqual(r.zscore(k.USERS_LAST_SEEN, user1),
+                         now - 2 * k.EXPIRE_24HRS)
+        self.assertEqual(r.zscore(k.USERS_LAST_SEEN, user2),
+                         now - 3 * k.EXPIRE_24HRS)
+        self.assertEqual(active_users([user1, user2, user3]), [user3])
+
+        # Running it again changes nothing
+        self.assertEqual(seed_last_seen(), 0)
@@ -0,0 +1,121 @@
+# -*- coding: utf8 -*-
+
+"""Hot feed tests.
+
+:license: AGPL v3, see LICENSE for more details
+:copyright: 2014-2023 Joe Doherty
+
+"""
+
+# 3rd party imports
+from flask import current_app as app
+# Pjuu imports
+from pjuu import mongo as m, redis as r
+from pjuu.auth.backend import create_account
+from pjuu.lib import keys as k, timestamp
+from pjuu.lib.hot import hot_score, rebuild_hot_feeds
+from pjuu.posts.backend import (create_post, delete_post, get_hot_feed,
+                                vote_post)
+# Test imports
+from tests import BackendTestCase
+
+
+class HotTests(BackendTestCase):
+
+    def test_hot_feed(self):
+        """Ensure posts are ranked by their points and moved as they are
+        voted and commented on.
+
+        """
+        user1 = create_account('user1', 'user1@pjuu.com', 'Password')
+        user2 = create_account('user2', 'user2@pjuu.com', 'Password')
+        user3 = create_account('user3', 'user3@pjuu.com', 'Password')
+
+        post1 = create_post(user1, 'user1', 'Test post')
+        post2 = create_post(user1, 'user1', 'Test post',
+                            permission=k.PERM_PJUU)
+        post3 = create_post(user1, 'user1', 'Test post')
+
+        def hot(perm=k.PERM_PUBLIC):
+            return [post.get('_id')
+                    for post in get_hot_feed(perm=perm).items]
+
+        # Newest first until there are votes
+        self.assertEqual(hot(), [post3, post1])
+        self.assertEqual(hot(k.PERM_PJUU), [post3, post2, post1])
+
+        # The points are worked out the same as `hot_score`
+        vote_post(user2, post1)
+        vote_post(user3, post1)
+        created = m.db.posts.find_one({'_id': post1}).get('created')
+        self.assertAlmostEqual(r.zscore(k.HOT_FEED.format(k.PERM_PUBLIC),
+                                        post1), hot_score(2, created))
+        self.assertEqual(hot(), [post1, post3])
+
+        # Comments count towards the points, the reply is not in the feed
+        reply1 = create_post(user2, 'user2', 'Test reply', post2)
+        create_post(user3, 'user3', 'Test reply', post2)
+        vote_post(user2, post2)
+        self.assertEqual(hot(k.PERM_PJUU), [post2, post1, post3])
+        self.assertNotIn(reply1, hot(k.PERM_PJUU))
+
+        delete_post(reply1)
+        self.assertEqual(
+            r.hget(k.HOT_POINTS.format(k.PERM_PJUU), post2), '2')
+
+        # Down votes sink a post
+        vote_post(user2, post3, amount=-1)
+        vote_post(user3, post3, amount=-1)
+        self.assertEqual(hot(), [post1, post3])
+        self.assertLess(r.zscore(k.HOT_FEED.format(k.PERM_PUBLIC), post3),
+                        hot_score(0, timestamp() - 60))
+
+        # Pagination
+        pagination = get_hot_feed(page=2, per_page=2, perm=k.PERM_PJUU)
+        self.assertEqual(pagination.total, 3)
+        self.assertEqual([post.get('_id') for post in pagination.items],
+                         [post3])
+
+        delete_post(post1)
+        self.assertEqual(hot(), [post3])
+        self.assertEqual(hot(k.PERM_PJUU), [post2, post3])
+
+    def test_hot_feed_cleanup(self):
+        """Ensure the hot feed is trimmed, missing posts are cleaned up and
+        it can be rebuilt.
+
+        """
+        app.config['HOT_MAX_SIZE'] = 2
+        app.config['FEED_TRIM_SLACK'] = 0
+
+        user1 = create_account('user1', 'user1@pjuu.com', 'Password')
+        user2 = create_account('user2', 'user2@pjuu.com', 'Password')
+
+        post1 = create_post(user1, 'user1', 'Test post')
+        post2 = create_post(user1, 'user1', 'Test post')
+        post3 = create_post(user1, 'user1', 'Test post')
+
+        feed_key = k.HOT_FEED.format(k.PERM_PUBLIC)
+        points_key = k.HOT_POINTS.format(k.PERM_PUBLIC)
+        self.assertEqual(r.zrevrange(feed_key, 0, -1), [post3, post2])
+        self.assertFalse(r.hexists(points_key, post1))
+
+        # Posts which have dropped out are not added back
+        vote_post(user2, post1)
+        self.assertNotIn(post1, r.zrange(feed_key, 0, -1))
+
+        # Posts missing from MongoDB are removed when read
+        m.db.posts.delete_one({'_id': post2})
+        self.assertEqual([post.get('_id') for post in
+                          get_hot_feed(perm=k.PERM_PUBLIC).items], [post3])
+        self.assertEqual(r.zrange(feed_key, 0, -1), [post3])
+        self.assertFalse(r.hexists(points_key, post2))
+
+        # Rebuilding keeps the newest posts and their points
+        r.delete(feed_key, points_key)
+        self.assertEqual(rebuild_hot_feeds(), 2)
+        self.assertEqual(r.zrevrange(feed_key, 0, -1), [post3, post1])
+        self.assertEqual(r.hget(points_key, post1), '1')
+
+        app.config['HOT_MAX_SIZE'] = 1000
+        app.config['FEED_TRIM_SLACK'] = 100
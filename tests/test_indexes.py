@@ -0,0 +1,106 @@
+# -*- coding: utf8 -*-
+
+"""MongoDB index tests. Every declared query shape has to be answered by an
+index without sorting in memory.
+
+:license: AGPL v3, see LICENSE for more details
+:copyright: 2014-2023 Joe Doherty
+
+"""
+
+# 3rd party imports
+import pymongo
+# Pjuu imports
+from pjuu import mongo as m
+from pjuu.auth.backend import create_account
+from pjuu.lib.indexes import (INDEXES, QUERY_SHAPES, REDUNDANT_INDEXES,
+                              drop_redundant_indexes, ensure_indexes)
+from pjuu.lib.pagination import keyset_query
+from pjuu.posts.backend import create_post, flag_post
+# Test imports
+from tests import BackendTestCase
+
+
+def plan_stages(plan):
+    """Returns the name of every stage in an explain `plan`."""
+    stages = []
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            stages.append(plan['stage'])
+        for value in plan.values():
+            stages.extend(plan_stages(value))
+    elif isinstance(plan, list):
+        for value in plan:
+            stages.extend(plan_stages(value))
+    return stages
+
+
+class IndexTests(BackendTestCase):
+
+    def create_posts(self):
+        """Create enough posts of each kind that a collection scan is never
+        the only plan.
+
+        """
+        user1 = create_account('user1', 'user1@pjuu.com', 'Password')
+        user2 = create_account('user2', 'user2@pjuu.com', 'Password')
+
+        for i in range(10):
+            post = create_post(user1, 'user1', 'Post #{} #hashtag'.format(i),
+                               permission=i % 3)
+            create_post(user2, 'user2', 'Reply #{} #hashtag'.format(i),
+                        post)
+            if i % 2:
+                flag_post(user2, post)
+
+    def assertIndexed(self, name, collection, lookup, sort):
+        plan = m.db[collection].find(lookup).sort(sort).explain()
+        stages = plan_stages(plan.get('queryPlanner', {}).get('winningPlan'))
+
+        self.assertTrue(stages, name)
+        self.assertNotIn('COLLSCAN', stages, name)
+        self.assertNotIn('SORT', stages, name)
+
+    def test_query_shapes(self):
+        """Ensure no query shape scans the collection or sorts in memory,
+        with and without a cursor.
+
+        """
+        self.create_posts()
+
+        post = m.db.posts.find_one({'reply_to': {'$exists': False}})
+        cursor = (post.get('created'), post.get('_id'))
+
+        for name, shape in QUERY_SHAPES.items():
+            self.assertIndexed(name, shape.collection, shape.lookup,
+                               shape.sort)
+
+            if shape.sort[0][0] == 'created':
+                for kwargs in ({'before': cursor}, {'after': cursor}):
+                    lookup, sort, _ = keyset_query(shape.lookup, **kwargs)
+                    self.assertIndexed(name, shape.collection, lookup, sort)
+
+    def test_ensure_indexes(self):
+        """Ensure the declared indexes are created and indexes from older
+        versions are dropped.
+
+        """
+        m.db.posts.create_index([('user_id', pymongo.DESCENDING)])
+        m.db.posts.create_index([('reply_to', pymongo.DESCENDING),
+                                 ('created', pymongo.DESCENDING),
+                                 ('_id', pymongo.DESCENDING)])
+        self.assertEqual(drop_redundant_indexes(), 2)
+        self.assertEqual(drop_redundant_indexes(), 0)
+
+        ensure_indexes()
+        for collection, indexes in INDEXES.items():
+            existing = [index.get('key') for index in
+                        m.db[collection].index_information().values()]
+            for keys, _ in indexes:
+                self.assertIn(keys, existing)
+
+            for name in REDUNDANT_INDEXES.get(collection, []):
+                self.assertNotIn(name, m.db[collection].index_information())
+
+        self.assertEqual(m.db.posts.index_information().get(
+            'flags_-1').get('partialFilterExpression'), {'flags': {'$gt': 0}})
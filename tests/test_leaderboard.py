@@ -0,0 +1,74 @@
+# -*- coding: utf8 -*-
+
+"""Leaderboard tests.
+
+:license: AGPL v3, see LICENSE for more details
+:copyright: 2014-2023 Joe Doherty
+
+"""
+
+# Pjuu imports
+from pjuu import mongo as m, redis as r
+from pjuu.auth.backend import create_account, delete_account
+from pjuu.lib import keys as k
+from pjuu.lib.leaderboard import get_rank, get_top_users, rebuild_leaderboard
+from pjuu.posts.backend import create_post, vote_post
+from pjuu.users.backend import top_users_by_score
+# Test imports
+from tests import BackendTestCase
+
+
+class LeaderboardTests(BackendTestCase):
+
+    def test_leaderboard(self):
+        """Ensure the leaderboard follows the users scores."""
+        user1 = create_account('user1', 'user1@pjuu.com', 'Password')
+        user2 = create_account('user2', 'user2@pjuu.com', 'Password')
+        user3 = create_account('user3', 'user3@pjuu.com', 'Password')
+
+        # Everyone starts on 0
+        self.assertEqual(get_top_users().total, 3)
+        self.assertEqual(r.zscore(k.USERS_LEADERBOARD, user1), 0)
+
+        post1 = create_post(user1, 'user1', 'Test post')
+        post2 = create_post(user2, 'user2', 'Test post')
+        vote_post(user2, post1)
+        vote_post(user3, post1)
+        vote_post(user1, post2, amount=-1)
+
+        self.assertEqual(get_rank(user1), 1)
+        self.assertEqual(get_rank(user3), 2)
+        self.assertEqual(get_rank(user2), 3)
+        self.assertIsNone(get_rank(k.NIL_VALUE))
+
+        pagination = get_top_users(1, 2)
+        self.assertEqual(pagination.total, 3)
+        self.assertEqual(pagination.items[0], {
+            '_id': user1,
+            'username': 'user1',
+            'avatar': None,
+            'score': 2,
+            'rank': 1
+        })
+        self.assertEqual(get_top_users(2, 2).items[0].get('score'), -1)
+        self.assertEqual(
+            [user.get('username') for user in top_users_by_score()],
+            ['user1', 'user3', 'user2'])
+
+        # Reversing a vote changes the score back
+        vote_post(user1, post2, amount=-1)
+        self.assertEqual(r.zscore(k.USERS_LEADERBOARD, user2), 0)
+
+        # Deleted users leave and ones which are missing are cleaned up
+        delete_account(user3)
+        self.assertIsNone(get_rank(user3))
+        r.zadd(k.USERS_LEADERBOARD, {k.NIL_VALUE: 100})
+        self.assertEqual(len(get_top_users().items), 2)
+        self.assertIsNone(get_rank(k.NIL_VALUE))
+
+        # Rebuilding takes the scores from MongoDB
+        r.delete(k.USERS_LEADERBOARD)
+        m.db.users.update({'_id': user2}, {'$set': {'score': 10}})
+        self.assertEqual(rebuild_leaderboard(), 2)
+        self.assertEqual(get_rank(user2), 1)
+        self.assertEqual(r.zscore(k.USERS_LEADERBOARD, user1), 2)
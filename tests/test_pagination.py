@@ -8,7 +8,9 @@
 """
 
 # Pjuu imports
-from pjuu.lib.pagination import Pagination, handle_page
+from pjuu.lib.pagination import (END, Pagination, decode_cursor,
+                                 encode_cursor, handle_cursor, handle_page,
+                                 keyset_query)
 # Test imports
 from tests import BackendTestCase
 
@@ -101,3 +103,94 @@ class PaginationTests(BackendTestCase):
         self.assertEqual(handle_page(request), 1)
         request.args['page'] = {}
         self.assertEqual(handle_page(request), 1)
+
+    def test_cursors(self):
+        """Check cursors survive a round trip and bad ones are ignored."""
+        cursor = encode_cursor({'_id': 'abc', 'created': 1234.5678})
+        # Safe to put in a URL as is
+        self.assertNotIn('=', cursor)
+        self.assertEqual(decode_cursor(cursor), (1234.5678, 'abc'))
+        self.assertEqual(decode_cursor(END), END)
+
+        for cursor in (None, '', 'abc', '!!!', encode_cursor({}),
+                       encode_cursor({'created': 'x', '_id': 'abc'})):
+            self.assertIsNone(decode_cursor(cursor))
+
+        class Request(object):
+            args = {'after': encode_cursor({'_id': 'abc', 'created': 1})}
+
+        self.assertEqual(handle_cursor(Request()),
+                         {'before': None, 'after': (1, 'abc')})
+
+    def test_keyset_query(self):
+        """Check the queries built for each side of a cursor."""
+        lookup = {'user_id': 'abc'}
+
+        # No cursor, the lookup is untouched
+        self.assertEqual(keyset_query(lookup), (
+            lookup, [('created', -1), ('_id', -1)], False))
+
+        # The next page of a newest first listing is older
+        query, sort, reverse = keyset_query(lookup, -1, after=(1, 'a'))
+        self.assertEqual(query, {'$and': [lookup, {'$or': [
+            {'created': {'$lt': 1}},
+            {'created': 1, '_id': {'$lt': 'a'}}]}]})
+        self.assertEqual(sort, [('created', -1), ('_id', -1)])
+        self.assertFalse(reverse)
+
+        # The previous page is read in the other direction then reversed
+        query, sort, reverse = keyset_query(lookup, -1, before=(1, 'a'))
+        self.assertEqual(query['$and'][1]['$or'][0], {'created': {'$gt': 1}})
+        self.assertEqual(sort, [('created', 1), ('_id', 1)])
+        self.assertTrue(reverse)
+
+        # Oldest first listings are the other way around
+        query, sort, reverse = keyset_query(lookup, 1, after=(1, 'a'))
+        self.assertEqual(query['$and'][1]['$or'][0], {'created': {'$gt': 1}})
+        self.assertEqual(sort, [('created', 1), ('_id', 1)])
+
+        # The last page is the first page read backwards
+        self.assertEqual(keyset_query(lookup, -1, before=END), (
+            lookup, [('created', 1), ('_id', 1)], True))
+
+    def test_keyset_links(self):
+        """Check which links a keyset pagination has."""
+        p = Pagination([], 100, 1, 10, None, 'next', keyset=True)
+        self.assertTrue(p.has_pages)
+        self.assertIsNone(p.prev_args)
+        self.assertEqual(p.next_args, {'after': 'next'})
+        self.assertEqual(p.first_args, {'page': 1})
+        self.assertEqual(p.last_args, {'before': END})
+
+        p = Pagination([], 100, 1, 10, 'prev', None, keyset=True)
+        self.assertEqual(p.prev_args, {'before': 'prev'})
+        self.assertIsNone(p.next_args)
+
+        # A single page has no links at all
+        p = Pagination([], 5, 1, 10, keyset=True)
+        self.assertFalse(p.has_pages)
+
+        # Page numbers still work without keyset
+        p = Pagination([], 100, 2, 10)
+        self.assertEqual(p.prev_args, {'page': 1})
+        self.assertEqual(p.next_args, {'page': 3})
+        self.assertEqual(p.last_args, {'page': 10})
+
+    def test_lazy_total(self):
+        """Check a total given as a function is only counted when needed."""
+        calls = []
+
+        def count():
+            calls.append(1)
+            return 100
+
+        # Keyset links do not need the total
+        p = Pagination([], count, 1, 10, None, 'next', keyset=True)
+        self.assertTrue(p.has_pages)
+        self.assertEqual(p.next_args, {'after': 'next'})
+        self.assertEqual(calls, [])
+
+        # It is counted once when asked for
+        self.assertEqual(p.total, 100)
+        self.assertEqual(p.pages, 10)
+        self.assertEqual(calls, [1])
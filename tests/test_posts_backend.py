@@ -15,11 +15,12 @@ from pjuu import mongo as m, redis as r, storage
 from pjuu.auth.backend import create_account, delete_account, activate
 from pjuu.auth.utils import get_user
 from pjuu.lib import keys as K, timestamp
+from pjuu.lib.pagination import END, decode_cursor
 from pjuu.posts.backend import (
     AlreadyVoted, CantVoteOnOwn, CommentingAlert, SubscriptionReasons,
     TaggingAlert, check_post, create_post, delete_post, get_post, get_posts,
     get_replies, is_subscribed, subscribe, unsubscribe, vote_post,
-    get_hashtagged_posts, has_voted)
+    get_hashtagged_posts, has_voted, get_global_feed)
 from pjuu.posts.stats import get_stats
 from pjuu.users.backend import (
     follow_user, get_alerts, get_feed, approve_user
@@ -211,6 +212,85 @@ class PostBackendTests(BackendTestCase):
         self.assertEqual(len(get_feed(user1, per_page=50).items), 50)
         self.assertEqual(len(get_feed(user1, per_page=100).items), 100)
 
+    def test_pulled_feed(self):
+        """Ensure authors above FEED_PULL_THRESHOLD are merged in to their
+        followers feeds when read rather than pushed."""
+        app.config['FEED_PULL_THRESHOLD'] = 2
+
+        user1 = create_account('user1', 'user1@pjuu.com', 'Password')
+        user2 = create_account('user2', 'user2@pjuu.com', 'Password')
+        user3 = create_account('user3', 'user3@pjuu.com', 'Password')
+        user4 = create_account('user4', 'user4@pjuu.com', 'Password')
+
+        # user1 is popular, user4 is not
+        follow_user(user2, user1)
+        follow_user(user3, user1)
+        follow_user(user2, user4)
+        approve_user(user1, user2)
+
+        # Interleave pulled and pushed posts
+        posts = []
+        for i in range(5):
+            posts.append(create_post(user1, 'user1', 'Pulled {}'.format(i)))
+            posts.append(create_post(user4, 'user4', 'Pushed {}'.format(i)))
+
+        approved = create_post(user1, 'user1', 'Approved',
+                               permission=K.PERM_APPROVED)
+
+        # user1's posts are never written to the followers feeds
+        self.assertNotIn(posts[0], r.zrange(K.USER_FEED.format(user2), 0, -1))
+        self.assertIn(posts[1], r.zrange(K.USER_FEED.format(user2), 0, -1))
+        # The author still gets the post in their own feed
+        self.assertIn(posts[0], r.zrange(K.USER_FEED.format(user1), 0, -1))
+
+        # Merged in time order, approved posts only for approved followers
+        feed = get_feed(user2, 1, 25)
+        self.assertEqual([post.get('_id') for post in feed.items],
+                         [approved] + posts[::-1])
+        self.assertEqual(feed.total, 11)
+
+        feed = get_feed(user3, 1, 25)
+        self.assertEqual([post.get('_id') for post in feed.items],
+                         posts[-2::-2])
+        self.assertEqual(feed.total, 5)
+
+        # Pagination works across both sources
+        self.assertEqual([post.get('_id') for post in
+                          get_feed(user2, 2, 4).items], posts[::-1][3:7])
+        self.assertEqual(len(get_feed(user2, 4, 4).items), 0)
+
+        # Turning pulling off (or losing followers) fans out again. The
+        # posts made while pulled are pushed so none of them are lost
+        app.config['FEED_PULL_THRESHOLD'] = 0
+        post1 = create_post(user1, 'user1', 'Pushed again')
+        self.assertIn(post1, r.zrange(K.USER_FEED.format(user3), 0, -1))
+        self.assertFalse(r.sismember(K.PULL_AUTHORS, user1))
+
+        feed = get_feed(user3, 1, 25)
+        self.assertEqual([post.get('_id') for post in feed.items],
+                         [post1] + posts[-2::-2])
+        self.assertEqual(feed.total, 6)
+
+        feed = get_feed(user2, 1, 25)
+        self.assertEqual([post.get('_id') for post in feed.items],
+                         [post1, approved] + posts[::-1])
+        self.assertEqual(feed.total, 12)
+
+        # Posts which are pushed and pulled are only counted once
+        app.config['FEED_PULL_THRESHOLD'] = 2
+        post2 = create_post(user1, 'user1', 'Pulled again')
+        self.assertTrue(r.sismember(K.PULL_AUTHORS, user1))
+
+        feed = get_feed(user3, 1, 25)
+        self.assertEqual([post.get('_id') for post in feed.items],
+                         [post2, post1] + posts[-2::-2])
+        self.assertEqual(feed.total, 7)
+
+        # The merged feed is capped like a pushed feed
+        app.config['FEED_MAX_SIZE'] = 3
+        self.assertEqual(get_feed(user3, 1, 25).total, 3)
+        app.config['FEED_MAX_SIZE'] = 1000
+
     def test_get_posts(self):
         """
         Test users post list works correctly
@@ -258,6 +338,77 @@ class PostBackendTests(BackendTestCase):
         self.assertEqual(len(get_posts(user1, per_page=50).items), 50)
         self.assertEqual(len(get_posts(user1, per_page=100).items), 100)
 
+    def test_keyset_pagination(self):
+        """Ensure listings can be walked in both directions with cursors and
+        every post is seen once.
+
+        """
+        user1 = create_account('user1', 'user1@pjuu.com', 'Password')
+
+        posts = [create_post(user1, 'user1', 'Test post {} #test'.format(i))
+                 for i in range(25)]
+        # Two posts created at the same time are still told apart by _id
+        m.db.posts.update({'_id': {'$in': posts[10:12]}},
+                          {'$set': {'created': 1}}, multi=True)
+        newest_first = [post.get('_id') for post in m.db.posts.find().sort(
+            [('created', -1), ('_id', -1)])]
+
+        for get_page in (lambda **kw: get_posts(user1, **kw),
+                         lambda **kw: get_global_feed(**kw),
+                         lambda **kw: get_hashtagged_posts('test', **kw)):
+            # Walk forward from the first page
+            seen = []
+            pagination = get_page(per_page=10)
+            self.assertIsNone(pagination.prev_cursor)
+            while True:
+                seen.extend([post.get('_id') for post in pagination.items])
+                if pagination.next_cursor is None:
+                    break
+                pagination = get_page(
+                    per_page=10, after=decode_cursor(pagination.next_cursor))
+            self.assertEqual(seen, newest_first)
+
+            # Walk back from the last page
+            seen = []
+            pagination = get_page(per_page=10, before=END)
+            self.assertIsNone(pagination.next_cursor)
+            self.assertEqual(len(pagination.items), 10)
+            while True:
+                seen = [post.get('_id') for post in pagination.items] + seen
+                if pagination.prev_cursor is None:
+                    break
+                pagination = get_page(
+                    per_page=10, before=decode_cursor(pagination.prev_cursor))
+            self.assertEqual(seen, newest_first)
+
+            # Page numbers still work and hand out cursors
+            pagination = get_page(page=2, per_page=10)
+            self.assertEqual([post.get('_id') for post in pagination.items],
+                             newest_first[10:20])
+            self.assertIsNotNone(pagination.prev_cursor)
+            self.assertIsNotNone(pagination.next_cursor)
+
+        # Totals are correct but the expensive ones are cached for a while
+        self.assertEqual(get_global_feed().total, 25)
+        self.assertEqual(get_hashtagged_posts('test').total, 25)
+        create_post(user1, 'user1', 'Test post #test')
+        self.assertEqual(get_posts(user1).total, 26)
+        self.assertEqual(get_global_feed().total, 25)
+        self.assertEqual(get_hashtagged_posts('test').total, 25)
+        r.delete(K.GLOBAL_COUNT.format(0), K.HASHTAG_COUNT.format('test'))
+        self.assertEqual(get_global_feed().total, 26)
+        self.assertEqual(get_hashtagged_posts('test').total, 26)
+
+        # Replies can be walked oldest first
+        comments = [create_post(user1, 'user1', 'Comment {}'.format(i),
+                                posts[0]) for i in range(5)]
+        pagination = get_replies(posts[0], per_page=3, sort_order=1)
+        pagination = get_replies(posts[0], per_page=3, sort_order=1,
+                                 after=decode_cursor(pagination.next_cursor))
+        self.assertEqual([reply.get('_id') for reply in pagination.items],
+                         comments[3:])
+        self.assertIsNone(pagination.next_cursor)
+
     def test_get_replies(self):
         """Test getting all replies for a post
 
@@ -419,7 +570,10 @@ class PostBackendTests(BackendTestCase):
         # Create a comment by user 1
         comment1 = create_post(user1, 'user1', 'Test comment', post1)
 
-        # Let's cheat and set user1's score back to 0
+        # Let's cheat and set user1's score back to 0, the score changes need
+        # to be in MongoDB first
+        from pjuu.lib.counters import flush_counters
+        flush_counters()
         m.db.users.update({'_id': user1},
                           {'$set': {'score': 0}})
 
@@ -479,6 +633,16 @@ class PostBackendTests(BackendTestCase):
                           lambda: vote_post(user2, comment1, 1,
                                             timestamp() + K.VOTE_TIMEOUT + 1))
 
+        # The author can be passed in rather than looked up
+        self.assertRaises(CantVoteOnOwn,
+                          lambda: vote_post(user1, post1, author_id=user1))
+        self.assertEqual(get_post(post1).get('score'), -1)
+        self.assertEqual(vote_post(user3, post1, -1, author_id=user1), -1)
+        self.assertEqual(get_post(post1).get('score'), -2)
+        self.assertEqual(vote_post(user3, post1, -1, author_id=user1), 0)
+        self.assertIsNone(has_voted(user3, post1))
+        self.assertEqual(get_post(post1).get('score'), -1)
+
     def test_delete(self):
         """
         Tests delete_post() does what it should.
@@ -512,6 +676,10 @@ class PostBackendTests(BackendTestCase):
         # Ensure the comment count on post1 is correct
         self.assertEqual(get_post(post1).get('comment_count'), 3)
 
+        # A vote waiting to be written is dropped along with the comment
+        vote_post(user2, reply1)
+        self.assertTrue(r.exists(K.POST_COUNTERS.format(reply1)))
+
         # Delete the post. This should delete all the comments, we will check
         self.assertIsNone(delete_post(post1))
         # Check that the post does not exist
@@ -520,6 +688,7 @@ class PostBackendTests(BackendTestCase):
         self.assertIsNone(get_post(reply1))
         self.assertIsNone(get_post(reply2))
         self.assertIsNone(get_post(reply3))
+        self.assertFalse(r.exists(K.POST_COUNTERS.format(reply1)))
 
         # Test deleting posts with uploads
         # Ensuring that the images are gone.
@@ -1646,10 +1646,14 @@ class PostFrontendTests(FrontendTestCase):
             'password': 'Password'
         }, follow_redirects=True)
 
-        # Check all conditions which will result in a 404
+        # No hashtag shows the trending hashtags
+        create_post(user1, 'user1', '#trending')
         resp = self.client.get(url_for('posts.hashtags'))
-        self.assertEqual(404, resp.status_code)
+        self.assertEqual(200, resp.status_code)
+        self.assertIn('<h1>Trending</h1>', resp.get_data(as_text=True))
+        self.assertIn('#trending', resp.get_data(as_text=True))
 
+        # Check all conditions which will result in a 404
         resp = self.client.get(url_for('posts.hashtags', hashtag=''))
         self.assertEqual(404, resp.status_code)
 
@@ -1829,3 +1833,25 @@ class PostFrontendTests(FrontendTestCase):
         self.assertNotIn('trusted post #1', resp.get_data(as_text=True))
         self.assertNotIn('trusted post #2', resp.get_data(as_text=True))
         self.assertNotIn('trusted post #3', resp.get_data(as_text=True))
+
+    def test_hot_feed(self):
+        """Ensure the hot feed shows the posts the user can see."""
+        user1 = create_account('user1', 'user1@pjuu.com', 'Password')
+        activate(user1)
+
+        create_post(user1, 'user1', 'public post', permission=k.PERM_PUBLIC)
+        create_post(user1, 'user1', 'pjuu post', permission=k.PERM_PJUU)
+
+        resp = self.client.get(url_for('posts.hot_feed'))
+        self.assertIn('<h1>Hot', resp.get_data(as_text=True))
+        self.assertIn('public post', resp.get_data(as_text=True))
+        self.assertNotIn('pjuu post', resp.get_data(as_text=True))
+
+        self.client.post(url_for('auth.signin'), data={
+            'username': 'user1',
+            'password': 'Password'
+        }, follow_redirects=True)
+
+        resp = self.client.get(url_for('posts.hot_feed'))
+        self.assertIn('public post', resp.get_data(as_text=True))
+        self.assertIn('pjuu post', resp.get_data(as_text=True))
@@ -0,0 +1,150 @@
+# -*- coding: utf8 -*-
+
+"""Global and hashtag timeline tests.
+
+:license: AGPL v3, see LICENSE for more details
+:copyright: 2014-2023 Joe Doherty
+
+"""
+
+# 3rd party imports
+from flask import current_app as app
+# Pjuu imports
+from pjuu import mongo as m, redis as r, post_cache
+from pjuu.auth.backend import create_account
+from pjuu.lib import keys as k
+from pjuu.lib.pagination import decode_cursor
+from pjuu.lib.timelines import rebuild_timelines
+from pjuu.posts.backend import (create_post, delete_post, get_global_feed,
+                                get_hashtagged_posts)
+# Test imports
+from tests import BackendTestCase
+
+
+class TimelineTests(BackendTestCase):
+
+    def test_timelines(self):
+        """Ensure posts are written to and removed from the right timelines.
+
+        """
+        user1 = create_account('user1', 'user1@pjuu.com', 'Password')
+
+        # Hashtag timelines are only written to once they have been read
+        get_hashtagged_posts('aa')
+        get_hashtagged_posts('bb')
+
+        post1 = create_post(user1, 'user1', '#aa #aa #bb #cc')
+        post2 = create_post(user1, 'user1', '#aa', permission=k.PERM_PJUU)
+        post3 = create_post(user1, 'user1', 'Test',
+                            permission=k.PERM_APPROVED)
+        create_post(user1, 'user1', '#aa reply', post1)
+
+        def timeline(key):
+            return r.zrevrange(key, 0, -1)
+
+        self.assertEqual(timeline(k.GLOBAL_TIMELINE.format(k.PERM_PUBLIC)),
+                         [post1])
+        self.assertEqual(timeline(k.GLOBAL_TIMELINE.format(k.PERM_PJUU)),
+                         [post2, post1])
+        self.assertEqual(timeline(k.HASHTAG_TIMELINE.format('aa')),
+                         [post2, post1])
+        self.assertEqual(timeline(k.HASHTAG_TIMELINE.format('bb')), [post1])
+        self.assertFalse(r.exists(k.HASHTAG_TIMELINE.format('cc')))
+        self.assertNotIn(post3, timeline(k.GLOBAL_TIMELINE.format(
+            k.PERM_APPROVED)))
+
+        delete_post(post1)
+        self.assertEqual(timeline(k.GLOBAL_TIMELINE.format(k.PERM_PJUU)),
+                         [post2])
+        self.assertEqual(timeline(k.HASHTAG_TIMELINE.format('aa')), [post2])
+        self.assertEqual(timeline(k.HASHTAG_TIMELINE.format('bb')), [])
+
+    def test_reading_timelines(self):
+        """Ensure cold timelines fall back to MongoDB and are rebuilt, and
+        posts past the end of a timeline are still found.
+
+        """
+        app.config['TIMELINE_MAX_SIZE'] = 10
+
+        user1 = create_account('user1', 'user1@pjuu.com', 'Password')
+        for i in range(15):
+            create_post(user1, 'user1', 'Post {} #test'.format(i))
+        newest_first = [post.get('_id') for post in m.db.posts.find().sort(
+            [('created', -1), ('_id', -1)])]
+
+        # Redis lost everything
+        r.flushdb()
+
+        # The first read comes from MongoDB and rebuilds the timelines
+        self.assertEqual(
+            [post.get('_id') for post in get_global_feed(per_page=5).items],
+            newest_first[:5])
+        self.assertEqual(r.zcard(k.GLOBAL_TIMELINE.format(0)), 10)
+        self.assertTrue(r.exists(k.TIMELINE_BUILT.format(
+            k.GLOBAL_TIMELINE.format(0))))
+
+        for get_page in (lambda **kw: get_global_feed(**kw),
+                         lambda **kw: get_hashtagged_posts('test', **kw)):
+            seen = []
+            pagination = get_page(per_page=4)
+            while True:
+                seen.extend([post.get('_id') for post in pagination.items])
+                if pagination.next_cursor is None:
+                    break
+                pagination = get_page(
+                    per_page=4, after=decode_cursor(pagination.next_cursor))
+            self.assertEqual(seen, newest_first)
+
+        # Posts removed from MongoDB directly drop out of the timeline once
+        # they have left the post cache
+        m.db.posts.remove({'_id': newest_first[0]})
+        post_cache.invalidate(newest_first[0])
+        self.assertEqual(
+            [post.get('_id') for post in get_global_feed(per_page=5).items],
+            newest_first[1:5])
+        timeline = r.zrange(k.GLOBAL_TIMELINE.format(0), 0, -1)
+        self.assertNotIn(newest_first[0], timeline)
+
+        # The rebuild command puts everything back
+        r.flushdb()
+        self.assertEqual(rebuild_timelines(['test']), 3)
+        self.assertEqual(r.zrevrange(k.HASHTAG_TIMELINE.format('test'), 0, 3),
+                         newest_first[1:5])
+
+    def test_hashtag_timeline_expiry(self):
+        """Ensure hashtag timelines expire unless they are read."""
+        app.config['HASHTAG_TIMELINE_TTL'] = 100
+
+        user1 = create_account('user1', 'user1@pjuu.com', 'Password')
+        post1 = create_post(user1, 'user1', '#test')
+
+        key = k.HASHTAG_TIMELINE.format('test')
+        self.assertFalse(r.exists(key))
+
+        # Reading builds it with an expiry, the global timeline has none
+        self.assertEqual([post.get('_id') for post in
+                          get_hashtagged_posts('test').items], [post1])
+        self.assertEqual(r.zrange(key, 0, -1), [post1])
+        self.assertTrue(0 < r.ttl(key) <= 100)
+        self.assertTrue(0 < r.ttl(k.TIMELINE_BUILT.format(key)) <= 100)
+        self.assertEqual(r.ttl(k.GLOBAL_TIMELINE.format(k.PERM_PUBLIC)), -1)
+
+        # Reads keep it alive
+        r.expire(key, 10)
+        r.expire(k.TIMELINE_BUILT.format(key), 10)
+        get_hashtagged_posts('test')
+        self.assertTrue(10 < r.ttl(key) <= 100)
+
+        # An empty timeline which is written to gets the same expiry
+        get_hashtagged_posts('empty')
+        create_post(user1, 'user1', '#empty')
+        self.assertTrue(0 < r.ttl(k.HASHTAG_TIMELINE.format('empty')) <= 100)
+
+        # Once it has expired posts are read from MongoDB again
+        r.delete(key, k.TIMELINE_BUILT.format(key))
+        post2 = create_post(user1, 'user1', '#test')
+        self.assertFalse(r.exists(key))
+        self.assertEqual([post.get('_id') for post in
+                          get_hashtagged_posts('test').items], [post2, post1])
+
+        app.config['HASHTAG_TIMELINE_TTL'] = 86400
@@ -0,0 +1,83 @@
+# -*- coding: utf8 -*-
+
+"""Trending hashtag tests.
+
+:license: AGPL v3, see LICENSE for more details
+:copyright: 2014-2023 Joe Doherty
+
+"""
+
+# 3rd party imports
+from flask import current_app as app
+# Pjuu imports
+from pjuu import redis as r
+from pjuu.auth.backend import create_account
+from pjuu.lib import keys as k, timestamp
+from pjuu.lib.trending import count_hashtags, get_trending
+from pjuu.posts.backend import create_post, delete_post
+# Test imports
+from tests import BackendTestCase
+
+
+class TrendingTests(BackendTestCase):
+
+    def test_trending(self):
+        """Ensure hashtags are counted for the right levels and windows."""
+        user1 = create_account('user1', 'user1@pjuu.com', 'Password')
+
+        post1 = create_post(user1, 'user1', '#aa #aa #bb')
+        create_post(user1, 'user1', '#bb', permission=k.PERM_PJUU)
+        create_post(user1, 'user1', '#cc', permission=k.PERM_APPROVED)
+        create_post(user1, 'user1', '#dd reply', post1)
+
+        # A post made two hours ago only counts towards the day
+        count_hashtags({'hashtags': [{'hashtag': 'ee'}],
+                        'created': timestamp() - 7200})
+
+        self.assertEqual(get_trending(k.PERM_PUBLIC), [('bb', 1), ('aa', 1)])
+        self.assertEqual(get_trending(k.PERM_PJUU), [('bb', 2), ('aa', 1)])
+        self.assertEqual(get_trending(k.PERM_PJUU, 'day'),
+                         [('bb', 2), ('ee', 1), ('aa', 1)])
+        self.assertEqual(get_trending(k.PERM_PJUU, count=1), [('bb', 2)])
+
+        # Results are cached
+        delete_post(post1)
+        self.assertEqual(get_trending(k.PERM_PJUU), [('bb', 2), ('aa', 1)])
+
+        r.delete(k.TRENDING.format(k.PERM_PJUU, 'hour'))
+        self.assertEqual(get_trending(k.PERM_PJUU), [('bb', 1)])
+
+    def test_trending_trimmed(self):
+        """Ensure buckets only keep their most used hashtags."""
+        app.config['TRENDING_BUCKET_SIZE'] = 2
+        app.config['TRENDING_TRIM_SLACK'] = 0
+
+        now = timestamp()
+        for hashtag in ['a', 'a', 'b', 'c', 'd']:
+            count_hashtags({'hashtags': [{'hashtag': hashtag}],
+                            'created': now})
+
+        self.assertEqual(
+            r.zcard(k.TRENDING_BUCKET.format(k.PERM_PUBLIC, 'minute',
+                                             int(now // 60))), 2)
+        self.assertEqual(get_trending(k.PERM_PUBLIC)[0], ('a', 2))
+        self.assertTrue(0 < r.ttl(k.TRENDING_BUCKET.format(
+            k.PERM_PUBLIC, 'minute', int(now // 60))) <= 3660)
+
+        app.config['TRENDING_BUCKET_SIZE'] = 1000
+        app.config['TRENDING_TRIM_SLACK'] = 100
+
+    def test_trending_empty(self):
+        """Ensure a window without any hashtags is cached too."""
+        key = k.TRENDING.format(k.PERM_PUBLIC, 'hour')
+        self.assertEqual(get_trending(k.PERM_PUBLIC), [])
+        self.assertTrue(r.exists(key))
+        self.assertTrue(0 < r.ttl(key) <= 60)
+
+        # Until it expires new hashtags are not seen
+        count_hashtags({'hashtags': [{'hashtag': 'a'}],
+                        'created': timestamp()})
+        self.assertEqual(get_trending(k.PERM_PUBLIC), [])
+
+        r.delete(key)
+        self.assertEqual(get_trending(k.PERM_PUBLIC), [('a', 1)])
@@ -11,8 +11,8 @@ from flask import current_app as app
 
 from pjuu import mongo as m, redis as r
 from pjuu.auth.backend import create_account, delete_account, activate
-from pjuu.lib import keys as k
-from pjuu.lib.alerts import BaseAlert
+from pjuu.lib import keys as k, timestamp
+from pjuu.lib.alerts import AlertManager, BaseAlert
 from pjuu.posts.backend import create_post
 from pjuu.users.backend import (
     get_profile, search, is_following, get_following, get_followers,
@@ -381,7 +381,7 @@ class BackendTests(BackendTestCase):
         follow_user(user2, user1)
 
         # Check that i_has_alerts is True
-        self.assertTrue(new_alerts(user1))
+        self.assertEqual(new_alerts(user1), 1)
 
         # Ensure that there is an alert in the get_alerts
         self.assertEqual(get_alerts(user1).total, 1)
@@ -476,6 +476,44 @@ class BackendTests(BackendTestCase):
         self.assertEqual(len(get_alerts(user1, per_page=50).items), 50)
         self.assertEqual(len(get_alerts(user1, per_page=100).items), 100)
 
+    def test_unread_alerts(self):
+        """Ensure a lost unread count is counted again and alerts which can
+        not be shown are taken off it.
+
+        """
+        user1 = create_account('user1', 'user1@pjuu.com', 'Password')
+        user2 = create_account('user2', 'user2@pjuu.com', 'Password')
+        user3 = create_account('user3', 'user3@pjuu.com', 'Password')
+        user4 = create_account('user4', 'user4@pjuu.com', 'Password')
+
+        follow_user(user2, user1)
+        follow_user(user3, user1)
+        self.assertEqual(new_alerts(user1), 2)
+
+        # Redis lost the count, it is counted from the users alerts
+        r.delete(k.USER_ALERTS_UNREAD.format(user1))
+        self.assertEqual(new_alerts(user1), 2)
+
+        get_alerts(user1)
+        r.delete(k.USER_ALERTS_UNREAD.format(user1))
+        self.assertEqual(new_alerts(user1), 0)
+
+        # An alert which no longer loads is taken off the count
+        follow_user(user4, user1)
+        self.assertEqual(new_alerts(user1), 1)
+        aid = r.zrevrange(k.USER_ALERTS.format(user1), 0, 0)[0]
+        r.delete(k.ALERT.format(aid))
+        self.assertEqual(AlertManager().get_many([aid], user1), [])
+        self.assertEqual(new_alerts(user1), 0)
+        self.assertEqual(r.zcard(k.USER_ALERTS.format(user1)), 2)
+
+        # Old alerts which are dropped do not touch the count
+        aid = r.zrevrange(k.USER_ALERTS.format(user1), 0, 0)[0]
+        r.delete(k.ALERT.format(aid))
+        r.set(k.USER_ALERTS_UNREAD.format(user1), 1)
+        self.assertEqual(AlertManager().get_many([aid], user1), [])
+        self.assertEqual(new_alerts(user1), 1)
+
     def test_get_trusted(self):
         user1 = create_account('user1', 'user1@pjuu.com', 'Password')
         activate(user1)
@@ -499,5 +537,14 @@ class BackendTests(BackendTestCase):
         # Test per page
         trusted_pagination = get_trusted(user1, per_page=10)
         self.assertEqual(trusted_pagination.total, 50)
-        # The answer is 5 because of the self cleaning action
-        self.assertEqual(len(trusted_pagination.items), 5)
+        # Deleted users are removed from the trusted set straight away
+        self.assertEqual(len(trusted_pagination.items), 10)
+
+        # Users which no longer exist are cleaned from the trusted set, not
+        # the followers set
+        r.zadd(k.USER_APPROVED.format(user1), {'missing': timestamp()})
+        r.zadd(k.USER_FOLLOWERS.format(user1), {'missing': timestamp()})
+        self.assertEqual(get_trusted(user1, per_page=10).total, 50)
+        self.assertIsNone(r.zscore(k.USER_APPROVED.format(user1), 'missing'))
+        self.assertIsNotNone(r.zscore(k.USER_FOLLOWERS.format(user1),
+                                      'missing'))
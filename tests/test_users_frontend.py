@@ -613,6 +613,13 @@ class FrontendTests(FrontendTestCase):
         self.assertEqual(
             json.loads(resp.get_data(as_text=True)).get('new_alerts'), 1)
 
+        # Polling again with the ETag is an empty 304 until the count changes
+        etag = resp.headers.get('ETag')
+        resp = self.client.get(url_for('users.new_alerts'),
+                               headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.get_data(as_text=True), '')
+
         # Ensure the count goes up correctly
         follow_user(user3, user1)
 
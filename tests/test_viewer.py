@@ -0,0 +1,71 @@
+# -*- coding: utf8 -*-
+
+"""Viewer state prefetch tests.
+
+:license: AGPL v3, see LICENSE for more details
+:copyright: 2014-2023 Joe Doherty
+
+"""
+
+# Pjuu imports
+from pjuu.auth.backend import create_account
+from pjuu.auth.utils import get_user
+from pjuu.lib.viewer import get_viewer_state, prefetch_viewer_state
+from pjuu.posts.backend import (create_post, flag_post, get_post,
+                                has_voted, vote_post)
+from pjuu.users.backend import approve_user, follow_user
+# Test imports
+from tests import BackendTestCase
+
+
+class ViewerTests(BackendTestCase):
+
+    def test_prefetch_viewer_state(self):
+        """Ensure the prefetched state matches what the backend says."""
+        user1 = create_account('user1', 'user1@pjuu.com', 'Password')
+        user2 = create_account('user2', 'user2@pjuu.com', 'Password')
+        user3 = create_account('user3', 'user3@pjuu.com', 'Password')
+
+        post1 = create_post(user1, 'user1', 'Test post')
+        post2 = create_post(user1, 'user1', 'Test post')
+        reply1 = create_post(user2, 'user2', 'Test reply', post1)
+
+        vote_post(user2, post1, amount=-1)
+        flag_post(user2, post2)
+        follow_user(user2, user1)
+        follow_user(user3, user2)
+        approve_user(user2, user3)
+
+        items = [get_post(post1), get_post(post2), get_post(reply1),
+                 get_user(user1), get_user(user3), None]
+        self.assertIs(prefetch_viewer_state(user2, items), items)
+
+        self.assertEqual(items[0].get('viewer_state'), {
+            'voted': has_voted(user2, post1),
+            'subscribed': True,
+            'flagged': False
+        })
+        self.assertLess(get_viewer_state(items[0], 'voted'), 0)
+        self.assertEqual(items[1].get('viewer_state'), {
+            'voted': 0,
+            'subscribed': False,
+            'flagged': True
+        })
+        self.assertFalse(get_viewer_state(items[2], 'subscribed'))
+
+        self.assertEqual(items[3].get('viewer_state'), {
+            'following': True,
+            'follower': False,
+            'trusted': False
+        })
+        self.assertEqual(items[4].get('viewer_state'), {
+            'following': False,
+            'follower': True,
+            'trusted': True
+        })
+
+        # Nothing is prefetched without a viewer, the filters will ask Redis
+        post = get_post(post1)
+        prefetch_viewer_state(None, [post])
+        self.assertIsNone(get_viewer_state(post, 'voted'))
+        self.assertIsNone(get_viewer_state(post1, 'voted'))